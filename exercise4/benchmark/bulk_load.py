@@ -0,0 +1,64 @@
+'''
+Rows per second when 100000 messages are loaded from an SQL dump of INSERT
+statements with Engine.populate_tables, versus from CSV and JSON Lines
+files with Engine.bulk_load.
+'''
+
+import csv, json, os, time
+
+from benchmark.utils import create_engine, remove_engine
+
+MESSAGES = 100000
+COLUMNS = ('message_id', 'title', 'body', 'timestamp', 'ip', 'timesviewed',
+           'reply_to', 'user_nickname', 'user_id')
+
+
+def messages():
+    #Every tenth message replies to the previous one
+    for i in xrange(1000, 1000 + MESSAGES):
+        yield (i, 'Message %d' % i, 'x' * 200, 1400000000 + i, '0.0.0.0', 0,
+               i - 1 if i % 10 == 1 else None, 'AxelW', 2)
+
+
+def write_files(folder):
+    paths = dict((name, os.path.join(folder, 'messages.' + name))
+                 for name in ('sql', 'csv', 'jsonl'))
+    with open(paths['sql'], 'wb') as f:
+        for row in messages():
+            f.write('INSERT INTO "messages" VALUES(%s);\n' % ','.join(
+                'NULL' if value is None else
+                "'%s'" % value if isinstance(value, str) else str(value)
+                for value in row + (None,)))
+    with open(paths['csv'], 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(['' if value is None else value for value in row]
+                         for row in messages())
+    with open(paths['jsonl'], 'wb') as f:
+        for row in messages():
+            f.write(json.dumps(dict(zip(COLUMNS, row))) + '\n')
+    return paths
+
+
+def main():
+    engine = create_engine()
+    folder = os.path.dirname(engine.db_path)
+    paths = write_files(folder)
+    try:
+        print '%d messages' % MESSAGES
+        start = time.time()
+        engine.populate_tables(paths['sql'])
+        seconds = time.time() - start
+        print '  %-45s %12.0f rows/s' % ('populate_tables, SQL dump',
+                                         MESSAGES / seconds)
+        for name in ('csv', 'jsonl'):
+            engine.clear()
+            engine.populate_tables()
+            report = engine.bulk_load({'messages': paths[name]})
+            print '  %-45s %12.0f rows/s' % ('bulk_load, ' + name,
+                                             report['rows_per_second'])
+    finally:
+        remove_engine(engine)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+'''
+Cost of serialising the Collection+JSON and HAL envelopes of the resources
+with every JSON encoder of forum.render that is installed, to a string and
+into a byte buffer.
+'''
+
+import io
+
+from forum import render
+
+from benchmark.rendering import messages_envelope, message_envelope, \
+    restricted_envelope
+from benchmark.utils import measure, report
+
+
+def main():
+    envelopes = (('Messages, page of 50', messages_envelope()),
+                 ('Message', message_envelope()),
+                 ('User_restricted', restricted_envelope()))
+    default = render.ENCODER
+    available = render.available_encoders()
+    results = []
+    try:
+        for name in available:
+            render.use_encoder(name)
+            for label, envelope in envelopes:
+                def into_buffer():
+                    render.dump(envelope, io.BytesIO())
+                results.append(('%s, %s' % (label, name),
+                                measure(lambda: render.dumps(envelope), 20000)))
+                results.append(('%s, %s, into a buffer' % (label, name),
+                                measure(into_buffer, 20000)))
+    finally:
+        render.use_encoder(default)
+    missing = [name for name in render.ENCODERS if name not in available]
+    report('Serialisation of the envelopes (not installed: %s)' %
+           (', '.join(missing) or 'none'), results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+'''
+Message ids on a database with millions of messages: cost of parsing an id
+with the precompiled parser versus the re.match call it replaced, and of
+reading the first and the last message by id. Seeding the database takes a
+couple of minutes.
+'''
+
+import re
+
+from forum import database
+
+from benchmark.utils import create_engine, remove_engine, seed_messages, \
+    measure, report
+
+ROWS = 2000000
+
+
+def main():
+    engine = create_engine(wal=True)
+    try:
+        seed_messages(engine, ROWS, body_size=20)
+        connection = engine.connect()
+        try:
+            cur = connection.con.execute('SELECT MAX(message_id) \
+                                          FROM messages')
+            last = 'msg-%d' % cur.fetchone()[0]
+            results = [
+                ('re.match msg-(\\d{1,3}), %s' % last,
+                 measure(lambda: int(re.match(r'msg-(\d{1,3})',
+                                              last).group(1)), 200000)),
+                ('parse_message_id, %s' % last,
+                 measure(lambda: database.parse_message_id(last), 200000)),
+                ('get_message msg-1',
+                 measure(lambda: connection.get_message('msg-1'), 20000)),
+                ('get_message %s' % last,
+                 measure(lambda: connection.get_message(last), 20000))]
+        finally:
+            connection.close()
+    finally:
+        engine.stop_checkpointer()
+        remove_engine(engine)
+    report('Message ids, %d messages' % ROWS, results)
+
+if __name__ == '__main__':
+    main()
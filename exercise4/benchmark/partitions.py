@@ -0,0 +1,82 @@
+'''
+Message lists of a database with hundreds of thousands of messages, all of
+them in the main file versus the oldest ones moved to partitions with
+Engine.create_partition. The windows of recent messages read only the main
+file, the windows of old messages only one partition and the first page of
+the list merges all of them.
+'''
+
+import os
+
+from benchmark.utils import create_engine, remove_engine, seed_messages, \
+    measure, report
+
+ROWS = 400000
+PARTITIONS = 4
+#Seconds of each partition. seed_messages creates a message per second
+#from FIRST.
+SPAN = 80000
+FIRST = 1400000000
+
+
+def run(connection):
+    '''
+    :return: a list of (label, microseconds per call) tuples.
+    '''
+    recent = FIRST + ROWS - SPAN / 2
+    old = FIRST + SPAN / 2
+    return [
+        ('first page, 20', measure(
+            lambda: connection.get_messages(number_of_messages=20), 2000)),
+        ('recent window, 20', measure(
+            lambda: connection.get_messages(number_of_messages=20,
+                                            before=recent + 100,
+                                            after=recent), 2000)),
+        ('old window, 20', measure(
+            lambda: connection.get_messages(number_of_messages=20,
+                                            before=old + 100, after=old),
+            2000)),
+        ('history of AxelW, old window', measure(
+            lambda: connection.get_messages('AxelW', 20, old + 300, old),
+            2000)),
+        ('get_message of an old message', measure(
+            lambda: connection.get_message('msg-100'), 2000))]
+
+
+def main():
+    engine = create_engine(wal=True)
+    try:
+        seed_messages(engine, ROWS, body_size=200)
+        engine.checkpoint('TRUNCATE')
+        sizes = [os.path.getsize(engine.db_path)]
+        connection = engine.connect(read_only=True)
+        try:
+            single = run(connection)
+        finally:
+            connection.close()
+        for i in xrange(PARTITIONS):
+            engine.create_partition('p%d' % i, FIRST + i * SPAN,
+                                    FIRST + (i + 1) * SPAN)
+        #The pages freed by the moved messages are reused by the new ones
+        con = engine.connect().con
+        try:
+            con.execute('VACUUM')
+        finally:
+            con.close()
+        engine.checkpoint('TRUNCATE')
+        sizes.append(os.path.getsize(engine.db_path))
+        connection = engine.connect(read_only=True)
+        try:
+            partitioned = run(connection)
+        finally:
+            connection.close()
+    finally:
+        engine.stop_checkpointer()
+        remove_engine(engine)
+    print 'Main file: %.1f MB, %.1f MB with %d partitions' % (
+        sizes[0] / 1e6, sizes[1] / 1e6, PARTITIONS)
+    report('Single file, %d messages' % ROWS, single)
+    report('%d partitions of %d messages' % (PARTITIONS, SPAN), partitioned)
+
+if __name__ == '__main__':
+    main()
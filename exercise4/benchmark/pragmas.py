@@ -0,0 +1,44 @@
+'''
+Compares the cost of the database API when PRAGMA foreign_keys is executed
+before every statement with the cost when PRAGMAs are applied once at the
+time the connection is opened.
+'''
+
+from benchmark.utils import create_engine, remove_engine, measure, report
+
+CALLS = 20000
+
+
+def main():
+    engine = create_engine()
+    connection = engine.connect()
+    try:
+        def get_message():
+            connection.get_message('msg-1')
+
+        def get_message_with_pragma():
+            connection.set_foreign_keys_support()
+            connection.get_message('msg-1')
+
+        def get_user_id():
+            connection.get_user_id('AxelW')
+
+        def get_user_id_with_pragma():
+            connection.set_foreign_keys_support()
+            connection.get_user_id('AxelW')
+
+        report('PRAGMA foreign_keys per call vs per connection', [
+            ('get_message, PRAGMA per call', measure(get_message_with_pragma,
+                                                     CALLS)),
+            ('get_message, PRAGMA per connection', measure(get_message,
+                                                           CALLS)),
+            ('get_user_id, PRAGMA per call', measure(get_user_id_with_pragma,
+                                                     CALLS)),
+            ('get_user_id, PRAGMA per connection', measure(get_user_id,
+                                                           CALLS))])
+    finally:
+        connection.close()
+        remove_engine(engine)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+'''
+Throughput of the development server (werkzeug run_simple, one process)
+versus the pre-forking server of forum.prefork. Several client processes
+fetch a message and the history of a user over keep-alive-less HTTP
+connections during a fixed time.
+'''
+
+import httplib, imp, multiprocessing, os, signal, time
+
+from benchmark.utils import create_engine, remove_engine
+
+CLIENTS = 8
+WORKERS = 4
+DURATION = 3
+HOST = 'localhost'
+PORT = 5123
+PATHS = ('/forum/api/messages/msg-1/',
+         '/forum/api/users/AxelW/history/')
+
+
+def _serve(db_path, prefork):
+    #Child process: never returns. The forum package hides forum.py
+    forum = imp.load_source('forum_main', 'forum.py')
+    from werkzeug.serving import run_simple
+    if prefork:
+        forum.serve_prefork(HOST, PORT, WORKERS, 0, db_path)
+    else:
+        run_simple(HOST, PORT, forum.create_application(db_path, debug=False))
+    os._exit(0)
+
+
+def _client(counter, errors, deadline):
+    done = failed = 0
+    while time.time() < deadline:
+        for path in PATHS:
+            try:
+                con = httplib.HTTPConnection(HOST, PORT)
+                con.request('GET', path)
+                response = con.getresponse()
+                response.read()
+                con.close()
+                if response.status == 200:
+                    done += 1
+                else:
+                    failed += 1
+            except Exception:
+                failed += 1
+    with counter.get_lock():
+        counter.value += done
+    with errors.get_lock():
+        errors.value += failed
+
+
+def _wait_listening(timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            con = httplib.HTTPConnection(HOST, PORT)
+            con.request('GET', PATHS[0])
+            con.getresponse().read()
+            con.close()
+            return
+        except Exception:
+            time.sleep(0.1)
+    raise RuntimeError('The server did not start')
+
+
+def run(db_path, prefork):
+    '''
+    :return: a tuple (requests per second, failed requests)
+    '''
+    pid = os.fork()
+    if pid == 0:
+        _serve(db_path, prefork)
+    try:
+        _wait_listening()
+        counter = multiprocessing.Value('l', 0)
+        errors = multiprocessing.Value('l', 0)
+        deadline = time.time() + DURATION
+        clients = [multiprocessing.Process(target=_client,
+                                           args=(counter, errors, deadline))
+                   for _ in range(CLIENTS)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    return counter.value / float(DURATION), errors.value
+
+
+def main():
+    print '%d client processes during %d seconds' % (CLIENTS, DURATION)
+    engine = create_engine(wal=True)
+    try:
+        db_path = engine.db_path
+        for label, prefork in (('run_simple', False),
+                               ('prefork, %d workers' % WORKERS, True)):
+            requests, errors = run(db_path, prefork)
+            print '  %-25s %10.1f requests/s %6d errors' % (label, requests,
+                                                            errors)
+    finally:
+        engine.stop_checkpointer()
+        remove_engine(engine)
+
+if __name__ == '__main__':
+    main()
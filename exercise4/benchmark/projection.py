@@ -0,0 +1,52 @@
+'''
+Cost of the message lists when every column is selected (SELECT *) versus
+when only the columns of a list item are selected, which lets SQLite answer
+from the covering list indexes without reading the message bodies.
+'''
+
+from forum import database
+
+from benchmark.utils import create_engine, remove_engine, seed_messages, \
+    measure, report
+
+MESSAGES = 20000
+BODY_SIZE = 4096
+
+
+def main():
+    engine = create_engine()
+    seed_messages(engine, MESSAGES, BODY_SIZE)
+    connection = engine.connect()
+    try:
+        def full_rows(**kwargs):
+            query, pvalue = connection._messages_query(**kwargs)
+            query = query.replace(database.MESSAGE_LIST_COLUMNS, '*', 1)
+
+            def run():
+                cur = connection.con.execute(query, pvalue)
+                [connection._create_message_list_object(row)
+                 for row in cur.fetchall()]
+            return run
+
+        def projected(**kwargs):
+            return lambda: connection.get_messages(**kwargs)
+
+        connection.con.row_factory = database.sqlite3.Row
+        results = []
+        for label, kwargs, number in (
+                ('Messages, page of 50', {'number_of_messages': 50}, 2000),
+                ('History, all messages of a user', {'nickname': 'AxelW'},
+                 10),
+                ('All messages', {}, 5)):
+            results.append((label + ', SELECT *',
+                            measure(full_rows(**kwargs), number)))
+            results.append((label + ', projected',
+                            measure(projected(**kwargs), number)))
+        report('%d messages with %d byte bodies' % (MESSAGES, BODY_SIZE),
+               results)
+    finally:
+        connection.close()
+        remove_engine(engine)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Concurrent read/write throughput of the pooled connections: every thread
+borrowing from one pool of read-write connections versus the readers
+borrowing read-only connections from the read pool and the writers sharing
+the only read-write connection. Both Engines work in WAL mode.
+'''
+
+import threading, time
+
+from benchmark.utils import create_engine, remove_engine
+
+READERS = 4
+WRITERS = 2
+DURATION = 3
+
+
+def run(engine, read_only):
+    '''
+    :return: a tuple (reads per second, writes per second, failed operations)
+    '''
+    stop = threading.Event()
+    counters = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def work(operation, counter, read_only):
+        done = errors = 0
+        while not stop.is_set():
+            try:
+                connection = engine.acquire(read_only)
+                try:
+                    operation(connection)
+                finally:
+                    engine.release(connection)
+                done += 1
+            except Exception:
+                errors += 1
+        with lock:
+            counters[counter] += done
+            counters['errors'] += errors
+
+    def read(connection):
+        connection.get_message('msg-1')
+        connection.get_messages(number_of_messages=20)
+
+    def write(connection):
+        connection.create_message('Benchmark', 'Benchmark body', 'AxelW')
+
+    threads = [threading.Thread(target=work, args=(read, 'reads', read_only))
+               for _ in range(READERS)]
+    threads.extend(threading.Thread(target=work,
+                                    args=(write, 'writes', False))
+                   for _ in range(WRITERS))
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return (counters['reads'] / float(DURATION),
+            counters['writes'] / float(DURATION), counters['errors'])
+
+
+def main():
+    print '%d readers + %d writers during %d seconds' % (READERS, WRITERS,
+                                                         DURATION)
+    for label, options, read_only in (
+            ('read-write pool of %d' % (READERS + WRITERS),
+             {'pool_size': READERS + WRITERS}, False),
+            ('read pool + 1 writer', {'read_pool_size': READERS}, True)):
+        engine = create_engine(wal=True, **options)
+        try:
+            reads, writes, errors = run(engine, read_only)
+        finally:
+            engine.stop_checkpointer()
+            remove_engine(engine)
+        print '  %-25s %10.1f reads/s %10.1f writes/s %6d errors' % (
+            label, reads, writes, errors)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''
+Cost of serialising the envelopes of the resources when the constant parts
+(templates, curies, queries) are serialised in every response versus when
+they are pre-serialised fragments of forum.render.
+
+The expanded envelopes are built once, so the cost of creating the constant
+dictionaries in every request, which the fragments also avoid, is not
+included.
+'''
+
+import json
+
+from forum import render, resources
+
+from benchmark.utils import measure, report
+
+
+def expand(value):
+    '''
+    :return: ``value`` with the fragments replaced by the values they
+        serialise.
+    '''
+    if isinstance(value, render.Fragment):
+        return json.loads(value.json)
+    if isinstance(value, dict):
+        return dict((key, expand(member)) for key, member in value.iteritems())
+    return value
+
+
+def messages_envelope(length=50):
+    href = '/forum/api/messages/'
+    items = [{'href': href + 'msg-%d/' % i,
+              'data': [{'name': 'headline', 'value': 'Message %d' % i}],
+              'links': []} for i in xrange(length)]
+    return {'collection': {
+        'version': '1.0', 'href': href,
+        'links': [{'prompt': 'List of all users in the Forum',
+                   'rel': 'users-all', 'href': '/forum/api/users/'}],
+        'template': resources.MESSAGE_TEMPLATE, 'items': items}}
+
+
+def message_envelope():
+    href = '/forum/api/messages/msg-1/'
+    link = {'href': href, 'profile': resources.FORUM_MESSAGE_PROFILE}
+    return {'_links': {'curies': resources.MESSAGE_CURIES, 'self': link,
+                       'msg:edit': link, 'msg:delete': link,
+                       'msg:reply': link, 'collection': link,
+                       'msg:author': link, 'atom-thread:in-reply-to': link},
+            'template': resources.MESSAGE_TEMPLATE,
+            'articleBody': 'x' * 200, 'headline': 'Message 1',
+            'author': 'AxelW', 'editor': None}
+
+
+def restricted_envelope():
+    href = '/forum/api/users/AxelW/restricted_profile/'
+    link = {'href': href, 'profile': resources.FORUM_USER_PROFILE}
+    envelope = {'_links': {'curies': resources.USER_CURIES, 'self': link,
+                           'user:parent': link, 'user:public-data': link,
+                           'user:edit': link, 'user:messages': link},
+                'template': resources.USER_RESTRICTED_TEMPLATE}
+    for name in ('nickname', 'address', 'birthday', 'email', 'familyName',
+                 'gender', 'givenName', 'website', 'telephone', 'skype',
+                 'image'):
+        envelope[name] = name + ' value'
+    return envelope
+
+
+def main():
+    results = []
+    for label, envelope in (('Messages, page of 50', messages_envelope()),
+                            ('Message', message_envelope()),
+                            ('User_restricted', restricted_envelope())):
+        expanded = expand(envelope)
+        assert json.loads(render.dumps(envelope)) == json.loads(
+            json.dumps(expanded))
+        results.append((label + ', json.dumps',
+                        measure(lambda: json.dumps(expanded), 20000)))
+        results.append((label + ', fragments',
+                        measure(lambda: render.dumps(envelope), 20000)))
+    report('Serialisation of the envelopes', results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+'''
+Time to the first byte of the body of the History of a user with many
+messages, when it is streamed, compared to the time to the whole body,
+which is what a client waited for before the body was streamed.
+'''
+
+from forum import resources
+
+from benchmark.utils import create_engine, remove_engine, seed_messages, \
+    measure, report
+
+MESSAGES = 60000
+
+
+def main():
+    engine = create_engine()
+    seed_messages(engine, MESSAGES)
+    resources.app.config['Engine'] = engine
+    client = resources.app.test_client()
+    url = '/forum/api/users/AxelW/history/'
+    try:
+        def first_chunk():
+            response = client.get(url)
+            try:
+                next(iter(response.response))
+            finally:
+                response.close()
+
+        def whole_body():
+            response = client.get(url)
+            try:
+                ''.join(response.response)
+            finally:
+                response.close()
+
+        report('History of a user with %d messages' % (MESSAGES / 3),
+               [('Time to the first byte', measure(first_chunk, 20)),
+                ('Time to the whole body', measure(whole_body, 2))])
+    finally:
+        remove_engine(engine)
+
+if __name__ == '__main__':
+    main()
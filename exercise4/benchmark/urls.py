@@ -0,0 +1,42 @@
+'''
+Cost of GET Users with 10000 users when the hrefs of the items are built
+with api.url_for, which walks the werkzeug URL map, versus when they are
+built from the URL templates of forum.resources.build_url.
+'''
+
+from forum import resources
+
+from benchmark.utils import create_engine, remove_engine, seed_users, \
+    measure, report
+
+USERS = 10000
+
+
+def main():
+    engine = create_engine()
+    seed_users(engine, USERS)
+    resources.app.config['Engine'] = engine
+    client = resources.app.test_client()
+    build_url = resources.build_url
+
+    def get_users():
+        response = client.get('/forum/api/users/')
+        try:
+            ''.join(response.response)
+        finally:
+            response.close()
+
+    try:
+        results = []
+        resources.build_url = lambda resource, **values: \
+            resources.api.url_for(resource, **values)
+        results.append(('GET Users, api.url_for', measure(get_users, 3)))
+        resources.build_url = build_url
+        results.append(('GET Users, URL templates', measure(get_users, 3)))
+        report('%d users' % USERS, results)
+    finally:
+        resources.build_url = build_url
+        remove_engine(engine)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+'''
+Helpers shared by the benchmarks. Run them from the exercise folder, e.g.:
+
+    python -m benchmark.pragmas
+'''
+
+import os, shutil, tempfile, timeit
+
+from forum import database
+
+
+def create_engine(**kwargs):
+    '''
+    Creates a populated database in a temporary folder.
+
+    :return: the :py:class:`forum.database.Engine` pointing to the new file.
+        Call :py:func:`remove_engine` once the benchmark is finished.
+    '''
+    folder = tempfile.mkdtemp(prefix='forum_bench_')
+    engine = database.Engine(os.path.join(folder, 'forum.db'), **kwargs)
+    engine.create_tables()
+    engine.populate_tables()
+    return engine
+
+
+def remove_engine(engine):
+    '''Removes the temporary folder created by :py:func:`create_engine`'''
+    engine.dispose()
+    shutil.rmtree(os.path.dirname(engine.db_path), ignore_errors=True)
+
+
+def measure(function, number, repeat=5):
+    '''
+    :return: the best time per call of ``function``, in microseconds.
+    '''
+    best = min(timeit.repeat(function, number=number, repeat=repeat))
+    return best / number * 1e6
+
+
+def report(title, results):
+    '''Prints a table of (label, microseconds per call) tuples.'''
+    print title
+    for label, value in results:
+        print '  %-45s %12.2f us/call' % (label, value)
+
+
+def seed_messages(engine, count, body_size=200, users=('AxelW', 'Mystery',
+                                                       'Koodari')):
+    '''
+    Inserts ``count`` messages with bodies of ``body_size`` characters,
+    spread among ``users`` and one second apart.
+    '''
+    body = 'x' * body_size
+    con = engine.connect().con
+    try:
+        with con:
+            con.executemany(
+                'INSERT INTO messages (title, body, timestamp, ip, \
+                 timesviewed, reply_to, user_nickname, user_id) \
+                 VALUES (?, ?, ?, ?, 0, NULL, ?, NULL)',
+                (('Message %d' % i, body, 1400000000 + i, '0.0.0.0',
+                  users[i % len(users)]) for i in xrange(count)))
+    finally:
+        con.close()
+
+
+def seed_users(engine, count):
+    '''
+    Inserts ``count`` users, with empty profiles, named ``User<n>``.
+    '''
+    con = engine.connect().con
+    try:
+        with con:
+            cur = con.execute('SELECT COALESCE(MAX(user_id), 0) FROM users')
+            first = cur.fetchone()[0] + 1
+            ids = xrange(first, first + count)
+            con.executemany(
+                'INSERT INTO users (user_id, nickname, regDate, lastLogin, \
+                 timesviewed) VALUES (?, ?, ?, ?, 0)',
+                ((i, 'User%d' % i, 1400000000 + i, 1400000000 + i)
+                 for i in ids))
+            con.executemany('INSERT INTO users_profile (user_id) VALUES (?)',
+                            ((i,) for i in ids))
+    finally:
+        con.close()
@@ -0,0 +1,72 @@
+'''
+Concurrent read/write throughput of the rollback journal versus the WAL
+mode. Several reader threads fetch a message while one writer thread
+creates messages, each thread with its own connection.
+'''
+
+import threading, time
+
+from benchmark.utils import create_engine, remove_engine
+
+READERS = 4
+DURATION = 3
+
+
+def run(engine):
+    '''
+    :return: a tuple (reads per second, writes per second, failed operations)
+    '''
+    stop = threading.Event()
+    counters = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def work(operation, counter):
+        connection = engine.connect()
+        done = errors = 0
+        try:
+            while not stop.is_set():
+                try:
+                    operation(connection)
+                    done += 1
+                except Exception:
+                    errors += 1
+        finally:
+            connection.close()
+        with lock:
+            counters[counter] += done
+            counters['errors'] += errors
+
+    def read(connection):
+        connection.get_message('msg-1')
+
+    def write(connection):
+        connection.create_message('Benchmark', 'Benchmark body', 'AxelW')
+
+    threads = [threading.Thread(target=work, args=(read, 'reads'))
+               for _ in range(READERS)]
+    threads.append(threading.Thread(target=work, args=(write, 'writes')))
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return (counters['reads'] / float(DURATION),
+            counters['writes'] / float(DURATION), counters['errors'])
+
+
+def main():
+    print '%d readers + 1 writer during %d seconds' % (READERS, DURATION)
+    for label, options in (('rollback journal', {}),
+                           ('WAL', {'wal': True})):
+        engine = create_engine(**options)
+        try:
+            reads, writes, errors = run(engine)
+        finally:
+            engine.stop_checkpointer()
+            remove_engine(engine)
+        print '  %-20s %10.1f reads/s %10.1f writes/s %6d errors' % (
+            label, reads, writes, errors)
+
+if __name__ == '__main__':
+    main()
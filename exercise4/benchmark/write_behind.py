@@ -0,0 +1,107 @@
+'''
+Durability/throughput trade-off of the write modes. Several threads create
+messages during a fixed time:
+
+* commit per write: each thread with its own connection, every write
+  commits (and syncs) by itself.
+* write-behind: the writes are submitted to the writer thread of the Engine
+  and each thread waits until its write is committed. The commits are
+  shared by the writes of a group, so a write is as durable as before.
+* write-behind, no wait: the threads do not wait for the commit. The
+  writes of the last group are lost if the process crashes.
+
+Each mode runs with the rollback journal (synchronous FULL, a sync per
+commit) and in WAL mode (synchronous NORMAL, commits are not synced).
+'''
+
+import threading, time
+
+from benchmark.utils import create_engine, remove_engine
+
+WRITERS = 8
+DURATION = 3
+BATCH_SIZES = (8, 64)
+
+
+def run(engine, submit, wait):
+    '''
+    :return: a tuple (writes per second, mean milliseconds per write,
+        failed writes)
+    '''
+    stop = threading.Event()
+    counters = {'writes': 0, 'seconds': 0.0, 'errors': 0}
+    lock = threading.Lock()
+
+    def work():
+        connection = None if submit else engine.connect()
+        done = errors = 0
+        futures = []
+        start = time.time()
+        try:
+            while not stop.is_set():
+                try:
+                    if not submit:
+                        connection.create_message('Benchmark', 'Body',
+                                                  'AxelW')
+                    elif wait:
+                        engine.submit('create_message', 'Benchmark', 'Body',
+                                      'AxelW').result()
+                    else:
+                        futures.append(engine.submit('create_message',
+                                                     'Benchmark', 'Body',
+                                                     'AxelW'))
+                        continue
+                    done += 1
+                except Exception:
+                    errors += 1
+            for future in futures:
+                try:
+                    future.result()
+                    done += 1
+                except Exception:
+                    errors += 1
+        finally:
+            if connection is not None:
+                connection.close()
+        with lock:
+            counters['writes'] += done
+            counters['errors'] += errors
+            counters['seconds'] += time.time() - start
+
+    threads = [threading.Thread(target=work) for _ in range(WRITERS)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    writes = counters['writes'] or 1
+    return (counters['writes'] / elapsed,
+            counters['seconds'] / writes * 1000, counters['errors'])
+
+
+def main():
+    print '%d writer threads during %d seconds' % (WRITERS, DURATION)
+    modes = [('commit per write', {}, False, True)]
+    for size in BATCH_SIZES:
+        modes.append(('write-behind, batch %d' % size,
+                      {'write_batch_size': size}, True, True))
+    modes.append(('write-behind, no wait', {}, True, False))
+    for journal, options in (('rollback journal', {}),
+                             ('WAL', {'wal': True})):
+        print journal
+        for label, mode_options, submit, wait in modes:
+            engine = create_engine(**dict(options, **mode_options))
+            try:
+                writes, latency, errors = run(engine, submit, wait)
+            finally:
+                engine.stop_writer()
+                engine.stop_checkpointer()
+                remove_engine(engine)
+            print '  %-25s %10.1f writes/s %8.2f ms/write %6d errors' % (
+                label, writes, latency, errors)
+
+if __name__ == '__main__':
+    main()
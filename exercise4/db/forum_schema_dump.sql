@@ -52,6 +52,133 @@ CREATE TABLE IF NOT EXISTS messages(
   editor_nickname TEXT,
   FOREIGN KEY(reply_to) REFERENCES messages(message_id) ON DELETE CASCADE,
   FOREIGN KEY(user_id,user_nickname) REFERENCES users(user_id, nickname) ON DELETE SET NULL);
+/*
+Indexes for the message and user lookups. Keep them in sync with INDEXES in
+forum/database.py. users(nickname) is already indexed by its UNIQUE
+constraint. The list indexes cover the columns read by the message and user
+lists.
+*/
+CREATE INDEX IF NOT EXISTS messages_user_list_idx
+  ON messages(user_nickname, timestamp, message_id, title);
+CREATE INDEX IF NOT EXISTS messages_list_idx
+  ON messages(timestamp, message_id, user_nickname, title);
+CREATE INDEX IF NOT EXISTS messages_reply_to_idx ON messages(reply_to);
+CREATE INDEX IF NOT EXISTS users_list_idx ON users(regDate, nickname);
+/*
+Full-text search index of the messages, kept in sync by triggers. Keep it
+in sync with SEARCH_INDEX in forum/database.py.
+*/
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(title, body,
+  content='messages', content_rowid='message_id');
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+BEGIN
+  INSERT INTO messages_fts(rowid, title, body)
+  VALUES (new.message_id, new.title, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+BEGIN
+  INSERT INTO messages_fts(messages_fts, rowid, title, body)
+  VALUES ('delete', old.message_id, old.title, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF title, body
+  ON messages
+BEGIN
+  INSERT INTO messages_fts(messages_fts, rowid, title, body)
+  VALUES ('delete', old.message_id, old.title, old.body);
+  INSERT INTO messages_fts(rowid, title, body)
+  VALUES (new.message_id, new.title, new.body);
+END;
+/*
+Counters of the messages of each nickname and of the direct replies to each
+message, kept by triggers. Keep them in sync with COUNTERS in
+forum/database.py.
+*/
+CREATE TABLE IF NOT EXISTS user_counters(
+  nickname TEXT PRIMARY KEY,
+  message_count INTEGER NOT NULL DEFAULT 0,
+  last_activity INTEGER);
+CREATE TABLE IF NOT EXISTS message_counters(
+  message_id INTEGER PRIMARY KEY,
+  reply_count INTEGER NOT NULL DEFAULT 0,
+  last_reply INTEGER);
+CREATE TRIGGER IF NOT EXISTS messages_counters_insert AFTER INSERT ON messages
+BEGIN
+  INSERT INTO user_counters(nickname)
+  SELECT new.user_nickname WHERE new.user_nickname IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM user_counters
+      WHERE nickname = new.user_nickname);
+  UPDATE user_counters SET message_count = message_count + 1,
+    last_activity = CASE WHEN last_activity >= new.timestamp
+      THEN last_activity ELSE COALESCE(new.timestamp, last_activity) END
+  WHERE nickname = new.user_nickname;
+  INSERT INTO message_counters(message_id)
+  SELECT new.reply_to WHERE new.reply_to IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM message_counters
+      WHERE message_id = new.reply_to);
+  UPDATE message_counters SET reply_count = reply_count + 1,
+    last_reply = CASE WHEN last_reply >= new.timestamp
+      THEN last_reply ELSE COALESCE(new.timestamp, last_reply) END
+  WHERE message_id = new.reply_to;
+END;
+CREATE TRIGGER IF NOT EXISTS messages_counters_delete AFTER DELETE ON messages
+BEGIN
+  UPDATE user_counters SET message_count = message_count - 1,
+    last_activity = (SELECT MAX(timestamp) FROM messages
+                     WHERE user_nickname = old.user_nickname)
+  WHERE nickname = old.user_nickname;
+  DELETE FROM user_counters
+  WHERE nickname = old.user_nickname AND message_count <= 0;
+  UPDATE message_counters SET reply_count = reply_count - 1,
+    last_reply = (SELECT MAX(timestamp) FROM messages
+                  WHERE reply_to = old.reply_to)
+  WHERE message_id = old.reply_to;
+  DELETE FROM message_counters WHERE message_id = old.message_id
+    OR (message_id = old.reply_to AND reply_count <= 0);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_counters_update AFTER UPDATE
+  OF user_nickname, reply_to, timestamp ON messages
+  WHEN old.user_nickname IS NOT new.user_nickname
+    OR old.reply_to IS NOT new.reply_to
+    OR old.timestamp IS NOT new.timestamp
+BEGIN
+  UPDATE user_counters SET message_count = message_count - 1
+  WHERE nickname = old.user_nickname;
+  INSERT INTO user_counters(nickname)
+  SELECT new.user_nickname WHERE new.user_nickname IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM user_counters
+      WHERE nickname = new.user_nickname);
+  UPDATE user_counters SET message_count = message_count + 1
+  WHERE nickname = new.user_nickname;
+  UPDATE user_counters SET last_activity = (
+    SELECT MAX(timestamp) FROM messages
+    WHERE user_nickname = user_counters.nickname)
+  WHERE nickname IN (old.user_nickname, new.user_nickname);
+  DELETE FROM user_counters
+  WHERE nickname = old.user_nickname AND message_count <= 0;
+  UPDATE message_counters SET reply_count = reply_count - 1
+  WHERE message_id = old.reply_to;
+  INSERT INTO message_counters(message_id)
+  SELECT new.reply_to WHERE new.reply_to IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM message_counters
+      WHERE message_id = new.reply_to);
+  UPDATE message_counters SET reply_count = reply_count + 1
+  WHERE message_id = new.reply_to;
+  UPDATE message_counters SET last_reply = (
+    SELECT MAX(timestamp) FROM messages
+    WHERE reply_to = message_counters.message_id)
+  WHERE message_id IN (old.reply_to, new.reply_to);
+  DELETE FROM message_counters
+  WHERE message_id = old.reply_to AND reply_count <= 0;
+END;
+/*
+Registry of the files holding the messages of old time ranges. Keep it in
+sync with PARTITIONS in forum/database.py.
+*/
+CREATE TABLE IF NOT EXISTS message_partitions(
+  name TEXT PRIMARY KEY,
+  path TEXT NOT NULL,
+  start_time INTEGER NOT NULL,
+  end_time INTEGER NOT NULL);
 
 COMMIT;
 PRAGMA foreign_keys=ON;
\ No newline at end of file
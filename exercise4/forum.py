@@ -1,11 +1,106 @@
+'''
+Entry point of the forum: the API and the admin client.
+
+Run it from the exercise folder. By default it starts the development
+server, with the reloader and the debugger:
+
+    python forum.py
+
+In production, start the pre-forking server of forum.prefork instead:
+
+    python forum.py --prefork --host 0.0.0.0 --workers 8
+
+Send SIGHUP to the master process to load the new code gracefully and
+SIGTERM to stop it. The master imports only forum.prefork and
+forum.versions, which are not reloaded: restart the server after changing
+them.
+
+@author: ivan
+'''
+
+import argparse
+
 from werkzeug.serving import run_simple
 from werkzeug.wsgi import DispatcherMiddleware
-from forum.resources import app as forum
-from forum_admin.application import app as forum_admin
 
-application = DispatcherMiddleware(forum, {
-    '/forum/admin': forum_admin
-})
+
+def create_application(db_path=None, versions=None, debug=True,
+                       write_behind=False):
+    '''
+    Imports the applications and mounts the admin client under
+    /forum/admin.
+
+    :param str db_path: Path of the database file. If None, the database
+        of the Engine created by forum.resources is used.
+    :param versions: A :py:class:`forum.versions.SharedTableVersions` to
+        count the changes made by all the processes sharing it. The caches
+        of this process are cleared when other processes change the tables.
+        Check :py:func:`forum.resources.clear_stale_caches`.
+    :param bool debug: Debug mode of the applications.
+    :param bool write_behind: If True, the writes are committed in groups by
+        the writer thread of the Engine.
+    :return: the WSGI application.
+    '''
+    from forum import database, resources
+    from forum_admin.application import app as forum_admin
+    forum = resources.app
+    if db_path is not None:
+        forum.config['Engine'] = database.Engine(db_path, wal=True)
+    if versions is not None:
+        forum.config['Engine'].versions = versions
+    if write_behind:
+        forum.config['Engine'].write_behind = True
+    forum.debug = forum_admin.debug = debug
+    return DispatcherMiddleware(forum, {
+        '/forum/admin': forum_admin
+    })
+
+
+def serve_prefork(host, port, workers, max_requests, db_path=None,
+                  write_behind=False):
+    '''
+    Serves the application with a :py:class:`forum.prefork.PreforkServer`.
+    The applications are imported by every worker after it is forked, so
+    each worker has its own database Engine and the workers forked on a
+    reload import the current code. The master must not import them.
+    '''
+    from forum.versions import SharedTableVersions
+    from forum.prefork import PreforkServer
+    #Created before forking, so the workers share it
+    versions = SharedTableVersions()
+    def load_app():
+        return create_application(db_path, versions, debug=False,
+                                  write_behind=write_behind)
+    PreforkServer(load_app, host, port, workers=workers,
+                  max_requests=max_requests).serve_forever()
+
+
+def main(argv=None):
+    from forum.prefork import DEFAULT_WORKERS, DEFAULT_MAX_REQUESTS
+    parser = argparse.ArgumentParser(description='Runs the forum server.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--database', default=None,
+                        help='path of the database file')
+    parser.add_argument('--write-behind', action='store_true',
+                        help='commit the writes in groups')
+    parser.add_argument('--prefork', action='store_true',
+                        help='production mode: pre-forking worker processes')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='number of worker processes (--prefork)')
+    parser.add_argument('--max-requests', type=int,
+                        default=DEFAULT_MAX_REQUESTS,
+                        help='requests served by a worker before it is '
+                             'replaced, 0 for no limit (--prefork)')
+    args = parser.parse_args(argv)
+    if args.prefork:
+        serve_prefork(args.host, args.port, args.workers, args.max_requests,
+                      args.database, args.write_behind)
+    else:
+        application = create_application(args.database,
+                                         write_behind=args.write_behind)
+        run_simple(args.host, args.port, application,
+                   use_reloader=True, use_debugger=True, use_evalex=True)
+
 if __name__ == '__main__':
-    run_simple('localhost', 5000, application,
-               use_reloader=True, use_debugger=True, use_evalex=True)
\ No newline at end of file
+    main()
@@ -0,0 +1,121 @@
+'''
+Created on 18.10.2026
+
+In-process caches used by the forum resources.
+'''
+
+from collections import OrderedDict
+import threading, time
+
+#Default limits of the caches
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+DEFAULT_TTL = 300
+
+
+class LRUCache(object):
+    '''
+    Thread safe least-recently-used cache of strings with time to live.
+
+    The memory used by the cache is estimated as the length of the cached
+    strings. Other values can be cached if their size is given. When adding
+    a value exceeds ``max_bytes``, the least recently used values are
+    evicted.
+
+    :Example:
+
+    >>> cache = LRUCache(max_bytes=1024, ttl=60)
+    >>> cache.set('msg-1', '{"headline": "Hello"}')
+    >>> cache.get('msg-1')
+    '{"headline": "Hello"}'
+
+    :param int max_bytes: Maximum size of the cached values.
+    :param ttl: Seconds a value is served after it was added. None means
+        that values do not expire.
+
+    '''
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        super(LRUCache, self).__init__()
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        #key -> (value, expiration time, size). Least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0,
+                          'expirations': 0, 'invalidations': 0}
+
+    def get(self, key):
+        '''
+        :return: the value cached for ``key`` or None if there is no value or
+            it has expired.
+        '''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            value, expires, size = entry
+            if expires is not None and expires < time.time():
+                self._bytes -= size
+                self._counters['expirations'] += 1
+                self._counters['misses'] += 1
+                return None
+            #Reinsert it as the most recently used
+            self._entries[key] = entry
+            self._counters['hits'] += 1
+            return value
+
+    def set(self, key, value, size=None):
+        '''
+        Caches ``value`` under ``key``. Values bigger than ``max_bytes`` are
+        not cached.
+
+        :param int size: Estimated size of ``value``. If None, its length.
+        '''
+        if size is None:
+            size = len(value)
+        if size > self.max_bytes:
+            return
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            while self._entries and self._bytes + size > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._counters['evictions'] += 1
+            self._entries[key] = (value, expires, size)
+            self._bytes += size
+
+    def invalidate(self, key):
+        '''
+        Removes the value cached for ``key``, if any.
+        '''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+                self._counters['invalidations'] += 1
+
+    def clear(self):
+        '''
+        Removes all the cached values.
+        '''
+        with self._lock:
+            self._counters['invalidations'] += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        '''
+        :return: a dictionary with the keys ``entries``, ``bytes``,
+            ``max_bytes`` and the counters ``hits``, ``misses``,
+            ``evictions``, ``expirations`` and ``invalidations``.
+        '''
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            stats['max_bytes'] = self.max_bytes
+        return stats
@@ -8,12 +8,380 @@ Provides the database API to access the forum persistent data.
 @author: ivan
 '''
 
+from collections import deque
 from datetime import datetime
-import time, sqlite3, re, os
+import time, sqlite3, re, os, threading, csv, json, urllib, Queue
+
+#Re-exported: the tables are counted by the Engine and the resources
+from versions import TABLES, TableVersions, SharedTableVersions
 #Default paths for .db and .sql files to create and populate the database.
 DEFAULT_DB_PATH = 'db/forum.db'
 DEFAULT_SCHEMA = "db/forum_schema_dump.sql"
 DEFAULT_DATA_DUMP = "db/forum_data_dump.sql"
+#Default configuration of the connection pools. SQLite runs one write
+#transaction at a time, so a single read-write connection makes the writers
+#wait in the pool instead of retrying in the busy handler. Readers use their
+#own read-only connections.
+DEFAULT_POOL_SIZE = 1
+DEFAULT_READ_POOL_SIZE = 5
+DEFAULT_POOL_TIMEOUT = 10
+DEFAULT_POOL_IDLE_TIMEOUT = 300
+DEFAULT_POOL_HEALTH_CHECK_INTERVAL = 30
+#PRAGMAs applied once to every connection when it is opened. They are
+#(name, value) tuples and are applied in order.
+DEFAULT_PRAGMAS = (('foreign_keys', 'ON'),
+                   ('temp_store', 'MEMORY'))
+#PRAGMAs that can be configured through the Engine.
+SUPPORTED_PRAGMAS = ('foreign_keys', 'journal_mode', 'synchronous',
+                     'cache_size', 'mmap_size', 'temp_store', 'busy_timeout',
+                     'wal_autocheckpoint')
+#PRAGMAs persisted in the database file. Read-only connections cannot apply
+#them and skip them; the read-write connections set them.
+PERSISTENT_PRAGMAS = ('journal_mode',)
+#Milliseconds a connection waits for a lock before failing with
+#"database is locked".
+DEFAULT_BUSY_TIMEOUT = 5000
+#Default checkpoint policy of the WAL mode. wal_autocheckpoint is in pages,
+#the interval of the background checkpointer in seconds.
+DEFAULT_WAL_AUTOCHECKPOINT = 1000
+DEFAULT_CHECKPOINT_INTERVAL = 30
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+#Number of prepared statements cached by each sqlite3 connection.
+DEFAULT_STATEMENT_CACHE_SIZE = 100
+#Default group commit policy of the write-behind mode: maximum number of
+#operations committed in one transaction and seconds the first operation of
+#a transaction waits for others to join it.
+DEFAULT_WRITE_BATCH_SIZE = 64
+DEFAULT_WRITE_LATENCY = 0.002
+#Connection methods that can be run by the WriteBehindQueue.
+WRITE_BEHIND_METHODS = ('create_message', 'create_messages', 'append_answer',
+                        'modify_message', 'delete_message', 'append_user',
+                        'modify_user', 'delete_user')
+#Secondary indexes of the database, as (name, statement) tuples. The same
+#indexes are defined in DEFAULT_SCHEMA. The name of an index starts with
+#the name of its table. users(nickname) is already indexed by its UNIQUE
+#constraint.
+#The list indexes follow the ORDER BY timestamp, message_id of the lists and
+#include the rest of columns of a message list item, so get_messages reads
+#only the index and never the message bodies. users_list_idx covers the
+#user lists sorted by registration date.
+INDEXES = (
+    ('messages_user_list_idx',
+     'CREATE INDEX IF NOT EXISTS messages_user_list_idx \
+      ON messages(user_nickname, timestamp, message_id, title)'),
+    ('messages_list_idx',
+     'CREATE INDEX IF NOT EXISTS messages_list_idx \
+      ON messages(timestamp, message_id, user_nickname, title)'),
+    ('messages_reply_to_idx',
+     'CREATE INDEX IF NOT EXISTS messages_reply_to_idx \
+      ON messages(reply_to)'),
+    ('users_list_idx',
+     'CREATE INDEX IF NOT EXISTS users_list_idx ON users(regDate, nickname)'))
+#Indexes replaced by the ones in INDEXES. They are dropped by
+#Engine.create_indexes.
+OBSOLETE_INDEXES = ('messages_user_nickname_timestamp_idx',
+                    'messages_timestamp_idx')
+#Full-text search index over the title and the body of the messages, as
+#(name, statement) tuples. The index is an external content FTS5 table kept
+#in sync by triggers, so every change of the messages, including the
+#cascaded deletes of the replies, is indexed. The same statements are in
+#DEFAULT_SCHEMA.
+SEARCH_INDEX = (
+    ('messages_fts',
+     "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(title, \
+      body, content='messages', content_rowid='message_id')"),
+    ('messages_fts_insert',
+     "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT \
+      ON messages BEGIN \
+        INSERT INTO messages_fts(rowid, title, body) \
+        VALUES (new.message_id, new.title, new.body); \
+      END"),
+    ('messages_fts_delete',
+     "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE \
+      ON messages BEGIN \
+        INSERT INTO messages_fts(messages_fts, rowid, title, body) \
+        VALUES ('delete', old.message_id, old.title, old.body); \
+      END"),
+    ('messages_fts_update',
+     "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE \
+      OF title, body ON messages BEGIN \
+        INSERT INTO messages_fts(messages_fts, rowid, title, body) \
+        VALUES ('delete', old.message_id, old.title, old.body); \
+        INSERT INTO messages_fts(rowid, title, body) \
+        VALUES (new.message_id, new.title, new.body); \
+      END"))
+#Counters of the messages sent by each nickname and of the direct replies
+#to each message, with the timestamp of the last one, as (name, statement)
+#tuples. They are kept by triggers, so every write path, including the
+#bulk loads and the cascaded deletes, updates them. Rows whose counter
+#reaches 0 are deleted. An insert only touches the counter rows, so it does
+#not need the indexes dropped by Engine.bulk_load. The counter rows are not
+#created with INSERT OR IGNORE, because the conflict policy of the statement
+#firing the trigger (e.g. a foreign key action) would replace it. The same
+#statements are in DEFAULT_SCHEMA.
+COUNTERS = (
+    ('user_counters',
+     'CREATE TABLE IF NOT EXISTS user_counters(nickname TEXT PRIMARY KEY, \
+      message_count INTEGER NOT NULL DEFAULT 0, last_activity INTEGER)'),
+    ('message_counters',
+     'CREATE TABLE IF NOT EXISTS message_counters( \
+      message_id INTEGER PRIMARY KEY, \
+      reply_count INTEGER NOT NULL DEFAULT 0, last_reply INTEGER)'),
+    ('messages_counters_insert',
+     'CREATE TRIGGER IF NOT EXISTS messages_counters_insert AFTER INSERT \
+      ON messages BEGIN \
+        INSERT INTO user_counters(nickname) \
+        SELECT new.user_nickname WHERE new.user_nickname IS NOT NULL \
+          AND NOT EXISTS (SELECT 1 FROM user_counters \
+            WHERE nickname = new.user_nickname); \
+        UPDATE user_counters SET message_count = message_count + 1, \
+          last_activity = CASE WHEN last_activity >= new.timestamp \
+            THEN last_activity ELSE COALESCE(new.timestamp, last_activity) END \
+        WHERE nickname = new.user_nickname; \
+        INSERT INTO message_counters(message_id) \
+        SELECT new.reply_to WHERE new.reply_to IS NOT NULL \
+          AND NOT EXISTS (SELECT 1 FROM message_counters \
+            WHERE message_id = new.reply_to); \
+        UPDATE message_counters SET reply_count = reply_count + 1, \
+          last_reply = CASE WHEN last_reply >= new.timestamp \
+            THEN last_reply ELSE COALESCE(new.timestamp, last_reply) END \
+        WHERE message_id = new.reply_to; \
+      END'),
+    ('messages_counters_delete',
+     'CREATE TRIGGER IF NOT EXISTS messages_counters_delete AFTER DELETE \
+      ON messages BEGIN \
+        UPDATE user_counters SET message_count = message_count - 1, \
+          last_activity = (SELECT MAX(timestamp) FROM messages \
+                           WHERE user_nickname = old.user_nickname) \
+        WHERE nickname = old.user_nickname; \
+        DELETE FROM user_counters \
+        WHERE nickname = old.user_nickname AND message_count <= 0; \
+        UPDATE message_counters SET reply_count = reply_count - 1, \
+          last_reply = (SELECT MAX(timestamp) FROM messages \
+                        WHERE reply_to = old.reply_to) \
+        WHERE message_id = old.reply_to; \
+        DELETE FROM message_counters WHERE message_id = old.message_id \
+          OR (message_id = old.reply_to AND reply_count <= 0); \
+      END'),
+    ('messages_counters_update',
+     'CREATE TRIGGER IF NOT EXISTS messages_counters_update AFTER UPDATE \
+      OF user_nickname, reply_to, timestamp ON messages \
+      WHEN old.user_nickname IS NOT new.user_nickname \
+        OR old.reply_to IS NOT new.reply_to \
+        OR old.timestamp IS NOT new.timestamp BEGIN \
+        UPDATE user_counters SET message_count = message_count - 1 \
+        WHERE nickname = old.user_nickname; \
+        INSERT INTO user_counters(nickname) \
+        SELECT new.user_nickname WHERE new.user_nickname IS NOT NULL \
+          AND NOT EXISTS (SELECT 1 FROM user_counters \
+            WHERE nickname = new.user_nickname); \
+        UPDATE user_counters SET message_count = message_count + 1 \
+        WHERE nickname = new.user_nickname; \
+        UPDATE user_counters SET last_activity = ( \
+          SELECT MAX(timestamp) FROM messages \
+          WHERE user_nickname = user_counters.nickname) \
+        WHERE nickname IN (old.user_nickname, new.user_nickname); \
+        DELETE FROM user_counters \
+        WHERE nickname = old.user_nickname AND message_count <= 0; \
+        UPDATE message_counters SET reply_count = reply_count - 1 \
+        WHERE message_id = old.reply_to; \
+        INSERT INTO message_counters(message_id) \
+        SELECT new.reply_to WHERE new.reply_to IS NOT NULL \
+          AND NOT EXISTS (SELECT 1 FROM message_counters \
+            WHERE message_id = new.reply_to); \
+        UPDATE message_counters SET reply_count = reply_count + 1 \
+        WHERE message_id = new.reply_to; \
+        UPDATE message_counters SET last_reply = ( \
+          SELECT MAX(timestamp) FROM messages \
+          WHERE reply_to = message_counters.message_id) \
+        WHERE message_id IN (old.reply_to, new.reply_to); \
+        DELETE FROM message_counters \
+        WHERE message_id = old.reply_to AND reply_count <= 0; \
+      END'))
+#Registry of the partitions of the messages, as (name, statement) tuples.
+#Each row is an SQLite file holding the messages of the time range
+#[start_time, end_time), moved there by Engine.create_partition. The same
+#statement is in DEFAULT_SCHEMA.
+PARTITIONS = (
+    ('message_partitions',
+     'CREATE TABLE IF NOT EXISTS message_partitions(name TEXT PRIMARY KEY, \
+      path TEXT NOT NULL, start_time INTEGER NOT NULL, \
+      end_time INTEGER NOT NULL)'),)
+#Table of the messages in a partition file: the columns of messages without
+#the foreign keys, since the users and the rest of the messages are in the
+#main database. Its indexes are the messages_* ones of INDEXES.
+PARTITION_MESSAGES_TABLE = 'CREATE TABLE %s.messages( \
+    message_id INTEGER PRIMARY KEY, title TEXT, body TEXT, \
+    timestamp INTEGER, ip TEXT, timesviewed INTEGER, reply_to INTEGER, \
+    user_nickname TEXT, user_id INTEGER, editor_nickname TEXT)'
+MESSAGE_COLUMNS = 'message_id, title, body, timestamp, ip, timesviewed, \
+    reply_to, user_nickname, user_id, editor_nickname'
+#Partitions are attached to the connections as PARTITION_PREFIX + name.
+#SQLite attaches at most 10 databases to a connection, so a query can read
+#all the partitions only if there are no more than MAX_PARTITIONS.
+PARTITION_PREFIX = 'partition_'
+MAX_PARTITIONS = 8
+_PARTITION_NAME = re.compile(r'\w+\Z')
+#Columns read by the message lists. Check _create_message_list_object
+MESSAGE_LIST_COLUMNS = 'message_id, title, timestamp, user_nickname'
+#Columns read by the user lists. Check _create_user_list_object
+USER_LIST_COLUMNS = 'nickname, regDate'
+#Orders of the user lists, by name, with the columns of their sort and
+#pagination key. Nicknames are unique, so they make every key unique. Both
+#orders are resolved with an index: the one of the UNIQUE nickname and
+#users_list_idx.
+USER_ORDERS = {'nickname': ('nickname',),
+               'registrationdate': ('regDate', 'nickname')}
+#Message ids are msg- followed by the message_id of the row, a positive
+#64-bit integer.
+MESSAGE_ID_PATTERN = r'msg-\d{1,19}'
+MAX_MESSAGE_ID = 2 ** 63 - 1
+_MESSAGE_ID = re.compile(r'msg-(\d{1,19})\Z')
+#Tables accepted by Engine.bulk_load, in the order they are loaded
+BULK_LOAD_TABLES = ('users', 'users_profile', 'friends', 'messages')
+#File formats accepted by Engine.bulk_load, by file extension
+BULK_LOAD_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.json': 'jsonl'}
+#Messages matching a full-text search, from the most relevant, with the
+#keyset restriction of Connection.search_messages. The parameters are the
+#FTS5 query, the seek rank (NULL for the first page), the seek rank and
+#message_id again and the LIMIT.
+_SEARCH_STATEMENT = 'SELECT messages.message_id, messages.title, \
+    messages.timestamp, messages.user_nickname, messages_fts.rank \
+    FROM messages_fts JOIN messages \
+    ON messages.message_id = messages_fts.rowid \
+    WHERE messages_fts MATCH ? AND (? IS NULL OR \
+        (messages_fts.rank, messages_fts.rowid) > (?, ?)) \
+    ORDER BY messages_fts.rank, messages_fts.rowid LIMIT ?'
+#The foreign key of the sender cannot point from a partition to the users
+#of the main database. A sender that no longer exists reads as NULL, as if
+#the foreign key had set it to NULL.
+_ARCHIVED_SENDER = '(archived.user_id IS NULL OR EXISTS (SELECT 1 \
+    FROM main.users WHERE users.user_id = archived.user_id \
+    AND users.nickname = archived.user_nickname))'
+_ARCHIVED_LIST_COLUMNS = 'message_id, title, timestamp, \
+    CASE WHEN %s THEN user_nickname END' % _ARCHIVED_SENDER
+_ARCHIVED_MESSAGE_STATEMENT = 'SELECT message_id, title, body, timestamp, \
+    reply_to, editor_nickname, \
+    CASE WHEN %s THEN user_nickname END AS user_nickname \
+    FROM %%s.messages AS archived WHERE message_id = ?' % _ARCHIVED_SENDER
+#Reply tree of a message, in depth-first order. The path of a message is
+#the ids of its ancestors and its own, zero padded to a fixed width, so
+#sorting by path lists every message after its parent and before its
+#siblings. A message already in the path is not followed again, in case
+#bulk loaded rows form a cycle. The parameters are the root message_id,
+#the maximum depth twice, the path to seek and the LIMIT.
+_THREAD_STATEMENT = '''WITH RECURSIVE thread(message_id, title, timestamp,
+        user_nickname, reply_to, depth, path) AS (
+      SELECT message_id, title, timestamp, user_nickname, reply_to, 0,
+             printf('%019d', message_id)
+      FROM messages WHERE message_id = ?
+      UNION ALL
+      SELECT m.message_id, m.title, m.timestamp, m.user_nickname,
+             m.reply_to, t.depth + 1,
+             t.path || '.' || printf('%019d', m.message_id)
+      FROM messages m JOIN thread t ON m.reply_to = t.message_id
+      WHERE (? < 0 OR t.depth < ?)
+        AND instr(t.path, printf('%019d', m.message_id)) = 0)
+    SELECT message_id, title, timestamp, user_nickname, reply_to, depth, path
+    FROM thread WHERE path > ? ORDER BY path LIMIT ?'''
+#Statements built by _messages_statement, by their arguments
+_MESSAGES_STATEMENTS = {}
+#Statements built by _users_statement, by their arguments
+_USERS_STATEMENTS = {}
+
+
+def _fts_query(text):
+    '''
+    :return: the FTS5 query matching the messages that contain all the
+        words of ``text``. The words are quoted, so the FTS5 operators in
+        ``text`` are searched as plain words.
+    :raises ValueError: if ``text`` has no words.
+    '''
+    words = text.split()
+    if not words:
+        raise ValueError("The search has no words")
+    return ' '.join('"%s"' % word.replace('"', '""') for word in words)
+
+
+def _messages_statement(by_nickname, by_before, by_after, by_seek, backwards,
+                        schemas=()):
+    '''
+    Returns the parameterised statement that lists messages with the given
+    restrictions. There are 24 possible statements for each tuple of
+    ``schemas``; each one is built once.
+
+    The messages of the partitions attached as ``schemas`` are merged with
+    the ones of the main database with UNION ALL. Every part is read in the
+    order of the list from its own index, so SQLite merges them and stops
+    at the LIMIT.
+
+    The parameters of the statement are, in order: nickname, before, after,
+    seek timestamp, seek message_id (only those that apply), repeated for
+    the main database and each partition, and the LIMIT.
+
+    '''
+    key = (by_nickname, by_before, by_after, by_seek, backwards, schemas)
+    query = _MESSAGES_STATEMENTS.get(key)
+    if query is None:
+        conditions = []
+        if by_nickname:
+            conditions.append('user_nickname = ?')
+        if by_before:
+            conditions.append('timestamp < ?')
+        if by_after:
+            conditions.append('timestamp > ?')
+        #Keyset restriction. Backwards pages are read in ascending order
+        #and reversed afterwards.
+        if by_seek:
+            conditions.append('(timestamp, message_id) %s (?, ?)' %
+                              ('>' if backwards else '<'))
+        #Only the columns of the list are selected, so the query is resolved
+        #using a covering index.
+        query = 'SELECT ' + MESSAGE_LIST_COLUMNS + ' FROM messages'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        for schema in schemas:
+            query += ' UNION ALL SELECT ' + _ARCHIVED_LIST_COLUMNS + \
+                     ' FROM %s.messages AS archived' % schema
+            if conditions:
+                query += ' WHERE ' + ' AND '.join(conditions)
+                if by_nickname:
+                    query += ' AND ' + _ARCHIVED_SENDER
+        if backwards:
+            query += ' ORDER BY timestamp ASC, message_id ASC'
+        else:
+            query += ' ORDER BY timestamp DESC, message_id DESC'
+        query += ' LIMIT ?'
+        _MESSAGES_STATEMENTS[key] = query
+    return query
+
+
+def _users_statement(order, by_seek, backwards):
+    '''
+    Returns the parameterised statement that lists users in ``order``, one
+    of ``USER_ORDERS``. Each statement is built once.
+
+    The parameters of the statement are, in order: the columns of the key
+    of ``order`` of the seek user (only if ``by_seek``) and the LIMIT.
+
+    '''
+    key = (order, by_seek, backwards)
+    query = _USERS_STATEMENTS.get(key)
+    if query is None:
+        columns = USER_ORDERS[order]
+        query = 'SELECT ' + USER_LIST_COLUMNS + ' FROM users'
+        #Keyset restriction. Backwards pages are read in descending order
+        #and reversed afterwards.
+        if by_seek:
+            query += ' WHERE (%s) %s (%s)' % (', '.join(columns),
+                                              '<' if backwards else '>',
+                                              ', '.join('?' * len(columns)))
+        direction = ' DESC' if backwards else ' ASC'
+        query += ' ORDER BY ' + ', '.join(column + direction
+                                          for column in columns)
+        query += ' LIMIT ?'
+        _USERS_STATEMENTS[key] = query
+    return query
 
 
 class Engine(object):
@@ -30,12 +398,83 @@ class Engine(object):
     >>> engine = Engine()
     >>> con = engine.connect()
 
+    Connections that are used only for the duration of a request should be
+    borrowed from the pool with :py:meth:`acquire` and given back with
+    :py:meth:`release` instead of being opened and closed every time.
+    Read-only connections, ``acquire(read_only=True)``, come from a separate
+    pool, so the readers never wait for the read-write connections. They are
+    opened with a ``file:...?mode=ro`` URI filename or, if the sqlite3 module
+    does not accept URI filenames (:py:attr:`uri_filenames`), with the
+    PRAGMA query_only.
+
+    If ``wal`` is True the database works in Write-Ahead Logging mode:
+    readers are not blocked by a writer committing a transaction. Committed
+    pages are copied back to the database file by SQLite every
+    ``wal_autocheckpoint`` pages and by a background
+    :py:class:`Checkpointer` thread every ``checkpoint_interval`` seconds.
+    The thread is started the first time a connection is acquired.
+
+    If ``write_behind`` is True the application should run the write
+    operations through :py:meth:`submit`: they are executed by a single
+    :py:class:`WriteBehindQueue` thread, which commits up to
+    ``write_batch_size`` of them in the same transaction, so concurrent
+    writers share the cost of a commit.
+
+    Old messages can be moved to partitions, one SQLite file per time range,
+    with :py:meth:`create_partition`. The connections attach the partitions
+    when they need them: the message lists read only the partitions whose
+    range overlaps the requested window and merge them with the main
+    database in timestamp order.
+
+    The changes committed through the connections of the Engine are counted
+    per table in :py:attr:`versions`, a :py:class:`TableVersions` instance
+    used to build HTTP validators without querying the database.
+
     :param db_path: The path of the database file (always with respect to the
         calling script. If not specified, the Engine will use the file located
         at *db/forum.db*
+    :param int pool_size: Maximum number of read-write connections kept by
+        the pool.
+    :param int read_pool_size: Maximum number of read-only connections kept
+        by the read pool.
+    :param pool_timeout: Seconds :py:meth:`acquire` waits for a free
+        connection before giving up.
+    :param pool_idle_timeout: Seconds an idle pooled connection is kept open.
+    :param pool_health_check_interval: Idle seconds after which a pooled
+        connection is checked before being handed out again.
+    :param pragmas: sequence of (name, value) tuples with the PRAGMAs applied
+        to every new connection. Names must be in ``SUPPORTED_PRAGMAS``. If
+        not specified, ``DEFAULT_PRAGMAS`` is used.
+    :param bool wal: If True, use the WAL journal mode.
+    :param int busy_timeout: Milliseconds a connection waits for a lock.
+    :param int wal_autocheckpoint: WAL size, in pages, that triggers an
+        automatic checkpoint on commit.
+    :param checkpoint_interval: Seconds between two checkpoints of the
+        background checkpointer. None disables the thread.
+    :param str checkpoint_mode: One of ``CHECKPOINT_MODES``.
+    :param int statement_cache_size: Number of prepared statements cached by
+        each connection.
+    :param bool write_behind: If True, the writes of the application are
+        run by the :py:class:`WriteBehindQueue`.
+    :param int write_batch_size: Maximum number of operations committed in
+        one transaction by the :py:class:`WriteBehindQueue`.
+    :param write_latency: Seconds the first operation of a transaction waits
+        for other operations to join it.
 
     '''
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, pool_size=DEFAULT_POOL_SIZE,
+                 read_pool_size=DEFAULT_READ_POOL_SIZE,
+                 pool_timeout=DEFAULT_POOL_TIMEOUT,
+                 pool_idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT,
+                 pool_health_check_interval=DEFAULT_POOL_HEALTH_CHECK_INTERVAL,
+                 pragmas=None, wal=False, busy_timeout=DEFAULT_BUSY_TIMEOUT,
+                 wal_autocheckpoint=DEFAULT_WAL_AUTOCHECKPOINT,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 checkpoint_mode='PASSIVE',
+                 statement_cache_size=DEFAULT_STATEMENT_CACHE_SIZE,
+                 write_behind=False,
+                 write_batch_size=DEFAULT_WRITE_BATCH_SIZE,
+                 write_latency=DEFAULT_WRITE_LATENCY):
         '''
         '''
 
@@ -44,25 +483,229 @@ class Engine(object):
             self.db_path = db_path
         else:
             self.db_path = DEFAULT_DB_PATH
-
-    def connect(self):
+        if checkpoint_mode not in CHECKPOINT_MODES:
+            raise ValueError("Unknown checkpoint mode %s" % checkpoint_mode)
+        self.wal = wal
+        self.busy_timeout = busy_timeout
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_mode = checkpoint_mode
+        self.statement_cache_size = statement_cache_size
+        if write_batch_size < 1:
+            raise ValueError("The write batch size must be at least 1")
+        self.write_behind = write_behind
+        self.write_batch_size = write_batch_size
+        self.write_latency = write_latency
+        #The busy timeout goes first so the rest of PRAGMAs wait for locks.
+        #Explicit pragmas go last so they can override the mode settings.
+        mode_pragmas = [('busy_timeout', busy_timeout)]
+        if wal:
+            mode_pragmas.extend([('journal_mode', 'WAL'),
+                                 ('synchronous', 'NORMAL'),
+                                 ('wal_autocheckpoint', wal_autocheckpoint)])
+        if pragmas is None:
+            pragmas = DEFAULT_PRAGMAS
+        self.pragmas = tuple(mode_pragmas) + tuple(pragmas)
+        for name, value in self.pragmas:
+            _check_pragma(name, value)
+        self._checkpointer = None
+        self._checkpointer_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        #Read-only connections fall back to query_only without URIs
+        self.uri_filenames = _uri_filenames()
+        self.versions = TableVersions()
+        self.pool = ConnectionPool(self._create_pooled_connection,
+                                   size=pool_size, timeout=pool_timeout,
+                                   idle_timeout=pool_idle_timeout,
+                                   health_check_interval=\
+                                       pool_health_check_interval)
+        self.read_pool = ConnectionPool(self._create_read_only_connection,
+                                        size=read_pool_size,
+                                        timeout=pool_timeout,
+                                        idle_timeout=pool_idle_timeout,
+                                        health_check_interval=\
+                                            pool_health_check_interval)
+
+    def connect(self, read_only=False):
         '''
         Creates a connection to the database.
 
+        :param bool read_only: If True, the connection cannot modify the
+            database.
         :return: A Connection instance
         :rtype: Connection
 
         '''
-        return Connection(self.db_path)
+        return Connection(self.db_path, pragmas=self.pragmas,
+                          cached_statements=self.statement_cache_size,
+                          versions=self.versions, read_only=read_only)
+
+    def _create_pooled_connection(self, read_only=False):
+        '''
+        Factory used by the pools. Pooled connections can be handed to any
+        thread, although only one thread uses them at a time.
+
+        '''
+        return Connection(self.db_path, check_same_thread=False,
+                          pragmas=self.pragmas,
+                          cached_statements=self.statement_cache_size,
+                          versions=self.versions, read_only=read_only)
+
+    def _create_read_only_connection(self):
+        return self._create_pooled_connection(read_only=True)
+
+    #CONNECTION POOL
+    def acquire(self, read_only=False):
+        '''
+        Borrows a connection from the pool. A thread that already holds a
+        connection of the same pool gets the same instance back.
+
+        :param bool read_only: If True, borrow a read-only connection from
+            the read pool. Use them to serve the requests that do not modify
+            the database.
+        :return: A Connection instance that must be given back using
+            :py:meth:`release`
+        :rtype: Connection
+        :raises sqlite3.OperationalError: if no connection became available
+            within ``pool_timeout`` seconds.
+
+        '''
+        if self.wal and self._checkpointer is None and \
+           self.checkpoint_interval is not None:
+            self.start_checkpointer()
+        if read_only:
+            return self.read_pool.checkout()
+        return self.pool.checkout()
+
+    def release(self, connection):
+        '''
+        Gives back a connection obtained with :py:meth:`acquire`. Pending
+        changes of a read-write connection are committed.
+
+        :param connection: The Connection to return to the pool.
+        :type connection: Connection
+
+        '''
+        if connection.read_only:
+            self.read_pool.checkin(connection)
+        else:
+            self.pool.checkin(connection)
+
+    def pool_stats(self, read_only=False):
+        '''
+        :param bool read_only: If True, return the counters of the read pool.
+        :return: a dictionary with the counters of the connection pool. Check
+            :py:meth:`ConnectionPool.stats`
+        '''
+        if read_only:
+            return self.read_pool.stats()
+        return self.pool.stats()
+
+    def dispose(self):
+        '''
+        Closes the idle connections of both pools. Check
+        :py:meth:`ConnectionPool.dispose`
+        '''
+        self.pool.dispose()
+        self.read_pool.dispose()
+
+    #WAL CHECKPOINTS
+    def checkpoint(self, mode=None):
+        '''
+        Copies the pages in the WAL file back to the database file.
+
+        :param str mode: One of ``CHECKPOINT_MODES``. If not specified, the
+            ``checkpoint_mode`` of the Engine is used.
+        :return: a tuple (busy, log, checkpointed) as returned by
+            ``PRAGMA wal_checkpoint``. busy is 1 if the checkpoint could not
+            complete because of readers or writers.
+        '''
+        con = sqlite3.connect(self.db_path)
+        try:
+            return _wal_checkpoint(con, mode or self.checkpoint_mode,
+                                   self.busy_timeout)
+        finally:
+            con.close()
+
+    def start_checkpointer(self):
+        '''
+        Starts the background :py:class:`Checkpointer` if it is not running.
+
+        '''
+        with self._checkpointer_lock:
+            if self._checkpointer is None:
+                self._checkpointer = Checkpointer(self.db_path,
+                                                  self.checkpoint_interval,
+                                                  self.checkpoint_mode,
+                                                  self.busy_timeout)
+                self._checkpointer.start()
+
+    def stop_checkpointer(self):
+        '''
+        Stops the background :py:class:`Checkpointer`, if running.
+
+        '''
+        with self._checkpointer_lock:
+            if self._checkpointer is not None:
+                self._checkpointer.stop()
+                self._checkpointer = None
+
+    #WRITE-BEHIND
+    def submit(self, method, *args, **kwargs):
+        '''
+        Runs a write operation in the :py:class:`WriteBehindQueue`, starting
+        it if it is not running.
+
+        :Example:
+
+        >>> future = engine.submit('create_message', 'Title', 'Body', 'AxelW')
+        >>> future.result()
+        'msg-25'
+
+        :param str method: Name of the :py:class:`Connection` method. One of
+            ``WRITE_BEHIND_METHODS``.
+        :return: a :py:class:`WriteFuture` with the return value of the
+            method, set once its transaction is committed.
+        :raises ValueError: if the method cannot be run by the queue.
+        :raises sqlite3.OperationalError: if the queue has stopped because
+            of an error. :py:meth:`stop_writer` discards it, so that the next
+            operation starts a new one.
+
+        '''
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = WriteBehindQueue(self.connect,
+                                                self.write_batch_size,
+                                                self.write_latency)
+                self._writer.start()
+            return self._writer.submit(method, *args, **kwargs)
+
+    def stop_writer(self):
+        '''
+        Stops the :py:class:`WriteBehindQueue`, if running, once the
+        operations already submitted are committed.
+
+        '''
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.stop()
+                self._writer = None
 
     def remove_database(self):
         '''
-        Removes the database file from the filesystem.
+        Removes the database file and its partitions from the filesystem.
 
         '''
-        if os.path.exists(self.db_path):
-            #THIS REMOVES THE DATABASE STRUCTURE
-            os.remove(self.db_path)
+        self.stop_checkpointer()
+        self.stop_writer()
+        #Pooled connections would keep pointing to the removed file
+        self.dispose()
+        partitions = [partition['path'] for partition in self.partitions()]
+        #THIS REMOVES THE DATABASE STRUCTURE
+        for path in [self.db_path, self.db_path + '-wal',
+                     self.db_path + '-shm'] + partitions:
+            if os.path.exists(path):
+                os.remove(path)
 
     def clear(self):
         '''
@@ -82,6 +725,24 @@ class Engine(object):
             cur.execute("DELETE FROM users")
             #NOTE since we have ON DELETE CASCADE BOTH IN users_profile AND
             #friends, WE DO NOT HAVE TO WORRY TO CLEAR THOSE TABLES.
+            partitions = _read_partitions(cur, 'SELECT path \
+                                                FROM message_partitions')
+            if partitions:
+                cur.execute("DELETE FROM message_partitions")
+                #The counters still count the archived messages
+                cur.execute("SELECT name FROM sqlite_master \
+                             WHERE type = 'table' \
+                             AND name IN ('user_counters', 'message_counters')")
+                for (table,) in cur.fetchall():
+                    cur.execute("DELETE FROM %s" % table)
+        con.close()
+        if partitions:
+            #The pooled connections may have the partitions attached
+            self.dispose()
+            for (path,) in partitions:
+                if os.path.exists(path):
+                    os.remove(path)
+        self.versions.bump(*TABLES)
 
     #METHODS TO CREATE AND POPULATE A DATABASE USING DIFFERENT SCRIPTS
     def create_tables(self, schema=None):
@@ -102,6 +763,99 @@ class Engine(object):
                 cur.executescript(sql)
         finally:
             con.close()
+        #The schema might be an old dump without indexes
+        self.create_indexes()
+        self.create_search_index()
+        self.create_counters()
+
+    def create_indexes(self):
+        '''
+        Create the secondary indexes listed in ``INDEXES`` if they do not
+        exist and drop the ones in ``OBSOLETE_INDEXES``. Use it also to
+        upgrade databases created before the indexes were added.
+
+        :return: ``True`` if the indexes exist or ``False`` otherwise.
+
+        '''
+        con = sqlite3.connect(self.db_path)
+        try:
+            with con:
+                cur = con.cursor()
+                for name in OBSOLETE_INDEXES:
+                    cur.execute('DROP INDEX IF EXISTS %s' % name)
+                for _, stmnt in INDEXES:
+                    cur.execute(stmnt)
+        except sqlite3.Error, excp:
+            print "Error %s:" % excp.args[0]
+            return False
+        finally:
+            con.close()
+        return True
+
+    def create_search_index(self):
+        '''
+        Create the full-text search index of the messages and its triggers,
+        listed in ``SEARCH_INDEX``, if they do not exist. A new index is
+        filled with the messages already in the database, so use it also to
+        upgrade databases created before the index was added.
+
+        :return: ``True`` if the index exists or ``False`` otherwise.
+
+        '''
+        con = sqlite3.connect(self.db_path)
+        try:
+            with con:
+                cur = con.cursor()
+                cur.execute("SELECT name FROM sqlite_master \
+                             WHERE name = 'messages_fts'")
+                exists = cur.fetchone() is not None
+                for _, stmnt in SEARCH_INDEX:
+                    cur.execute(stmnt)
+                if not exists:
+                    cur.execute("INSERT INTO messages_fts(messages_fts) \
+                                 VALUES('rebuild')")
+        except sqlite3.Error, excp:
+            print "Error %s:" % excp.args[0]
+            return False
+        finally:
+            con.close()
+        return True
+
+    def create_counters(self):
+        '''
+        Create the tables of counters of the messages and their triggers,
+        listed in ``COUNTERS``, if they do not exist. Counters that are
+        empty are filled with the messages already in the database, so use
+        it also to upgrade databases created before the counters were added.
+
+        :return: ``True`` if the counters exist or ``False`` otherwise.
+
+        '''
+        con = sqlite3.connect(self.db_path)
+        try:
+            with con:
+                cur = con.cursor()
+                for _, stmnt in COUNTERS:
+                    cur.execute(stmnt)
+                cur.execute("SELECT EXISTS (SELECT 1 FROM user_counters) \
+                             OR EXISTS (SELECT 1 FROM message_counters)")
+                if not cur.fetchone()[0]:
+                    cur.execute("INSERT INTO user_counters \
+                                 SELECT user_nickname, COUNT(*), \
+                                        MAX(timestamp) \
+                                 FROM messages \
+                                 WHERE user_nickname IS NOT NULL \
+                                 GROUP BY user_nickname")
+                    cur.execute("INSERT INTO message_counters \
+                                 SELECT reply_to, COUNT(*), MAX(timestamp) \
+                                 FROM messages WHERE reply_to IS NOT NULL \
+                                 GROUP BY reply_to")
+        except sqlite3.Error, excp:
+            print "Error %s:" % excp.args[0]
+            return False
+        finally:
+            con.close()
+        return True
 
     def populate_tables(self, dump=None):
         '''
@@ -123,11 +877,238 @@ class Engine(object):
             sql = f.read()
             cur = con.cursor()
             cur.executescript(sql)
+        self.versions.bump(*TABLES)
+
+    def bulk_load(self, sources):
+        '''
+        Loads rows from CSV or JSON Lines files, for migrations and
+        restores of big forums. It is much faster than
+        :py:meth:`populate_tables`, whose dump is parsed one INSERT
+        statement at a time.
+
+        The rows of each file are inserted with one ``executemany``, all the
+        files in a single transaction. The indexes in ``INDEXES`` are
+        dropped before inserting and built again at the end, once. Foreign
+        keys are checked when the transaction is committed, so messages may
+        reply to messages later in the file.
+
+        The first row of a CSV file contains the names of the columns and
+        empty values are NULL. Every line of a JSON Lines file is an object
+        with the columns as keys. Columns that are not given are NULL.
+
+        :Example:
+
+        >>> engine.bulk_load({'users': 'users.csv',
+        ...                   'users_profile': 'profiles.csv',
+        ...                   'messages': 'messages.jsonl'})
+        {'tables': {'users': 120, 'users_profile': 120, 'messages': 50000},
+         'rows': 50240, 'seconds': 0.61, 'rows_per_second': 82360.6}
+
+        :param dict sources: Paths of the files by table. The tables are
+            the ones in ``BULK_LOAD_TABLES`` and the format is given by the
+            extension of the file (``BULK_LOAD_FORMATS``).
+        :return: a dictionary with the rows inserted in each table
+            (``tables``), the total of rows (``rows``), the ``seconds`` it
+            took and the ``rows_per_second``.
+        :raises ValueError: if a table, a file format or a column is not
+            supported.
+        :raises sqlite3.Error: if the rows could not be inserted, e.g. they
+            break a constraint. Nothing is inserted then.
+
+        '''
+        for table, path in sources.iteritems():
+            if table not in BULK_LOAD_TABLES:
+                raise ValueError("Table %s cannot be bulk loaded" % table)
+            if os.path.splitext(path)[1].lower() not in BULK_LOAD_FORMATS:
+                raise ValueError("Unknown file format of %s" % path)
+        start = time.time()
+        counts = {}
+        con = sqlite3.connect(self.db_path)
+        #Transactions are handled here, the sqlite3 module would commit
+        #before dropping the indexes
+        con.isolation_level = None
+        try:
+            cur = con.cursor()
+            cur.execute('PRAGMA foreign_keys = ON')
+            cur.execute('BEGIN')
+            try:
+                cur.execute('PRAGMA defer_foreign_keys = ON')
+                for name, _ in INDEXES:
+                    cur.execute('DROP INDEX IF EXISTS %s' % name)
+                for table in BULK_LOAD_TABLES:
+                    if table in sources:
+                        counts[table] = _bulk_insert(cur, table,
+                                                     sources[table])
+                for _, stmnt in INDEXES:
+                    cur.execute(stmnt)
+                cur.execute('COMMIT')
+            except:
+                cur.execute('ROLLBACK')
+                raise
+        finally:
+            con.close()
+        self.versions.bump(*counts)
+        seconds = time.time() - start
+        rows = sum(counts.itervalues())
+        return {'tables': counts, 'rows': rows, 'seconds': seconds,
+                'rows_per_second': rows / seconds if seconds else None}
+
+    #PARTITIONS
+    def create_partition(self, name, start, end, path=None):
+        '''
+        Moves the messages of the time range [``start``, ``end``) to a new
+        SQLite file, registered in the table ``message_partitions``. The
+        main database keeps the rest of the messages, including the new
+        ones, so it does not grow without bound.
+
+        The messages are read by :py:meth:`Connection.get_message` and by
+        the message lists (:py:meth:`Connection.get_messages`), which
+        attach the file when a window overlaps its range. Archived messages
+        are read-only: they cannot be modified, deleted or replied to, and
+        they are not found by :py:meth:`Connection.search_messages` or
+        :py:meth:`Connection.get_thread`. They still count in the counters
+        of their senders and of their parents. Their replies that stay in
+        the main database keep pointing to them. A deleted user is not
+        removed from the partitions, but the messages of the user are
+        listed without sender, as if the foreign key set it to NULL.
+
+        :Example:
+
+        >>> engine.create_partition('2013', 1356998400, 1388534400)
+        19
+
+        :param str name: Name of the partition, made of letters, digits and
+            underscores.
+        :param start: UNIX timestamp of the first second of the range.
+        :param end: UNIX timestamp following the last second of the range.
+        :param str path: Path of the new file. If not specified, it is the
+            path of the database with the name before the extension, e.g.
+            *db/forum.2013.db*.
+        :return: the number of messages moved.
+        :raises ValueError: if the name is malformed or already used, the
+            range is empty or overlaps another partition, the file exists,
+            there are already ``MAX_PARTITIONS`` partitions or the range
+            contains the message with the largest id.
+
+        '''
+        if not isinstance(name, basestring) or \
+           _PARTITION_NAME.match(name) is None:
+            raise ValueError("The partition name is malformed")
+        if start >= end:
+            raise ValueError("The partition range is empty")
+        if path is None:
+            root, ext = os.path.splitext(self.db_path)
+            path = '%s.%s%s' % (root, name, ext)
+        if os.path.exists(path):
+            raise ValueError("The file %s already exists" % path)
+        schema = PARTITION_PREFIX + name
+        con = sqlite3.connect(self.db_path)
+        #Transactions are handled here, the sqlite3 module would commit
+        #before dropping the trigger
+        con.isolation_level = None
+        try:
+            cur = con.cursor()
+            cur.execute('PRAGMA busy_timeout = %d' % self.busy_timeout)
+            #The messages are moved, not deleted: their replies must not be
+            #deleted by ON DELETE CASCADE
+            cur.execute('PRAGMA foreign_keys = OFF')
+            cur.execute('ATTACH DATABASE ? AS %s' % schema, (path,))
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                moved = self._move_messages(cur, name, path, schema, start,
+                                            end)
+                cur.execute('COMMIT')
+            except:
+                cur.execute('ROLLBACK')
+                raise
+        except:
+            con.close()
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        con.close()
+        self.versions.bump('messages')
+        return moved
+
+    def _move_messages(self, cur, name, path, schema, start, end):
+        '''
+        Runs the statements of :py:meth:`create_partition` in its
+        transaction.
+
+        :return: the number of messages moved.
+        '''
+        for _, stmnt in PARTITIONS:
+            cur.execute(stmnt)
+        cur.execute('SELECT COUNT(*) FROM message_partitions')
+        if cur.fetchone()[0] >= MAX_PARTITIONS:
+            raise ValueError("There are already %d partitions" %
+                             MAX_PARTITIONS)
+        cur.execute('SELECT name FROM message_partitions \
+                     WHERE name = ? OR (start_time < ? AND end_time > ?)',
+                    (name, end, start))
+        row = cur.fetchone()
+        if row is not None:
+            raise ValueError("The partition overlaps the partition %s" %
+                             row[0])
+        #New rows take the largest message_id plus one, so moving the last
+        #message would give its id to the next message
+        cur.execute('SELECT MAX(message_id) FROM messages')
+        last = cur.fetchone()[0]
+        cur.execute('SELECT MAX(message_id) FROM messages \
+                     WHERE timestamp >= ? AND timestamp < ?', (start, end))
+        if last is not None and cur.fetchone()[0] == last:
+            raise ValueError("The last message cannot be moved to a "
+                             "partition")
+        cur.execute(PARTITION_MESSAGES_TABLE % schema)
+        cur.execute('INSERT INTO %s.messages SELECT %s FROM main.messages \
+                     WHERE timestamp >= ? AND timestamp < ? \
+                     ORDER BY message_id' % (schema, MESSAGE_COLUMNS),
+                    (start, end))
+        moved = cur.rowcount
+        #Built after the inserts, like in bulk_load
+        for index, stmnt in INDEXES:
+            if index.startswith('messages_'):
+                cur.execute(stmnt.replace(' ' + index,
+                                          ' %s.%s' % (schema, index), 1))
+        #The counters keep the moved messages. The search index drops them
+        #through its trigger.
+        cur.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' \
+                     AND name = 'messages_counters_delete'")
+        trigger = cur.fetchone()
+        if trigger is not None:
+            cur.execute('DROP TRIGGER messages_counters_delete')
+        cur.execute('DELETE FROM main.messages \
+                     WHERE timestamp >= ? AND timestamp < ?', (start, end))
+        if trigger is not None:
+            cur.execute(trigger[0])
+        cur.execute('INSERT INTO message_partitions VALUES (?, ?, ?, ?)',
+                    (name, path, start, end))
+        return moved
+
+    def partitions(self):
+        '''
+        :return: the partitions of the messages, oldest first, as
+            dictionaries with the keys ``name``, ``path``, ``start`` and
+            ``end``. Check :py:meth:`create_partition`.
+        '''
+        if not os.path.exists(self.db_path):
+            return []
+        con = sqlite3.connect(self.db_path)
+        try:
+            rows = _read_partitions(con.cursor(),
+                                    'SELECT name, path, start_time, end_time \
+                                     FROM message_partitions \
+                                     ORDER BY start_time')
+        finally:
+            con.close()
+        return [{'name': name, 'path': path, 'start': start, 'end': end}
+                for name, path, start, end in rows]
 
     #METHODS TO CREATE THE TABLES PROGRAMMATICALLY WITHOUT USING SQL SCRIPT
     def create_messages_table(self):
         '''
-        Create the table ``messages`` programmatically, without using .sql file.
+        Create the table ``messages``, its indexes and its counters
+        programmatically, without using .sql file.
 
         Print an error message in the console if it could not be created.
 
@@ -155,6 +1136,12 @@ class Engine(object):
                 cur.execute(keys_on)
                 #execute the statement
                 cur.execute(stmnt)
+                #and the indexes and counters of the table
+                for name, index_stmnt in INDEXES:
+                    if name.startswith('messages_'):
+                        cur.execute(index_stmnt)
+                for _, index_stmnt in SEARCH_INDEX + COUNTERS + PARTITIONS:
+                    cur.execute(index_stmnt)
             except sqlite3.Error, excp:
                 print "Error %s:" % excp.args[0]
                 return False
@@ -162,7 +1149,8 @@ class Engine(object):
 
     def create_users_table(self):
         '''
-        Create the table ``users`` programmatically, without using .sql file.
+        Create the table ``users`` and its indexes programmatically, without
+        using .sql file.
 
         Print an error message in the console if it could not be created.
 
@@ -185,6 +1173,10 @@ class Engine(object):
                 cur.execute(keys_on)
                 #execute the statement
                 cur.execute(stmnt)
+                #and the indexes of the table
+                for name, index_stmnt in INDEXES:
+                    if name.startswith('users_'):
+                        cur.execute(index_stmnt)
             except sqlite3.Error, excp:
                 print "Error %s:" % excp.args[0]
                 return False
@@ -262,6 +1254,628 @@ class Engine(object):
         return None
 
 
+def parse_message_id(messageid, name='messageid'):
+    '''
+    :param str messageid: Id of a message, with the format ``msg-\d+``.
+    :param str name: Name of the parameter, for the error message.
+    :return: the message_id of the message in the database.
+    :raises ValueError: if ``messageid`` is malformed or out of the range of
+        64-bit integers.
+
+    '''
+    match = _MESSAGE_ID.match(messageid) \
+        if isinstance(messageid, basestring) else None
+    if match is not None:
+        value = int(match.group(1))
+        if value <= MAX_MESSAGE_ID:
+            return value
+    raise ValueError("The %s is malformed" % name)
+
+
+def _check_pragma(name, value):
+    '''
+    Validates a PRAGMA before it is formatted into a statement.
+
+    :raises ValueError: if the PRAGMA is not supported or the value is not a
+        number or a keyword.
+
+    '''
+    if name not in SUPPORTED_PRAGMAS:
+        raise ValueError("Unsupported PRAGMA %s" % name)
+    if re.match(r'^-?\w+$', str(value)) is None:
+        raise ValueError("Malformed value for PRAGMA %s" % name)
+
+
+def _bulk_insert(cur, table, path):
+    '''
+    Inserts the rows of the CSV or JSON Lines file ``path`` into ``table``
+    using the cursor ``cur``. Check :py:meth:`Engine.bulk_load`.
+
+    :return: the number of inserted rows.
+    :raises ValueError: if the file has a column that ``table`` has not.
+    '''
+    cur.execute('PRAGMA table_info(%s)' % table)
+    columns = [row[1] for row in cur.fetchall()]
+    stmnt = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        table, ', '.join(columns), ', '.join('?' * len(columns)))
+    read = _read_csv if BULK_LOAD_FORMATS[
+        os.path.splitext(path)[1].lower()] == 'csv' else _read_jsonl
+
+    def rows(records):
+        for record in records:
+            unknown = set(record).difference(columns)
+            if unknown:
+                raise ValueError("%s has no columns %s" %
+                                 (table, ', '.join(sorted(unknown))))
+            yield tuple(record.get(column) for column in columns)
+
+    with open(path, 'rb') as f:
+        cur.executemany(stmnt, rows(read(f)))
+    return cur.rowcount
+
+
+def _read_csv(f):
+    '''
+    :return: a generator of the rows of the UTF-8 CSV file ``f`` as
+        dictionaries. Empty values are None.
+    '''
+    reader = csv.DictReader(f)
+    for record in reader:
+        if None in record:
+            raise ValueError("Line %d has more values than columns" %
+                             reader.line_num)
+        yield dict((column, value.decode('utf-8') if value else None)
+                   for column, value in record.iteritems())
+
+
+def _read_jsonl(f):
+    '''
+    :return: a generator of the objects in the JSON Lines file ``f``.
+    '''
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError("Malformed JSON in line %d" % number)
+        if not isinstance(record, dict):
+            raise ValueError("Line %d is not a JSON object" % number)
+        yield record
+
+
+#Whether sqlite3 opens URI filenames. Probed once by _uri_filenames.
+_URI_FILENAMES = None
+
+
+def _uri_filenames():
+    '''
+    Checks whether the sqlite3 module opens URI filenames. The sqlite3 module
+    of Python 2 does not ask SQLite for them, so they only work if the
+    library is compiled with SQLITE_USE_URI. Otherwise a URI is opened as a
+    relative path: the read-only connections would create a stray file
+    called "file:...".
+
+    :return: True if URI filenames are supported.
+    '''
+    global _URI_FILENAMES
+    if _URI_FILENAMES is None:
+        con = sqlite3.connect(':memory:')
+        try:
+            #An in-memory database with URIs. Without them, a file in the
+            #missing directory "file:forum-probe", which is not created.
+            con.execute("ATTACH DATABASE 'file:forum-probe/probe?mode=memory' "
+                        "AS probe")
+            _URI_FILENAMES = True
+        except sqlite3.OperationalError:
+            _URI_FILENAMES = False
+        finally:
+            con.close()
+    return _URI_FILENAMES
+
+
+def _read_only_filename(db_path):
+    '''
+    :return: the URI filename opening ``db_path`` in read-only mode or, if
+        URI filenames are not supported, the absolute path of ``db_path``.
+        Those connections must set the PRAGMA query_only.
+    '''
+    if not _uri_filenames():
+        return os.path.abspath(db_path)
+    return 'file:%s?mode=ro' % urllib.pathname2url(os.path.abspath(db_path))
+
+
+def _read_partitions(cur, query, pvalue=()):
+    '''
+    Executes ``query`` over the table ``message_partitions`` using the
+    cursor ``cur``.
+
+    :return: the rows of the result. A list without rows if the database
+        was created before the partitions were added.
+    '''
+    try:
+        cur.execute(query, pvalue)
+    except sqlite3.OperationalError, excp:
+        if 'no such table' not in str(excp):
+            raise
+        return []
+    return cur.fetchall()
+
+
+def _wal_checkpoint(con, mode, busy_timeout):
+    '''
+    Runs ``PRAGMA wal_checkpoint`` in the sqlite3 connection ``con``.
+
+    :return: the tuple (busy, log, checkpointed)
+    '''
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError("Unknown checkpoint mode %s" % mode)
+    cur = con.cursor()
+    cur.execute('PRAGMA busy_timeout = %d' % busy_timeout)
+    cur.execute('PRAGMA wal_checkpoint(%s)' % mode)
+    return tuple(cur.fetchone())
+
+
+class Checkpointer(threading.Thread):
+    '''
+    Daemon thread that checkpoints the WAL file of a database periodically,
+    so the WAL does not grow when there is always a reader preventing the
+    automatic checkpoints from completing.
+
+    An instance of this class should not be instantiated directly. Use
+    :py:meth:`Engine.start_checkpointer`.
+
+    :param str db_path: Location of the database file.
+    :param interval: Seconds between checkpoints.
+    :param str mode: One of ``CHECKPOINT_MODES``.
+    :param int busy_timeout: Milliseconds to wait for locks.
+
+    '''
+    def __init__(self, db_path, interval, mode='PASSIVE',
+                 busy_timeout=DEFAULT_BUSY_TIMEOUT):
+        super(Checkpointer, self).__init__(name='forum-checkpointer')
+        self.daemon = True
+        self.db_path = db_path
+        self.interval = interval
+        self.mode = mode
+        self.busy_timeout = busy_timeout
+        #Counters: number of checkpoints, how many were incomplete (busy)
+        #and the result of the last one.
+        self.checkpoints = 0
+        self.busy = 0
+        self.last_result = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        con = sqlite3.connect(self.db_path)
+        try:
+            while not self._stop_event.wait(self.interval):
+                try:
+                    result = _wal_checkpoint(con, self.mode,
+                                             self.busy_timeout)
+                except sqlite3.Error, excp:
+                    print "Error %s:" % excp.args[0]
+                    continue
+                self.checkpoints += 1
+                self.busy += result[0]
+                self.last_result = result
+        finally:
+            con.close()
+
+    def stop(self, timeout=None):
+        '''
+        Asks the thread to finish and waits until it does.
+
+        '''
+        self._stop_event.set()
+        self.join(timeout)
+
+
+
+class WriteFuture(object):
+    '''
+    Result of an operation submitted to a :py:class:`WriteBehindQueue`. It
+    is set once the transaction including the operation has finished.
+
+    An instance of this class should not be instantiated directly. Use
+    :py:meth:`Engine.submit`.
+
+    '''
+    def __init__(self):
+        super(WriteFuture, self).__init__()
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        '''
+        :return: True if the operation has been committed or has failed.
+        '''
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        '''
+        Waits until the operation has been committed.
+
+        :param timeout: Seconds to wait. None waits forever.
+        :return: the return value of the operation.
+        :raises sqlite3.OperationalError: if the operation has not finished
+            within ``timeout`` seconds.
+        :raises: the exception of the operation or of the commit, if any.
+
+        '''
+        if not self._done.wait(timeout):
+            raise sqlite3.OperationalError("Timeout waiting for the write")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def _set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def _set_exception(self, exception):
+        self._exception = exception
+        self._done.set()
+
+
+#Ends the thread of a WriteBehindQueue
+_STOP_WRITER = object()
+
+
+class WriteBehindQueue(threading.Thread):
+    '''
+    Daemon thread that runs the write operations of the application with its
+    own connection and commits them in groups: the operations waiting in
+    the queue, up to ``max_batch``, are run in one transaction, each one in
+    a savepoint, so a failing operation does not undo the rest. The first
+    operation of a transaction waits at most ``max_latency`` seconds for
+    other operations to join it.
+
+    The callers get a :py:class:`WriteFuture`, set after the commit, so an
+    operation is as durable as when it commits itself. The commit, and its
+    fsync, is shared by the operations of the transaction.
+
+    An instance of this class should not be instantiated directly. Use
+    :py:meth:`Engine.submit`.
+
+    :param connect: callable returning the :py:class:`Connection` of the
+        thread.
+    :param int max_batch: Maximum number of operations per transaction.
+    :param max_latency: Seconds the first operation waits for others.
+
+    '''
+    def __init__(self, connect, max_batch=DEFAULT_WRITE_BATCH_SIZE,
+                 max_latency=DEFAULT_WRITE_LATENCY):
+        super(WriteBehindQueue, self).__init__(name='forum-writer')
+        self.daemon = True
+        self.connect = connect
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        #Counters: committed transactions, operations run and failed
+        self.batches = 0
+        self.writes = 0
+        self.errors = 0
+        #Exception that stopped the thread, if any. Check _fail
+        self.failure = None
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+
+    def submit(self, method, *args, **kwargs):
+        '''
+        Enqueues a call to the :py:class:`Connection` method ``method``.
+
+        :return: a :py:class:`WriteFuture`
+        :raises ValueError: if the method is not in ``WRITE_BEHIND_METHODS``.
+        :raises sqlite3.OperationalError: if the thread has stopped because
+            of an error.
+
+        '''
+        if method not in WRITE_BEHIND_METHODS:
+            raise ValueError("%s cannot be run by the writer" % method)
+        future = WriteFuture()
+        with self._lock:
+            if self.failure is not None:
+                raise sqlite3.OperationalError("The writer has stopped: %s" %
+                                               self.failure)
+            self._queue.put((future, method, args, kwargs))
+        return future
+
+    def run(self):
+        connection = None
+        batch = []
+        try:
+            connection = self.connect()
+            #The transactions and savepoints are managed by this thread
+            connection.con.isolation_level = None
+            stopping = False
+            while not stopping:
+                batch = self._next_batch()
+                if batch[-1] is _STOP_WRITER:
+                    stopping = True
+                    batch.pop()
+                if batch:
+                    self._run_batch(connection, batch)
+        except Exception, excp:
+            self._fail(excp, batch)
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def _fail(self, excp, batch):
+        '''
+        Stops accepting operations after the error ``excp`` and sets it as
+        the exception of the operations of ``batch`` and of the queue, so
+        that no caller waits forever.
+        '''
+        with self._lock:
+            self.failure = excp
+        pending = [item for item in batch if item is not _STOP_WRITER]
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except Queue.Empty:
+                break
+        for item in pending:
+            if item is not _STOP_WRITER and not item[0].done():
+                self.errors += 1
+                item[0]._set_exception(excp)
+
+    def stop(self, timeout=None):
+        '''
+        Asks the thread to finish once the operations already submitted are
+        committed and waits until it does.
+
+        '''
+        self._queue.put(_STOP_WRITER)
+        self.join(timeout)
+
+    def _next_batch(self):
+        '''
+        :return: the operations of the next transaction, ending with
+            ``_STOP_WRITER`` if the thread has to finish.
+        '''
+        batch = [self._queue.get()]
+        deadline = time.time() + self.max_latency
+        while len(batch) < self.max_batch and batch[-1] is not _STOP_WRITER:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def _run_batch(self, connection, batch):
+        con = connection.con
+        done = []
+        changed = set()
+        try:
+            #Take the write lock first, waiting for it in the busy handler
+            con.execute('BEGIN IMMEDIATE')
+            for future, method, args, kwargs in batch:
+                connection._group = set()
+                con.execute('SAVEPOINT write_behind')
+                try:
+                    result = getattr(connection, method)(*args, **kwargs)
+                except Exception, excp:
+                    con.execute('ROLLBACK TO write_behind')
+                    con.execute('RELEASE write_behind')
+                    self.errors += 1
+                    future._set_exception(excp)
+                    continue
+                finally:
+                    tables, connection._group = connection._group, None
+                con.execute('RELEASE write_behind')
+                changed.update(tables)
+                done.append((future, result))
+            con.execute('COMMIT')
+        except sqlite3.Error, excp:
+            #The transaction failed: none of the operations was committed
+            try:
+                con.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            for future, _, _, _ in batch:
+                if not future.done():
+                    self.errors += 1
+                    future._set_exception(excp)
+            return
+        self.batches += 1
+        self.writes += len(done)
+        if changed:
+            connection._changed(*changed)
+        for future, result in done:
+            future._set_result(result)
+
+
+class ConnectionPool(object):
+    '''
+    Bounded pool of reusable :py:class:`Connection` instances.
+
+    Connections are opened lazily by ``factory`` until ``size`` connections
+    exist. Each connection is checked out by one thread at a time; nested
+    checkouts from the same thread return the same connection. Idle
+    connections are closed after ``idle_timeout`` seconds and, when they
+    have been idle longer than ``health_check_interval`` seconds, they are
+    probed with ``SELECT 1`` before being handed out again.
+
+    An instance of this class should not be instantiated directly. Use the
+    pool created by :py:class:`Engine`.
+
+    :param factory: callable returning a new :py:class:`Connection`.
+    :param int size: maximum number of open connections.
+    :param timeout: seconds to wait for a free connection.
+    :param idle_timeout: seconds an idle connection is kept open.
+    :param health_check_interval: idle seconds before a connection is probed.
+
+    '''
+    def __init__(self, factory, size=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_POOL_TIMEOUT,
+                 idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT,
+                 health_check_interval=DEFAULT_POOL_HEALTH_CHECK_INTERVAL):
+        super(ConnectionPool, self).__init__()
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        #Idle connections as (connection, last_used) tuples. Newest at the end
+        self._idle = deque()
+        #Number of open connections, both idle and checked out
+        self._opened = 0
+        #Incremented by dispose() to retire connections checked out before.
+        self._generation = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._local = threading.local()
+        self._counters = {'created': 0, 'checkouts': 0, 'checkins': 0,
+                          'waits': 0, 'timeouts': 0, 'evicted': 0,
+                          'discarded': 0}
+
+    def checkout(self):
+        '''
+        Returns a connection for the calling thread.
+
+        :rtype: Connection
+        :raises sqlite3.OperationalError: if no connection is available after
+            :py:attr:`timeout` seconds.
+
+        '''
+        local = self._local
+        connection = getattr(local, 'connection', None)
+        if connection is not None:
+            local.depth += 1
+            return connection
+        connection = self._checkout()
+        local.connection = connection
+        local.depth = 1
+        return connection
+
+    def _checkout(self):
+        deadline = time.time() + self.timeout
+        with self._cond:
+            while True:
+                self._evict_idle()
+                while self._idle:
+                    #LIFO: the most recently used connection is the warmest
+                    connection, last_used = self._idle.pop()
+                    if time.time() - last_used > self.health_check_interval \
+                       and not self._is_healthy(connection):
+                        self._discard(connection)
+                        continue
+                    self._counters['checkouts'] += 1
+                    return connection
+                if self._opened < self.size:
+                    self._opened += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise sqlite3.OperationalError(
+                        "Timeout waiting for a database connection")
+                self._counters['waits'] += 1
+                self._cond.wait(remaining)
+            generation = self._generation
+        #Open the new connection outside the lock
+        try:
+            connection = self.factory()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+        connection._pool_generation = generation
+        with self._cond:
+            self._counters['created'] += 1
+            self._counters['checkouts'] += 1
+        return connection
+
+    def checkin(self, connection):
+        '''
+        Commits the pending changes of ``connection`` and returns it to the
+        pool. Connections that cannot commit are closed instead. Read-only
+        connections have nothing to commit: their transaction is ended.
+
+        :param connection: a connection obtained with :py:meth:`checkout`
+        :type connection: Connection
+
+        '''
+        local = self._local
+        if getattr(local, 'connection', None) is connection:
+            local.depth -= 1
+            if local.depth > 0:
+                return
+            local.connection = None
+        try:
+            if connection.read_only:
+                connection.con.rollback()
+            else:
+                connection.con.commit()
+            reusable = True
+        except sqlite3.Error:
+            reusable = False
+        with self._cond:
+            self._counters['checkins'] += 1
+            if reusable and \
+               connection._pool_generation == self._generation:
+                self._idle.append((connection, time.time()))
+            else:
+                self._discard(connection)
+            self._cond.notify()
+
+    def dispose(self):
+        '''
+        Closes all idle connections. Connections currently checked out are
+        closed when they are returned.
+
+        '''
+        with self._cond:
+            self._generation += 1
+            while self._idle:
+                connection, _ = self._idle.pop()
+                self._discard(connection)
+            self._cond.notify_all()
+
+    def stats(self):
+        '''
+        :return: a dictionary with the keys ``size``, ``opened``, ``idle``,
+            ``in_use`` and the counters ``created``, ``checkouts``,
+            ``checkins``, ``waits``, ``timeouts``, ``evicted`` and
+            ``discarded``.
+        '''
+        with self._cond:
+            stats = dict(self._counters)
+            stats['size'] = self.size
+            stats['opened'] = self._opened
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._opened - len(self._idle)
+        return stats
+
+    #HELPERS. They must be called holding the lock.
+    def _evict_idle(self):
+        now = time.time()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            connection, _ = self._idle.popleft()
+            self._discard(connection, 'evicted')
+
+    def _is_healthy(self, connection):
+        try:
+            connection.con.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, connection, counter='discarded'):
+        self._opened -= 1
+        self._counters[counter] += 1
+        try:
+            connection.con.close()
+        except sqlite3.Error:
+            pass
+
+
 class Connection(object):
     '''
     API to access the Forum database.
@@ -278,11 +1892,95 @@ class Connection(object):
 
     :param db_path: Location of the database file.
     :type dbpath: str
+    :param bool check_same_thread: If False, the connection can be used from
+        a thread different from the one that created it. Used by the pool.
+    :param pragmas: sequence of (name, value) tuples applied once when the
+        connection is opened. If not specified, ``DEFAULT_PRAGMAS`` is used.
+    :param int cached_statements: Number of prepared statements cached by
+        the connection.
+    :param versions: :py:class:`TableVersions` notified of the changes
+        committed by this connection, or None.
+    :param bool read_only: If True, the database is opened in read-only mode
+        and the methods modifying it raise ``sqlite3.OperationalError``.
+        Without URI filenames, the database is opened as usual and the
+        PRAGMA query_only is set.
+    :raises sqlite3.NotSupportedError: if ``read_only`` is True, but
+        neither URI filenames nor query_only are supported.
 
     '''
-    def __init__(self, db_path):
+    def __init__(self, db_path, check_same_thread=True, pragmas=None,
+                 cached_statements=DEFAULT_STATEMENT_CACHE_SIZE,
+                 versions=None, read_only=False):
         super(Connection, self).__init__()
-        self.con = sqlite3.connect(db_path)
+        self.read_only = read_only
+        #Tables changed by the operation run by a WriteBehindQueue, which
+        #commits them, or None if the methods commit their own changes.
+        self._group = None
+        #Schemas of the partitions attached to the connection
+        self._attached = set()
+        if read_only:
+            if not _uri_filenames() and \
+               sqlite3.sqlite_version_info < (3, 8, 0):
+                raise sqlite3.NotSupportedError(
+                    "Read-only connections need URI filenames or SQLite 3.8.0")
+            db_path = _read_only_filename(db_path)
+        self.con = sqlite3.connect(db_path,
+                                   check_same_thread=check_same_thread,
+                                   cached_statements=cached_statements)
+        if read_only and not _uri_filenames():
+            #Also applies to the attached partitions
+            self.con.execute('PRAGMA query_only = ON')
+        self.versions = versions
+        if pragmas is None:
+            pragmas = DEFAULT_PRAGMAS
+        if read_only:
+            pragmas = [(name, value) for name, value in pragmas
+                       if name not in PERSISTENT_PRAGMAS]
+        self.apply_pragmas(pragmas)
+
+    def apply_pragmas(self, pragmas):
+        '''
+        Executes the given PRAGMAs on this connection. The database methods
+        rely on these settings (e.g. foreign keys support) instead of
+        setting them before every statement.
+
+        :param pragmas: sequence of (name, value) tuples.
+        :raises ValueError: if a PRAGMA is not supported or malformed.
+
+        '''
+        cur = self.con.cursor()
+        for name, value in pragmas:
+            _check_pragma(name, value)
+            cur.execute('PRAGMA %s = %s' % (name, value))
+
+    def _changed(self, *tables):
+        '''
+        Notifies :py:attr:`versions` of a change committed to ``tables``.
+        '''
+        if self._group is not None:
+            #Notified by the WriteBehindQueue after the commit
+            self._group.update(tables)
+        elif self.versions is not None:
+            self.versions.bump(*tables)
+
+    def _commit(self):
+        '''
+        Commits the changes of a write method, unless it is run by a
+        :py:class:`WriteBehindQueue`, which commits them later.
+        '''
+        if self._group is None:
+            self.con.commit()
+
+    def _rollback(self):
+        '''
+        Undoes the changes of a write method. Run by a
+        :py:class:`WriteBehindQueue`, only the changes of the method are
+        undone.
+        '''
+        if self._group is None:
+            self.con.rollback()
+        else:
+            self.con.execute('ROLLBACK TO write_behind')
 
     def close(self):
         '''
@@ -290,7 +1988,8 @@ class Connection(object):
 
         '''
         if self.con:
-            self.con.commit()
+            if not self.read_only:
+                self.con.commit()
             self.con.close()
 
     #FOREIGN KEY STATUS
@@ -320,7 +2019,8 @@ class Connection(object):
 
     def set_foreign_keys_support(self):
         '''
-        Activate the support for foreign keys.
+        Activate the support for foreign keys. Connections created by the
+        :py:class:`Engine` have it activated already when they are opened.
 
         :return: ``True`` if operation succeed and ``False`` otherwise.
 
@@ -402,6 +2102,8 @@ class Connection(object):
         Same as :py:meth:`_create_message_object`. However, the resulting
         dictionary is targeted to build messages in a list.
 
+        The row only needs the columns in ``MESSAGE_LIST_COLUMNS``.
+
         :param row: The row obtained from the database.
         :type row: sqlite3.Row
         :return: a dictionary with the keys ``messageid``, ``title``,
@@ -478,6 +2180,8 @@ class Connection(object):
         Same as :py:meth:`_create_message_object`. However, the resulting
         dictionary is targeted to build messages in a list.
 
+        The row only needs the columns in ``USER_LIST_COLUMNS``.
+
         :param row: The row obtained from the database.
         :type row: sqlite3.Row
         :return: a dictionary with the keys ``registrationdate`` and
@@ -493,7 +2197,7 @@ class Connection(object):
         Extracts a message from the database.
 
         :param messageid: The id of the message. Note that messageid is a
-            string with format ``msg-\d{1,3}``.
+            string with format ``msg-\d+``.
         :return: A dictionary with the format provided in
             :py:meth:`_create_message_object` or None if the message with target
             id does not exist.
@@ -501,12 +2205,7 @@ class Connection(object):
 
         '''
         #Extracts the int which is the id for a message in the database
-        match = re.match(r'msg-(\d{1,3})', messageid)
-        if match is None:
-            raise ValueError("The messageid is malformed")
-        messageid = int(match.group(1))
-        #Activate foreign key support
-        self.set_foreign_keys_support()
+        messageid = parse_message_id(messageid)
         #Create the SQL Query
         query = 'SELECT * FROM messages WHERE message_id = ?'
         #Cursor and row initialization
@@ -518,17 +2217,30 @@ class Connection(object):
         #Process the response.
         #Just one row is expected
         row = cur.fetchone()
+        #The message might have been moved to a partition
         if row is None:
-            return None
+            for schema in self._partitions():
+                cur.execute(_ARCHIVED_MESSAGE_STATEMENT % schema, pvalue)
+                row = cur.fetchone()
+                if row is not None:
+                    break
+            else:
+                return None
         #Build the return object
         return self._create_message_object(row)
 
     def get_messages(self, nickname=None, number_of_messages=-1,
-                     before=-1, after=-1):
+                     before=-1, after=-1, seek=None, backwards=False):
         '''
         Return a list of all the messages in the database filtered by the
         conditions provided in the parameters.
 
+        Messages are sorted from newest to oldest by (timestamp, message_id).
+        Pages of a long list are obtained with keyset pagination: pass in
+        ``seek`` the key of the last message of the previous page and only
+        the messages that follow it are returned. The cost of a page does not
+        depend on how many pages precede it.
+
         :param nickname: default None. Search messages of a user with the given
             nickname. If this parameter is None, it returns the messages of
             any user in the system.
@@ -542,11 +2254,18 @@ class Connection(object):
         :param after: All timestamps < ``after`` (UNIX timestamp) are removed.
             If set to -1, this condition is not applied.
         :type after: long
+        :param seek: default None. Tuple (timestamp, message_id) of a message,
+            where message_id is the integer id in the database. Only messages
+            older than it are returned.
+        :type seek: tuple
+        :param bool backwards: default False. If True, the messages newer
+            than ``seek`` are returned instead (previous page). The list is
+            still sorted from newest to oldest.
 
         :return: A list of messages. Each message is a dictionary containing
             the following keys:
 
-            * ``messageid``: string with the format msg-\d{1,3}.Id of the
+            * ``messageid``: string with the format msg-\d+.Id of the
                 message.
             * ``sender``: nickname of the message's author.
             * ``title``: string containing the title of the message.
@@ -560,62 +2279,226 @@ class Connection(object):
             timestamps
 
         '''
-        #Create the SQL Statement build the string depending on the existence
-        #of nickname, numbero_of_messages, before and after arguments.
-        query = 'SELECT * FROM messages'
-          #Nickname restriction
-        if nickname is not None or before != -1 or after != -1:
-            query += ' WHERE'
-        if nickname is not None:
-            query += " user_nickname = '%s'" % nickname
-          #Before restriction
-        if before != -1:
-            if nickname is not None:
-                query += ' AND'
-            query += " timestamp < %s" % str(before)
-          #After restriction
-        if after != -1:
-            if nickname is not None or before != -1:
-                query += ' AND'
-            query += " timestamp > %s" % str(after)
-          #Order of results
-        query += ' ORDER BY timestamp DESC'
-          #Limit the number of resulst return
-        if number_of_messages > -1:
-            query += ' LIMIT ' + str(number_of_messages)
-        #Activate foreign key support
-        self.set_foreign_keys_support()
+        return list(self.iter_messages(nickname, number_of_messages, before,
+                                       after, seek, backwards))
+
+    def iter_messages(self, nickname=None, number_of_messages=-1,
+                      before=-1, after=-1, seek=None, backwards=False):
+        '''
+        Same as :py:meth:`get_messages`, but the messages are read from the
+        cursor as they are iterated, so a long list is never in memory.
+
+        The query is executed when the first message is requested. The
+        messages of a backwards page are read at once, since they have to be
+        reversed.
+
+        :return: a generator of messages with the format of
+            :py:meth:`get_messages`.
+
+        '''
+        query, pvalue = self._messages_query(nickname, number_of_messages,
+                                             before, after, seek, backwards)
         #Cursor and row initialization
         self.con.row_factory = sqlite3.Row
         cur = self.con.cursor()
         #Execute main SQL Statement
-        cur.execute(query)
-        #Get results
-        rows = cur.fetchall()
-        if rows is None:
-            return None
+        cur.execute(query, pvalue)
+        rows = cur
+        if seek is not None and backwards:
+            rows = reversed(cur.fetchall())
         #Build the return object
-        messages = []
         for row in rows:
+            yield self._create_message_list_object(row)
+
+    def search_messages(self, text, number_of_messages=-1, seek=None):
+        '''
+        Returns the messages whose title or body contain all the words of
+        ``text``, from the most relevant (BM25 ranking of SQLite FTS5).
+
+        Long results are read in pages using keyset pagination: pass in
+        ``seek`` the tuple (``rank``, id) of the last message of the
+        previous page.
+
+        :param str text: The words to search, separated by spaces.
+        :param int number_of_messages: default -1. Maximum number of
+            messages returned. -1 means no limit.
+        :param tuple seek: default None. (rank, message_id) of the message
+            preceding the page. message_id is an int.
+        :return: a list of messages with the format of
+            :py:meth:`get_messages` plus the key ``rank``. Lower ranks are
+            more relevant.
+        :raises ValueError: if ``text`` has no words.
+
+        '''
+        query = _fts_query(text)
+        rank, message_id = seek if seek is not None else (None, None)
+        self.con.row_factory = sqlite3.Row
+        cur = self.con.cursor()
+        cur.execute(_SEARCH_STATEMENT, (query, rank, rank, message_id,
+                                        number_of_messages))
+        messages = []
+        for row in cur:
             message = self._create_message_list_object(row)
+            message['rank'] = row['rank']
             messages.append(message)
         return messages
 
+    def _messages_query(self, nickname=None, number_of_messages=-1,
+                        before=-1, after=-1, seek=None, backwards=False):
+        '''
+        Builds the SQL statement executed by :py:meth:`get_messages`. The
+        arguments are the same.
+
+        The values are always passed as parameters, so the statement is one
+        of the few returned by :py:func:`_messages_statement` and it is found
+        in the sqlite3 statement cache of the connection.
+
+        :return: a tuple (query, parameters)
+
+        '''
+        pvalue = []
+        if nickname is not None:
+            pvalue.append(nickname)
+        if before != -1:
+            pvalue.append(before)
+        if after != -1:
+            pvalue.append(after)
+        if seek is not None:
+            pvalue.extend(seek)
+        schemas = self._partitions(before, after, seek, backwards)
+        #The same restrictions apply to every partition
+        pvalue *= len(schemas) + 1
+        #A negative LIMIT means no limit in SQLite
+        pvalue.append(number_of_messages)
+        query = _messages_statement(nickname is not None, before != -1,
+                                    after != -1, seek is not None,
+                                    seek is not None and backwards, schemas)
+        return query, tuple(pvalue)
+
+    def _partitions(self, before=-1, after=-1, seek=None, backwards=False):
+        '''
+        Attaches the partitions that may contain messages of the window
+        given by the arguments of :py:meth:`get_messages`. The rest of the
+        partitions are pruned. Check :py:meth:`Engine.create_partition`.
+
+        :return: a tuple with the schemas of the partitions, oldest first.
+
+        '''
+        query = 'SELECT name, path FROM message_partitions'
+        conditions = []
+        pvalue = []
+        if before != -1:
+            conditions.append('start_time < ?')
+            pvalue.append(before)
+        if after != -1:
+            conditions.append('end_time > ?')
+            pvalue.append(after)
+        if seek is not None:
+            conditions.append('end_time > ?' if backwards
+                              else 'start_time <= ?')
+            pvalue.append(seek[0])
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY start_time'
+        schemas = []
+        for name, path in _read_partitions(self.con.cursor(), query, pvalue):
+            schema = PARTITION_PREFIX + name
+            if schema not in self._attached:
+                #Partitions are never modified through a connection
+                self.con.execute('ATTACH DATABASE ? AS %s' % schema,
+                                 (_read_only_filename(path),))
+                self._attached.add(schema)
+            schemas.append(schema)
+        return tuple(schemas)
+
+    def get_thread(self, messageid, max_depth=-1, number_of_messages=-1,
+                   seek=None):
+        '''
+        Returns a message and all its replies, the replies to the replies
+        and so on, with one recursive query.
+
+        The messages are in depth-first order: every message is followed by
+        its replies, which are sorted by id. Long threads are read in pages
+        using keyset pagination: pass in ``seek`` the ``path`` of the last
+        message of the previous page.
+
+        :param messageid: The id of the root message, with format
+            ``msg-\d+``.
+        :param int max_depth: default -1. Replies deeper than ``max_depth``
+            levels below the root are not returned. -1 means no limit.
+        :param int number_of_messages: default -1. Maximum number of
+            messages returned. -1 means no limit.
+        :param str seek: default None. ``path`` of the message preceding
+            the page.
+        :return: a list of messages with the format of
+            :py:meth:`get_messages` plus the keys ``replyto`` (id of the
+            parent or None for the root), ``depth`` (0 for the root) and
+            ``path``, or None if the root message does not exist.
+        :raises ValueError: if ``messageid`` is malformed.
+
+        '''
+        messageid = parse_message_id(messageid)
+        self.con.row_factory = sqlite3.Row
+        cur = self.con.cursor()
+        cur.execute(_THREAD_STATEMENT, (messageid, max_depth, max_depth,
+                                        seek or '', number_of_messages))
+        messages = []
+        for row in cur:
+            message = self._create_message_list_object(row)
+            message['replyto'] = 'msg-' + str(row['reply_to']) \
+                if row['depth'] > 0 else None
+            message['depth'] = row['depth']
+            message['path'] = row['path']
+            messages.append(message)
+        if not messages and not self.contains_message('msg-%d' % messageid):
+            return None
+        return messages
+
+    def get_message_counters(self, messageid):
+        '''
+        Returns the counters of the direct replies to a message, which are
+        kept in the table ``message_counters``.
+
+        :param messageid: The id of the message, with format
+            ``msg-\d+``.
+        :return: a dictionary with the keys ``replycount`` (number of
+            direct replies) and ``lastreply`` (UNIX timestamp of the last
+            one or None), or None if the message does not exist.
+        :raises ValueError: if ``messageid`` is malformed.
+
+        '''
+        messageid = parse_message_id(messageid)
+        query = 'SELECT COALESCE(reply_count, 0) AS reply_count, last_reply \
+                 FROM messages LEFT JOIN message_counters \
+                 ON message_counters.message_id = messages.message_id \
+                 WHERE messages.message_id = ?'
+        self.con.row_factory = sqlite3.Row
+        cur = self.con.cursor()
+        cur.execute(query, (messageid,))
+        row = cur.fetchone()
+        if row is None:
+            #The counters of a message moved to a partition are kept
+            if not self.is_archived('msg-%d' % messageid):
+                return None
+            cur.execute('SELECT reply_count, last_reply \
+                         FROM message_counters WHERE message_id = ?',
+                        (messageid,))
+            row = cur.fetchone() or {'reply_count': 0, 'last_reply': None}
+        return {'replycount': row['reply_count'],
+                'lastreply': row['last_reply']}
+
     def delete_message(self, messageid):
         '''
         Delete the message with id given as parameter.
 
         :param str messageid: id of the message to remove.Note that messageid
-            is a string with format ``msg-\d{1,3}``
+            is a string with format ``msg-\d+``
         :return: True if the message has been deleted, False otherwise
         :raises ValueError: if the messageId has a wrong format.
 
         '''
         #Extracts the int which is the id for a message in the database
-        match = re.match(r'msg-(\d{1,3})', messageid)
-        if match is None:
-            raise ValueError("The messageid is malformed")
-        messageid = int(match.group(1))
+        messageid = parse_message_id(messageid)
         '''
         #TASK5 TODO:#
         * Implement this method.
@@ -635,18 +2518,17 @@ class Connection(object):
         '''
         #Create the SQL statment
         stmnt = 'DELETE FROM messages WHERE message_id = ?'
-        #Activate foreign key support
-        self.set_foreign_keys_support()
         #Cursor and row initialization
         self.con.row_factory = sqlite3.Row
         cur = self.con.cursor()
         pvalue = (messageid,)
         cur.execute(stmnt, pvalue)
         #Commit the message
-        self.con.commit()
+        self._commit()
         #Check that the message has been deleted
         if cur.rowcount < 1:
             return False
+        self._changed('messages')
         #Return true if message is deleted.
         return True
 
@@ -656,23 +2538,20 @@ class Connection(object):
         ``messageid``
 
         :param str messageid: The id of the message to remove. Note that
-            messageid is a string with format msg-\d{1,3}
+            messageid is a string with format msg-\d+
         :param str title: the message's title
         :param str body: the message's content
         :param str editor: default 'Anonymous'. The nickname of the person
             who is editing this message. If it is not provided "Anonymous"
             will be stored in db.
         :return: the id of the edited message or None if the message was
-              not found. The id of the message has the format ``msg-\d{1,3}``,
-              where \d{1,3} is the id of the message in the database.
+              not found. The id of the message has the format ``msg-\d+``,
+              where \d+ is the id of the message in the database.
         :raises ValueError: if the messageid has a wrong format.
 
         '''
         #Extracts the int which is the id for a message in the database
-        match = re.match(r'msg-(\d{1,3})', messageid)
-        if match is None:
-            raise ValueError("The messageid is malformed")
-        messageid = int(match.group(1))
+        messageid = parse_message_id(messageid)
         '''
         TASK5 TODO:
         * Finish this method
@@ -694,17 +2573,16 @@ class Connection(object):
         #Create the SQL statment
         stmnt = 'UPDATE messages SET title=? , body=?, editor_nickname=?\
                  WHERE message_id = ?'
-        #Activate foreign key support
-        self.set_foreign_keys_support()
         #Cursor and row initialization
         self.con.row_factory = sqlite3.Row
         cur = self.con.cursor()
         #Execute main SQL Statement
         pvalue = (title, body, editor, messageid)
         cur.execute(stmnt, pvalue)
-        self.con.commit()
+        self._commit()
         if cur.rowcount < 1:
             return None
+        self._changed('messages')
         return 'msg-'+str(messageid)
 
     def create_message(self, title, body, sender="Anonymous",
@@ -721,11 +2599,11 @@ class Connection(object):
             provided then database will store "0.0.0.0"
         :param str replyto: Only provided if this message is an answer to a
             previous message (parent). Otherwise, Null will be stored in the
-            database. The id of the message has the format msg-\d{1,3}
+            database. The id of the message has the format msg-\d+
 
         :return: the id of the created message or None if the message could not
             be created, or the ``replyto`` parameter does not exist. Note that 
-            the returned value is a string with the format msg-\d{1,3}.
+            the returned value is a string with the format msg-\d+.
 
         :raises ForumDatabaseError: if the database could not be modified.
         :raises ValueError: if the replyto has a wrong format.
@@ -733,10 +2611,7 @@ class Connection(object):
         '''
         #Extracts the int which is the id for a message in the database
         if replyto is not None:
-            match = re.match('msg-(\d{1,3})', replyto)
-            if match is None:
-                raise ValueError("The replyto is malformed")
-            replyto = int(match.group(1))
+            replyto = parse_message_id(replyto, 'replyto')
         '''
         TASK5 TODO:
         * Finish this method
@@ -794,8 +2669,6 @@ class Connection(object):
           #user_id is obtained from first statement.
         user_id = None
         timestamp = time.mktime(datetime.now().timetuple())
-        #Activate foreign key support
-        self.set_foreign_keys_support()
         #Cursor and row initialization
         self.con.row_factory = sqlite3.Row
         cur = self.con.cursor()
@@ -819,12 +2692,74 @@ class Connection(object):
                   user_id)
         #Execute the statement
         cur.execute(stmnt, pvalue)
-        self.con.commit()
+        self._commit()
+        self._changed('messages')
         #Extract the id of the added message
         lid = cur.lastrowid
         #Return the id in
         return 'msg-' + str(lid) if lid is not None else None
 
+    def create_messages(self, messages, ipaddress="0.0.0.0"):
+        '''
+        Creates many messages in a single transaction. Either all the
+        messages are created or none.
+
+        :param list messages: The messages, as dictionaries with the keys
+            ``title``, ``body`` and, optionally, ``sender`` and ``replyto``.
+            They have the meaning of the arguments of
+            :py:meth:`create_message`.
+        :param str ipaddress: The ip address from which the messages were
+            created.
+
+        :return: the list of ids of the created messages, in the order of
+            ``messages``, or None if any of the ``replyto`` messages does not
+            exist.
+
+        :raises ValueError: if a replyto has a wrong format.
+
+        '''
+        rows = []
+        for message in messages:
+            replyto = message.get('replyto')
+            if replyto is not None:
+                replyto = parse_message_id(replyto, 'replyto')
+            rows.append((message['title'], message['body'],
+                         message.get('sender') or 'Anonymous', replyto))
+        query1 = 'SELECT message_id from messages WHERE message_id = ?'
+        query2 = 'SELECT user_id from users WHERE nickname = ?'
+        stmnt = 'INSERT INTO messages (title,body,timestamp,ip, \
+                 timesviewed,reply_to,user_nickname,user_id) \
+                 VALUES(?,?,?,?,?,?,?,?)'
+        timestamp = time.mktime(datetime.now().timetuple())
+        cur = self.con.cursor()
+        #Check the parents like create_message. The foreign key catches a
+        #parent deleted meanwhile
+        for replyto in set(row[3] for row in rows if row[3] is not None):
+            cur.execute(query1, (replyto,))
+            if cur.fetchone() is None:
+                return None
+        user_ids = {}
+        for sender in set(row[2] for row in rows):
+            cur.execute(query2, (sender,))
+            row = cur.fetchone()
+            user_ids[sender] = row[0] if row is not None else None
+        ids = []
+        try:
+            for title, body, sender, replyto in rows:
+                cur.execute(stmnt, (title, body, timestamp, ipaddress, 0,
+                                    replyto, sender, user_ids[sender]))
+                ids.append('msg-' + str(cur.lastrowid))
+            self._commit()
+        except sqlite3.IntegrityError:
+            #A parent was deleted meanwhile
+            self._rollback()
+            return None
+        except:
+            self._rollback()
+            raise
+        self._changed('messages')
+        return ids
+
     def append_answer(self, replyto, title, body, sender="Anonymous",
                       ipaddress="0.0.0.0"):
         '''
@@ -833,7 +2768,7 @@ class Connection(object):
 
         :param str replyto: Only provided if this message is an answer to a
             previous message (parent). Otherwise, Null will be stored in the
-            database. The id of the message has the format msg-\d{1,3}
+            database. The id of the message has the format msg-\d+
         :param str title: the message's title
         :param str body: the message's content
         :param str sender: the nickname of the person who is editing this
@@ -844,7 +2779,7 @@ class Connection(object):
 
         :return: the id of the created message or None if the message could not
             be created, or the ``replyto`` parameter does not exist. Note that 
-            the returned value is a string with the format msg-\d{1,3}.
+            the returned value is a string with the format msg-\d+.
 
         :raises ForumDatabaseError: if the database could not be modified.
         :raises ValueError: if the replyto has a wrong format.
@@ -859,7 +2794,7 @@ class Connection(object):
         ``messageid``
 
         :param str messageid: Id of the message to search. Note that messageid
-            is a string with the format msg-\d{1,3}.
+            is a string with the format msg-\d+.
 
         :return: a dictionary with the following format:
 
@@ -903,18 +2838,39 @@ class Connection(object):
         Checks if a message is in the database.
 
         :param str messageid: Id of the message to search. Note that messageid
-            is a string with the format msg-\d{1,3}.
+            is a string with the format msg-\d+.
         :return: True if the message is in the database. False otherwise.
 
         '''
         return self.get_message(messageid) is not None
 
+    def is_archived(self, messageid):
+        '''
+        Checks if a message was moved to a partition. Archived messages can
+        be read, but not modified, deleted or replied to. Check
+        :py:meth:`Engine.create_partition`.
+
+        :param str messageid: Id of the message to search. Note that messageid
+            is a string with the format msg-\d+.
+        :return: True if the message is in a partition. False otherwise.
+        :raises ValueError: if ``messageid`` is malformed.
+
+        '''
+        messageid = parse_message_id(messageid)
+        cur = self.con.cursor()
+        for schema in self._partitions():
+            cur.execute('SELECT 1 FROM %s.messages WHERE message_id = ?'
+                        % schema, (messageid,))
+            if cur.fetchone() is not None:
+                return True
+        return False
+
     def get_message_time(self, messageid):
         '''
         Get the time when the message was sent.
 
         :param str messageid: Id of the message to search. Note that messageid
-            is a string with the format msg-\d{1,3}.
+            is a string with the format msg-\d+.
         :return: message time as a string or None if that message does not
             exist.
         :raises ValueError: if messageId is not well formed
@@ -922,77 +2878,123 @@ class Connection(object):
         raise NotImplementedError("")
 
     #ACCESSING THE USER and USER_PROFILE tables
-    def get_users(self):
-        '''
-        Extracts all users in the database.
-
+    def get_users(self, number_of_users=-1, seek=None, backwards=False,
+                  order='nickname'):
+        '''
+        Extracts the users in the database, sorted by ``order``. Only the
+        columns of the list are read.
+
+        Pages of a long list are obtained with keyset pagination: pass in
+        ``seek`` the key of the last user of the previous page and only the
+        users that follow it are returned.
+
+        :param int number_of_users: default -1. Maximum number of users
+            returned. -1 means no limit.
+        :param tuple seek: default None. Key of the user preceding the page:
+            (nickname,) if ``order`` is 'nickname' and (registrationdate,
+            nickname) if it is 'registrationdate'.
+        :param bool backwards: default False. If True, the users preceding
+            ``seek`` are returned instead (previous page). The list is still
+            sorted by ``order``.
+        :param str order: default 'nickname'. One of ``USER_ORDERS``. Users
+            are sorted in ascending order.
         :return: list of Users of the database. Each user is a dictionary
             that contains two keys: ``nickname``(str) and ``registrationdate``
-            (long representing UNIX timestamp). None is returned if the database
-            has no users.
+            (long representing UNIX timestamp).
+        :raises ValueError: if ``order`` is unknown or ``seek`` is not a key
+            of ``order``.
 
         '''
-        #Create the SQL Statements
-          #SQL Statement for retrieving the users
-        query = 'SELECT users.*, users_profile.* FROM users, users_profile \
-                 WHERE users.user_id = users_profile.user_id'
-        #Activate foreign key support
-        self.set_foreign_keys_support()
+        return list(self.iter_users(number_of_users, seek, backwards, order))
+
+    def iter_users(self, number_of_users=-1, seek=None, backwards=False,
+                   order='nickname'):
+        '''
+        Same as :py:meth:`get_users`, but the users are read from the cursor
+        as they are iterated, so a long list is never in memory.
+
+        The arguments are checked when the generator is created and the
+        query is executed when the first user is requested.
+
+        :return: a generator of users with the format of
+            :py:meth:`get_users`.
+
+        '''
+        if order not in USER_ORDERS:
+            raise ValueError("Unknown order of the users " + repr(order))
+        if seek is not None and len(seek) != len(USER_ORDERS[order]):
+            raise ValueError("The seek key does not match the order")
+        return self._iter_users(number_of_users, seek, backwards, order)
+
+    def _iter_users(self, number_of_users, seek, backwards, order):
+        '''
+        Generator of :py:meth:`iter_users`.
+        '''
+        query = _users_statement(order, seek is not None,
+                                 seek is not None and backwards)
+        pvalue = tuple(seek or ()) + (number_of_users,)
         #Create the cursor
         self.con.row_factory = sqlite3.Row
         cur = self.con.cursor()
         #Execute main SQL Statement
-        cur.execute(query)
-        #Process the results
-        rows = cur.fetchall()
-        if rows is None:
-            return None
+        cur.execute(query, pvalue)
+        rows = cur
+        if seek is not None and backwards:
+            rows = reversed(cur.fetchall())
         #Process the response.
-        users = []
         for row in rows:
-            users.append(self._create_user_list_object(row))
-        return users
+            yield self._create_user_list_object(row)
 
     def get_user(self, nickname):
         '''
-        Extracts all the information of a user.
+        Extracts all the information of a user with one query.
 
         :param str nickname: The nickname of the user to search for.
         :return: dictionary with the format provided in the method:
-            :py:meth:`_create_user_object`
+            :py:meth:`_create_user_object` or None if the user does not
+            exist.
 
         '''
-        #Create the SQL Statements
-          #SQL Statement for retrieving the user given a nickname
-        query1 = 'SELECT user_id from users WHERE nickname = ?'
-          #SQL Statement for retrieving the user information
-        query2 = 'SELECT users.*, users_profile.* FROM users, users_profile \
-                  WHERE users.user_id = ? \
-                  AND users_profile.user_id = users.user_id'
-          #Variable to be used in the second query.
-        user_id = None
-        #Activate foreign key support
-        self.set_foreign_keys_support()
+        #Create the SQL Statement. The user is found with the index of its
+        #UNIQUE nickname and the profile with its primary key.
+        query = 'SELECT users.*, users_profile.* FROM users \
+                 JOIN users_profile ON users_profile.user_id = users.user_id \
+                 WHERE users.nickname = ?'
         #Cursor and row initialization
         self.con.row_factory = sqlite3.Row
         cur = self.con.cursor()
-        #Execute SQL Statement to retrieve the id given a nickname
+        #Execute the SQL Statement to retrieve the user information.
         pvalue = (nickname,)
-        cur.execute(query1, pvalue)
-        #Extract the user id
+        cur.execute(query, pvalue)
+        #Process the response. Only one posible row is expected.
         row = cur.fetchone()
         if row is None:
             return None
-        user_id = row["user_id"]
-        # Execute the SQL Statement to retrieve the user invformation.
-        # Create first the valuse
-        pvalue = (user_id, )
-        #execute the statement
-        cur.execute(query2, pvalue)
-        #Process the response. Only one posible row is expected.
-        row = cur.fetchone()
         return self._create_user_object(row)
 
+    def get_user_counters(self, nickname):
+        '''
+        Returns the counters of the messages sent with a nickname, which are
+        kept in the table ``user_counters``. The nickname does not need to
+        belong to a registered user.
+
+        :param str nickname: The nickname of the sender.
+        :return: a dictionary with the keys ``messagecount`` (number of
+            messages) and ``lastactivity`` (UNIX timestamp of the last
+            message or None).
+
+        '''
+        query = 'SELECT message_count, last_activity FROM user_counters \
+                 WHERE nickname = ?'
+        self.con.row_factory = sqlite3.Row
+        cur = self.con.cursor()
+        cur.execute(query, (nickname,))
+        row = cur.fetchone()
+        if row is None:
+            return {'messagecount': 0, 'lastactivity': None}
+        return {'messagecount': row['message_count'],
+                'lastactivity': row['last_activity']}
+
     def delete_user(self, nickname):
         '''
         Remove all user information of the user with the nickname passed in as
@@ -1006,18 +3008,19 @@ class Connection(object):
         #Create the SQL Statements
           #SQL Statement for deleting the user information
         query = 'DELETE FROM users WHERE nickname = ?'
-        #Activate foreign key support
-        self.set_foreign_keys_support()
         #Cursor and row initialization
         self.con.row_factory = sqlite3.Row
         cur = self.con.cursor()
         #Execute the statement to delete
         pvalue = (nickname,)
         cur.execute(query, pvalue)
-        self.con.commit()
+        self._commit()
         #Check that it has been deleted
         if cur.rowcount < 1:
             return False
+        #The profile and friends are deleted in cascade and the messages
+        #lose their sender
+        self._changed(*TABLES)
         return True
 
     def modify_user(self, nickname, user):
@@ -1114,8 +3117,6 @@ class Connection(object):
 
         if p_profile is None and r_profile is None:
             return nickname
-        #Activate foreign key support
-        self.set_foreign_keys_support()
         #Cursor and row initialization
         self.con.row_factory = sqlite3.Row
         cur = self.con.cursor()
@@ -1135,10 +3136,11 @@ class Connection(object):
             print query2
             print pvalue
             cur.execute(query2, pvalue)
-            self.con.commit()
+            self._commit()
             #Check that I have modified the user
             if cur.rowcount < 1:
                 return None
+            self._changed('users_profile')
             return nickname
 
     def append_user(self, nickname, user):
@@ -1216,8 +3218,6 @@ class Connection(object):
         _gender = r_profile.get('gender', None)
         _signature = p_profile.get('signature', None)
         _avatar = p_profile.get('avatar', None)
-        #Activate foreign key support
-        self.set_foreign_keys_support()
         #Cursor and row initialization
         self.con.row_factory = sqlite3.Row
         cur = self.con.cursor()
@@ -1240,7 +3240,8 @@ class Connection(object):
                       _picture, _mobile, _skype, _birthday,_residence, _gender,
                       _signature, _avatar)
             cur.execute(query3, pvalue)
-            self.con.commit()
+            self._commit()
+            self._changed('users', 'users_profile')
             #We do not do any comprobation and return the nickname
             return nickname
         else:
@@ -1285,8 +3286,6 @@ class Connection(object):
                 * test_get_user_id_unknown_user
         '''
         query = 'SELECT user_id from users WHERE nickname = ?'
-        #Activate foreign key support
-        self.set_foreign_keys_support()
         #Cursor and row initialization
         self.con.row_factory = sqlite3.Row
         cur = self.con.cursor()
@@ -0,0 +1,222 @@
+'''
+Created on 18.10.2026
+
+Pre-forking HTTP server for production.
+
+The master process binds the listening socket and forks the workers, which
+accept the connections of the shared socket and serve one request at a
+time each. The application is loaded by every worker after it is forked,
+so each worker creates its own :py:class:`forum.database.Engine` and never
+uses SQLite connections or threads of another process.
+
+The master replaces the workers that exit, e.g. after serving
+``max_requests`` requests. It reacts to the signals:
+
+* SIGHUP: graceful reload. New workers are forked, loading the current
+  code of the application, and the old ones exit after finishing the
+  request they are serving.
+* SIGTERM, SIGINT: graceful stop. The workers finish the request they are
+  serving and the master exits when all of them have exited.
+'''
+
+import errno, os, random, signal, sys, time, traceback
+
+from werkzeug.serving import BaseWSGIServer
+
+#Default configuration of the server
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_REQUESTS = 10000
+#Seconds a worker blocks waiting for a connection before checking if it
+#has to exit
+WORKER_POLL_INTERVAL = 1
+#Seconds the workers have to finish their requests when the server stops
+DEFAULT_GRACEFUL_TIMEOUT = 30
+
+
+class _WorkerServer(BaseWSGIServer):
+    '''
+    The server of a worker: it counts the requests it handles.
+    '''
+    requests = 0
+
+    def process_request(self, request, client_address):
+        self.requests += 1
+        BaseWSGIServer.process_request(self, request, client_address)
+
+
+class PreforkServer(object):
+    '''
+    Pre-forking HTTP server of a WSGI application.
+
+    :Example:
+
+    >>> def load_app():
+    ...     from forum.resources import app
+    ...     return app
+    >>> PreforkServer(load_app, port=8000, workers=8).serve_forever()
+
+    :param load_app: Function without arguments returning the WSGI
+        application. It is called in every worker after it is forked, so it
+        is the place to create the per-process resources, e.g. the database
+        Engine. Modules imported by it for the first time are imported again
+        by the workers forked on a reload.
+    :param str host: Interface to listen on.
+    :param int port: Port to listen on.
+    :param int workers: Number of worker processes.
+    :param int max_requests: A worker exits after serving between
+        ``max_requests`` and 10% more requests, so the workers do not exit
+        at the same time, and a new one replaces it. 0 means never.
+    :param graceful_timeout: Seconds the workers have to finish their
+        requests when the server stops. Then they are killed.
+
+    '''
+    def __init__(self, load_app, host='localhost', port=5000,
+                 workers=DEFAULT_WORKERS, max_requests=DEFAULT_MAX_REQUESTS,
+                 graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT):
+        super(PreforkServer, self).__init__()
+        if workers < 1:
+            raise ValueError("There must be at least one worker")
+        self.load_app = load_app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.server = None
+        #Generation of each worker by pid. A reload starts a new generation
+        self._workers = {}
+        self._generation = 0
+        self._stopping = False
+        self._reloading = False
+        #Set in the workers
+        self._alive = True
+
+    def serve_forever(self):
+        '''
+        Binds the socket, forks the workers and supervises them until the
+        server is stopped.
+        '''
+        self.server = _WorkerServer(self.host, self.port, None)
+        #Every waiting worker is woken up by a new connection, but only one
+        #accepts it. The rest wait in accept() for the next connection, or
+        #until they are signalled to exit.
+        self.server.timeout = WORKER_POLL_INTERVAL
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        print ' * Pre-fork server on http://%s:%d/ (master %d, %d workers)' % \
+            (self.host, self.server.port, os.getpid(), self.workers)
+        try:
+            while not self._stopping:
+                self._reap_workers()
+                if self._reloading:
+                    self._reloading = False
+                    self._generation += 1
+                    print ' * Reloading the workers'
+                self._spawn_workers()
+                self._stop_old_workers()
+                #Interrupted by the signals
+                time.sleep(WORKER_POLL_INTERVAL)
+            self._stop_workers()
+        finally:
+            self.server.server_close()
+
+    def stop(self):
+        '''Stops the server gracefully. Same as sending it SIGTERM.'''
+        self._stopping = True
+
+    def reload(self):
+        '''Replaces the workers gracefully. Same as sending it SIGHUP.'''
+        self._reloading = True
+
+    #MASTER
+    def _handle_stop(self, signum, frame):
+        self.stop()
+
+    def _handle_reload(self, signum, frame):
+        self.reload()
+
+    def _spawn_workers(self):
+        current = sum(1 for generation in self._workers.itervalues()
+                      if generation == self._generation)
+        for _ in xrange(self.workers - current):
+            pid = os.fork()
+            if pid == 0:
+                self._run_worker()
+            self._workers[pid] = self._generation
+
+    def _stop_old_workers(self):
+        for pid, generation in self._workers.items():
+            if generation < self._generation:
+                self._kill(pid, signal.SIGTERM)
+                #Signalled once
+                self._workers[pid] = None
+
+    def _reap_workers(self):
+        '''Forgets the workers that have exited.'''
+        while self._workers:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except OSError, excp:
+                if excp.errno == errno.ECHILD:
+                    self._workers.clear()
+                    return
+                if excp.errno == errno.EINTR:
+                    continue
+                raise
+            if pid == 0:
+                return
+            self._workers.pop(pid, None)
+
+    def _stop_workers(self):
+        for pid in self._workers.keys():
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        while self._workers and time.time() < deadline:
+            time.sleep(0.1)
+            self._reap_workers()
+        for pid in self._workers.keys():
+            self._kill(pid, signal.SIGKILL)
+        while self._workers:
+            time.sleep(0.1)
+            self._reap_workers()
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError, excp:
+            if excp.errno != errno.ESRCH:
+                raise
+
+    #WORKER
+    def _handle_worker_stop(self, signum, frame):
+        self._alive = False
+
+    def _run_worker(self):
+        '''
+        Body of a worker process. It never returns.
+        '''
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, self._handle_worker_stop)
+            #Ctrl+C reaches the whole process group. The master stops the
+            #workers gracefully.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            random.seed()
+            self._workers.clear()
+            self.server.app = self.load_app()
+            limit = self.max_requests
+            if limit:
+                limit += random.randint(0, limit // 10)
+            while self._alive and not (limit and
+                                       self.server.requests >= limit):
+                self.server.handle_request()
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            #Do not run the cleanup of the master
+            os._exit(status)
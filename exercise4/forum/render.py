@@ -0,0 +1,308 @@
+'''
+Created on 18.10.2026
+
+Serialisation of the Collection+JSON and HAL envelopes.
+
+The constant parts of the envelopes (templates, curies, queries) are
+serialised once, when the resources module is imported, as
+:py:class:`Fragment` instances. Parts that are constant except for a few
+strings (e.g. an href) are :py:class:`FragmentTemplate` instances.
+
+A fragment is a marker string for the JSON encoder. :py:func:`dumps`
+serialises the envelope in one pass of the JSON encoder and then
+replaces the markers with the pre-serialised JSON of the fragments.
+Replacing the markers costs about as much as serialising small
+fragments, so only the envelopes with big templates, e.g. those of the
+user profiles, are serialised faster. The message envelopes take the same
+time. Check benchmark/rendering.py.
+
+Big collections are not serialised at once. Their items are a
+:py:class:`Stream` and :py:func:`iterdumps` yields the document in chunks
+while the items are read, e.g. from a database cursor. The parts of the
+envelope that depend on the items (e.g. the links to the next page) are
+:py:class:`Deferred` and placed after the items.
+
+The JSON is written by the fastest encoder available: ujson or simplejson
+with its C speedups when they are installed, the standard library
+otherwise. Check :py:data:`ENCODERS` and :py:func:`use_encoder`.
+'''
+
+from collections import OrderedDict
+import itertools, json, random, weakref
+
+#Markers contain a random token, so they cannot be forged in the data of
+#the users. Serialised, a marker is _MARKER_START + id + _MARKER_END. Both
+#are set by use_encoder
+_TOKEN = '%032x' % random.getrandbits(128)
+_MARKER_START = _MARKER_END = None
+#Fragments by id. Fragments created for a response are dropped with it.
+_fragments = weakref.WeakValueDictionary()
+_ids = itertools.count()
+#String that marks the position of a Placeholder in a serialised template
+_PLACEHOLDER = u'\x00placeholder\x00'
+#Number of items of a Stream serialised in every chunk
+DEFAULT_STREAM_BATCH_SIZE = 100
+
+
+def _ujson():
+    import ujson
+    def encode(value):
+        return ujson.dumps(value, ensure_ascii=True,
+                           escape_forward_slashes=False)
+    #Old versions write dict subclasses in the order of the hash table
+    keys = [str(i) for i in xrange(16, 0, -1)]
+    if encode(OrderedDict.fromkeys(keys, 0)) != \
+       '{%s}' % ','.join('"%s":0' % key for key in keys):
+        raise ImportError("This ujson version does not keep the order of "
+                          "OrderedDict")
+    return encode
+
+
+def _simplejson():
+    import simplejson.encoder
+    if simplejson.encoder.c_make_encoder is None:
+        raise ImportError("simplejson is installed without its C speedups")
+    return simplejson.dumps
+
+
+def _json():
+    return json.dumps
+
+#Loaders of the encoders by name, from the fastest. A loader returns a
+#function serialising a value to a JSON str, or raises ImportError if the
+#encoder is not available. The encoders must keep the order of
+#OrderedDict instances and escape the non ASCII characters.
+ENCODERS = OrderedDict([('ujson', _ujson), ('simplejson', _simplejson),
+                        ('json', _json)])
+#Name of the encoder in use
+ENCODER = None
+_encode = None
+
+
+def available_encoders():
+    '''
+    :return: the names of the installed encoders, from the fastest.
+    '''
+    names = []
+    for name, loader in ENCODERS.iteritems():
+        try:
+            loader()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def use_encoder(name=None):
+    '''
+    Sets the encoder used by :py:func:`dumps`, :py:func:`iterdumps` and
+    :py:func:`dump`. Call it at start-up, before serving requests. The
+    fastest available encoder is set when the module is imported.
+
+    :param str name: One of :py:data:`ENCODERS`. If None, the fastest
+        available encoder is used.
+    :raises ValueError: if ``name`` is not a known encoder.
+    :raises ImportError: if the encoder ``name`` is not installed.
+    '''
+    global ENCODER, _encode, _MARKER_START, _MARKER_END
+    if name is None:
+        name = available_encoders()[0]
+    if name not in ENCODERS:
+        raise ValueError("Unknown JSON encoder " + repr(name))
+    encode = ENCODERS[name]()
+    _MARKER_START = encode(u'\x00%s-' % _TOKEN)[:-1]
+    _MARKER_END = encode(u'\x00')[1:]
+    ENCODER, _encode = name, encode
+
+use_encoder()
+
+
+class Fragment(unicode):
+    '''
+    JSON value serialised once and reused in every response.
+
+    :Example:
+
+    >>> template = Fragment({'data': []})
+    >>> dumps({'template': template})
+    '{"template": {"data": []}}'
+
+    Fragments must be serialised with :py:func:`dumps`. Serialised with
+    :py:func:`json.dumps` they are just marker strings.
+
+    :param value: The JSON compatible value. It must not be modified later.
+
+    '''
+    def __new__(cls, value):
+        return cls.from_json(_encode(value))
+
+    @classmethod
+    def from_json(cls, serialised):
+        '''
+        :return: a Fragment with the already serialised JSON ``serialised``.
+        '''
+        fragment = cls._create()
+        fragment.json = serialised
+        return fragment
+
+    @classmethod
+    def _create(cls):
+        '''
+        :return: a new registered instance of ``cls``.
+        '''
+        fragment_id = str(next(_ids))
+        fragment = unicode.__new__(cls,
+                                   u'\x00%s-%s\x00' % (_TOKEN, fragment_id))
+        _fragments[fragment_id] = fragment
+        return fragment
+
+    def iterjson(self):
+        '''
+        :return: an iterator over the chunks of the JSON of the fragment.
+        '''
+        yield self.json
+
+
+class Stream(Fragment):
+    '''
+    JSON array serialised while its items are read from an iterable. The
+    items are JSON compatible values and they may contain fragments.
+
+    Serialised with :py:func:`iterdumps`, only ``batch_size`` items are in
+    memory at a time.
+
+    :param iterable: The items of the array. They can be iterated only once.
+    :param int batch_size: Number of items serialised in each chunk.
+
+    '''
+    def __new__(cls, iterable, batch_size=DEFAULT_STREAM_BATCH_SIZE):
+        fragment = cls._create()
+        fragment.iterable = iterable
+        fragment.batch_size = batch_size
+        return fragment
+
+    def iterjson(self):
+        yield '['
+        separator = ''
+        batch = []
+        for item in self.iterable:
+            batch.append(item)
+            if len(batch) == self.batch_size:
+                yield separator + dumps(batch)[1:-1]
+                separator = ', '
+                batch = []
+        if batch:
+            yield separator + dumps(batch)[1:-1]
+        yield ']'
+
+
+class Deferred(Fragment):
+    '''
+    JSON value computed when it is reached by :py:func:`iterdumps`, e.g.
+    after a :py:class:`Stream` placed before it has been consumed.
+
+    :param function: Function without arguments returning the JSON
+        compatible value. It may contain fragments.
+
+    '''
+    def __new__(cls, function):
+        fragment = cls._create()
+        fragment.function = function
+        return fragment
+
+    def iterjson(self):
+        return iterdumps(self.function())
+
+
+class Placeholder(object):
+    '''
+    Position of a string in a :py:class:`FragmentTemplate`.
+
+    :param str name: The name of the field filling the placeholder.
+    '''
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class FragmentTemplate(object):
+    '''
+    JSON value serialised once, except for some strings which are given
+    every time a response is rendered.
+
+    :Example:
+
+    >>> queries = FragmentTemplate([{'href': Placeholder('href'),
+    ...                              'rel': 'search'}])
+    >>> queries.fill(href='/forum/api/users/AxelW/history/').json
+    '[{"href": "/forum/api/users/AxelW/history/", "rel": "search"}]'
+
+    :param value: The JSON compatible value with :py:class:`Placeholder`
+        instances in the place of the changing strings.
+
+    '''
+    def __init__(self, value):
+        self._names = []
+        def marker(placeholder):
+            if not isinstance(placeholder, Placeholder):
+                raise TypeError(repr(placeholder) + " is not JSON serializable")
+            #The encoder calls this function in the output order
+            self._names.append(placeholder.name)
+            return _PLACEHOLDER
+        #Only the standard library supports the default hook. Templates are
+        #serialised once, so its speed does not matter
+        self._parts = json.dumps(value, default=marker).split(
+            json.dumps(_PLACEHOLDER))
+
+    def fill(self, **fields):
+        '''
+        :return: a :py:class:`Fragment` with the placeholders replaced by the
+            values in ``fields``.
+        '''
+        parts = [self._parts[0]]
+        for name, part in zip(self._names, self._parts[1:]):
+            parts.append(_encode(fields[name]))
+            parts.append(part)
+        return Fragment.from_json(''.join(parts))
+
+
+def iterdumps(value):
+    '''
+    Serialises ``value`` with the encoder in use, writing the
+    :py:class:`Fragment` instances with their JSON.
+
+    The envelope itself is serialised at once. Use a
+    :py:class:`collections.OrderedDict` to place the :py:class:`Deferred`
+    values after the :py:class:`Stream` they depend on.
+
+    :return: an iterator over the chunks of the JSON document.
+    '''
+    parts = _encode(value).split(_MARKER_START)
+    yield parts[0]
+    for part in parts[1:]:
+        fragment_id, rest = part.split(_MARKER_END, 1)
+        for chunk in _fragments[fragment_id].iterjson():
+            yield chunk
+        yield rest
+
+
+def dumps(value):
+    '''
+    Same as :py:func:`iterdumps`, but the JSON document is returned as a
+    string.
+    '''
+    return ''.join(iterdumps(value))
+
+
+def dump(value, fp):
+    '''
+    Same as :py:func:`iterdumps`, but the chunks of the JSON document are
+    written to ``fp`` as they are serialised.
+
+    :param fp: A file-like object accepting str, e.g. a
+        :py:class:`io.BytesIO` buffer or a socket file.
+    '''
+    write = fp.write
+    for chunk in iterdumps(value):
+        write(chunk)
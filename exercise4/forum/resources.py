@@ -5,14 +5,23 @@ Modified on 09.03.2016
 '''
 
 #TODO: Create another file
-import json
+from collections import OrderedDict
+import calendar, functools, itertools, urlparse, sqlite3
 
-from flask import Flask, request, Response, g, jsonify, _request_ctx_stack, redirect
+from flask import Flask, request, Response, g, _request_ctx_stack, \
+    redirect, stream_with_context
 from flask.ext.restful import Resource, Api, abort
 from flask.ext.cors import CORS
-from werkzeug.exceptions import NotFound,  UnsupportedMediaType
-
-from utils import RegexConverter
+from werkzeug.exceptions import NotFound,  UnsupportedMediaType, \
+    MethodNotAllowed
+from werkzeug.routing import RequestRedirect
+from werkzeug.wsgi import ClosingIterator
+
+from utils import RegexConverter, MessageIdConverter, URLTemplate, \
+    encode_cursor, decode_cursor
+from cache import LRUCache
+from render import Fragment, FragmentTemplate, Placeholder, Stream, \
+    Deferred, dumps, iterdumps
 import database
 
 #Constants for hypermedia formats and profiles
@@ -22,6 +31,197 @@ FORUM_USER_PROFILE ="/profiles/user-profile"
 FORUM_MESSAGE_PROFILE = "/profiles/message-profile"
 ATOM_THREAD_PROFILE = "https://tools.ietf.org/html/rfc4685"
 APIARY_PROFILES_URL = "http://docs.pwpforumappcomplete.apiary.io/#reference/profiles/"
+#Number of items in a page of a collection, if the client does not provide
+#the length query parameter, and maximum value of that parameter.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+#Maximum number of messages created with one request to MessagesBatch
+MAX_BATCH_SIZE = 1000
+#Seconds a request waits for its write in the write-behind mode before
+#answering 503
+WRITE_TIMEOUT = 30
+#Range of the INTEGER values of SQLite. The integers of a cursor out of it
+#cannot be bound to a statement.
+MIN_INTEGER = -2 ** 63
+MAX_INTEGER = 2 ** 63 - 1
+
+#Constant parts of the envelopes, serialised once. Only the user templates
+#are big enough to make the responses faster. Check forum.render
+MESSAGE_TEMPLATE = Fragment({
+    "data": [
+        {"prompt": "", "name": "headline",
+         "value": "", "required": True},
+        {"prompt": "", "name": "articleBody",
+         "value": "", "required": True},
+        {"prompt": "", "name": "author",
+         "value": "", "required": False},
+        {"prompt": "", "name": "editor",
+         "value": "", "required": False}
+    ]
+})
+MESSAGE_CURIES = Fragment([
+    {
+        "name": "msg",
+        "href": FORUM_MESSAGE_PROFILE + "/{rels}",
+        "templated": True
+    },
+    {
+        "name": "atom-thread",
+        "href": ATOM_THREAD_PROFILE + "/{rels}",
+        "templated": True
+    }
+])
+USERS_TEMPLATE = Fragment({
+    "data": [
+        {"prompt": "Insert nickname", "name": "nickname",
+         "value": "", "required": True},
+        {"prompt": "Insert user address", "name": "address",
+         "object": {}, "required": False},
+        {"prompt": "Insert user avatar", "name": "avatar",
+         "value": "", "required": True},
+        {"prompt": "Insert user birthday", "name": "birthday",
+         "value": "", "required": True},
+        {"prompt": "Insert user email", "name": "email",
+         "value": "", "required": True},
+        {"prompt": "Insert user familyName", "name": "familyName",
+         "value": "", "required": True},
+        {"prompt": "Insert user gender", "name": "gender",
+         "value": "", "required": True},
+        {"prompt": "Insert user givenName", "name": "givenName",
+         "value": "", "required": True},
+        {"prompt": "Insert user image", "name": "image",
+         "value": "", "required": False},
+        {"prompt": "Insert user signature", "name": "signature",
+         "value": "", "required": True},
+        {"prompt": "Insert user skype", "name": "skype",
+         "value": "", "required": False},
+        {"prompt": "Insert user telephone", "name": "telephone",
+         "value": "", "required": False},
+        {"prompt": "Insert user website", "name": "website",
+         "value": "", "required": False}
+    ]
+})
+USER_CURIES = Fragment([
+    {
+        "name": "user",
+        "href": FORUM_USER_PROFILE + "/{rels}",
+        "templated": True
+    }
+])
+USER_PUBLIC_TEMPLATE = Fragment({
+    "data": [
+        {
+            "prompt": "Insert signature text",
+            "name": "signature",
+            "value": "",
+            "required": True
+        },
+        {
+            "prompt": "Insert avatar file name",
+            "name": "avatar",
+            "value": "",
+            "required": True
+        }
+    ]
+})
+USER_RESTRICTED_TEMPLATE = Fragment({
+    "data": [
+        {"prompt": "Insert user address",
+         "name": "address",
+         "object": {},
+         "required": False},
+        {"prompt": "Insert user birthday",
+         "name": "birthday",
+         "value": "",
+         "required": True},
+        {"prompt": "Insert user email",
+         "name": "email",
+         "value": "",
+         "required": True},
+        {"prompt": "Insert user familyName",
+         "name": "familyName",
+         "value": "",
+         "required": True},
+        {"prompt": "Insert user gender",
+         "name": "gender",
+         "value":  "",
+         "required": True},
+        {"prompt": "Insert user givenName",
+         "name": "givenName",
+         "value": "",
+         "required": True},
+        {"prompt": "Insert user website",
+         "name": "website",
+         "value": "",
+         "required": False},
+        {"prompt": "Insert user telephone",
+         "name":  "telephone",
+         "value":  "",
+         "required": False},
+        {"prompt": "Insert user skype",
+         "name": "skype",
+         "value": "",
+         "required": False},
+        {"prompt": "Insert user image",
+         "name": "image",
+         "value": "",
+         "required": False}
+    ]
+})
+#The href of the query is the url of the history
+HISTORY_QUERIES = FragmentTemplate([
+    {'href': Placeholder('href'),
+     'rel': 'search',
+     'prompt': "Search in the user history",
+     'data': [
+            {"prompt": "Return the messages published after this timestamp",
+             "name": "after",
+             "value": "",
+             "required": False},
+            {"prompt": "Return the messages published before this timestamp",
+             "name": "before",
+             "value": "",
+             "required": False},
+            {"prompt": "Limit the number of messages returned",
+             "name": "length",
+             "value": "",
+             "required": False}
+     ]
+    }
+])
+#The href of the query is the url of the messages
+MESSAGES_QUERIES = FragmentTemplate([
+    {'href': Placeholder('href'),
+     'rel': 'search',
+     'prompt': "Search messages by their content",
+     'data': [
+            {"prompt": "Words contained in the headline or the body",
+             "name": "search",
+             "value": "",
+             "required": True},
+            {"prompt": "Limit the number of messages returned",
+             "name": "length",
+             "value": "",
+             "required": False}
+     ]
+    }
+])
+USERS_QUERIES = FragmentTemplate([
+    {'href': Placeholder('href'),
+     'rel': 'sort',
+     'prompt': "Sort the users",
+     'data': [
+            {"prompt": "Order of the users: nickname or registrationdate",
+             "name": "order",
+             "value": "nickname",
+             "required": False},
+            {"prompt": "Limit the number of users returned",
+             "name": "length",
+             "value": "",
+             "required": False}
+     ]
+    }
+])
 
 #Define the application and the api
 app = Flask(__name__)
@@ -29,13 +229,27 @@ app.debug = True
 # Set the database Engine. In order to modify the database file (e.g. for
 # testing) provide the database path   app.config to modify the
 #database to be used (for instance for testing)
-app.config.update({'Engine': database.Engine()})
+#WAL mode lets GET requests read while another request is writing.
+app.config.update({'Engine': database.Engine(wal=True)})
+#Cache of the rendered single messages. Replace it with another LRUCache to
+#change its memory cap (max_bytes) or time to live (ttl).
+app.config.update({'MessageCache': LRUCache()})
+#Cache of the user records read by User, User_public and User_restricted,
+#by nickname.
+app.config.update({'UserCache': LRUCache()})
 #Start the RESTful API.
 api = Api(app)
 #Add support for cors
 CORS(app)
 
 
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    '''Serialises the data returned by the resources, and their errors, with
+    the encoder of forum.render.'''
+    return Response(dumps(data), code, headers, mimetype='application/json')
+
+
 #ERROR HANDLERS
 #TODO: Modify this accordding
 # http://soabits.blogspot.no/2013/05/error-handling-considerations-and-best.html
@@ -54,13 +268,14 @@ def create_error_response(status_code, title, message=None):
     ctx = _request_ctx_stack.top
     if ctx is not None:
         resource_url = request.path
-        resource_type = ctx.url_adapter.match(resource_url)[0]
-    response = jsonify(title=title,
-                       message=message,
-                       resource_url=resource_url,
-                       resource_type=resource_type)
-    response.status_code = status_code
-    return response
+        #None if the URL does not match any resource
+        rule = request.url_rule
+        resource_type = rule.endpoint if rule is not None else None
+    body = dumps({'title': title,
+                  'message': message,
+                  'resource_url': resource_url,
+                  'resource_type': resource_type})
+    return Response(body, status_code, mimetype='application/json')
 
 @app.errorhandler(404)
 def resource_not_found(error):
@@ -78,24 +293,327 @@ def unknown_error(error):
                     "The system has failed. Please, contact the administrator")
 
 
+#Methods that do not modify the resources. They are served with read-only
+#database connections.
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
 @app.before_request
 def connect_db():
-    '''Creates a database connection before the request is proccessed.
+    '''Borrows a database connection from the Engine pool before the request
+    is proccessed. The requests with a safe method get a read-only
+    connection from the read pool; the rest, the read-write connection.
+
+    In write-behind mode all the requests get a read-only connection: the
+    writes are run by the writer of the Engine. Check _write.
 
     The connection is stored in the application context variable flask.g .
     Hence it is accessible from the request object.'''
-
-    g.con = app.config['Engine'].connect()
+    engine = app.config['Engine']
+    g.con = engine.acquire(engine.write_behind or
+                           request.method in SAFE_METHODS)
 
 
 #HOOKS
 @app.teardown_request
 def close_connection(exc):
-    ''' Closes the database connection
+    ''' Returns the database connection to the Engine pool
         Check if the connection is created. It migth be exception appear before
         the connection is created.'''
-    if hasattr(g, 'con'):
-        g.con.close()
+    con = g.pop('con', None)
+    if con is not None:
+        app.config['Engine'].release(con)
+
+
+#Validator of all the tables when clear_stale_caches last checked them
+_tables_etag = None
+
+
+@app.before_request
+def clear_stale_caches():
+    '''
+    Clears the MessageCache and the UserCache before a request if any table
+    has changed since the previous one.
+
+    The resources only invalidate the entries of the representations they
+    change. This catches the rest of the changes counted by the
+    :py:attr:`forum.database.Engine.versions`: those of
+    :py:meth:`forum.database.Engine.bulk_load` and
+    :py:meth:`forum.database.Engine.create_partition` and, with a
+    :py:class:`forum.versions.SharedTableVersions`, those of the other
+    processes. The changes of the processes that do not share the counters
+    are seen once the cached entries expire, after the ttl of the caches.
+    '''
+    global _tables_etag
+    etag, _ = app.config['Engine'].versions.validators(*database.TABLES)
+    if etag != _tables_etag:
+        app.config['MessageCache'].clear()
+        app.config['UserCache'].clear()
+        _tables_etag = etag
+
+
+def conditional(*tables):
+    '''
+    Decorator for the get methods of the resources whose representation is
+    built only from ``tables``.
+
+    The ETag and Last-Modified headers are generated from the
+    :py:class:`forum.database.TableVersions` of the Engine, so the
+    preconditions If-None-Match and If-Modified-Since are evaluated before
+    querying the database. If they hold, the response is 304 Not Modified
+    without body.
+
+    The validators are read before the representation is built. If a change
+    is committed meanwhile, the client just gets the new representation in
+    the next request.
+    '''
+    def decorator(get):
+        @functools.wraps(get)
+        def wrapper(*args, **kwargs):
+            versions = app.config['Engine'].versions
+            etag, last_modified = versions.validators(*tables)
+            #HTTP dates have a resolution of seconds
+            last_modified = int(last_modified)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            elif request.if_modified_since:
+                since = calendar.timegm(
+                    request.if_modified_since.utctimetuple())
+                not_modified = last_modified <= since
+            else:
+                not_modified = False
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = get(*args, **kwargs)
+                if not isinstance(response, Response) or \
+                   response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
+
+
+def stream_response(envelope, mimetype, headers=None):
+    '''
+    Creates a 200 response whose body is the envelope serialised while it is
+    sent. Use it for collections whose items are a
+    :py:class:`forum.render.Stream` reading a database cursor.
+
+    The request context is kept until the whole body has been sent. The
+    database connection in g.con is owned by the response from now on and
+    it is given back to the pool when the response is closed.
+
+    :param dict headers: Additional headers of the response.
+    '''
+    engine, con = app.config['Engine'], g.pop('con')
+    body = ClosingIterator(stream_with_context(iterdumps(envelope)),
+                           lambda: engine.release(con))
+    return Response(body, 200, headers=headers, mimetype=mimetype)
+
+
+def build_url(resource, **values):
+    '''
+    Same as ``api.url_for(resource, **values)`` for URLs without query
+    parameters, but the URL is built from the template of the endpoint in
+    :py:data:`URL_TEMPLATES`. Use it in the loops over the items of a
+    collection. It must be called while handling a request.
+    '''
+    return request.script_root + \
+        URL_TEMPLATES[resource.endpoint].expand(**values)
+
+
+def _message_items(messages):
+    '''
+    :return: a generator of the Collection+JSON items of ``messages``, as
+        returned by :py:meth:`forum.database.Connection.iter_messages`.
+    '''
+    for message in messages:
+        _messageid = message['messageid']
+        _headline = message['title']
+        _url = build_url(Message, messageid=_messageid)
+        message = {}
+        message['href'] = _url
+        message['data'] = []
+        value = {'name': 'headline', 'value': _headline}
+        message['data'].append(value)
+        message['links'] = []
+        yield message
+
+
+def _user_items(users):
+    '''
+    :return: a generator of the Collection+JSON items of ``users``, as
+        returned by :py:meth:`forum.database.Connection.iter_users`.
+    '''
+    for user in users:
+        _nickname = user['nickname']
+        _registrationdate = user['registrationdate']
+        _url = build_url(User, nickname=_nickname)
+        _history_url = build_url(History, nickname=_nickname)
+        user = {}
+        user['href'] = _url
+        user['read-only'] = True
+        user['data'] = []
+        value = {'name': 'nickname', 'value': _nickname}
+        user['data'].append(value)
+        value = {'name': 'registrationdate', 'value': _registrationdate}
+        user['data'].append(value)
+        user['links'] = [{'href': _history_url,
+                          'rel': "messages",
+                          'name': "history",
+                          'prompt': "History of user"
+                        }]
+        yield user
+
+
+def _message_key(message):
+    '''
+    :return: the keyset pagination key (timestamp, message_id) of a message
+        returned by :py:meth:`forum.database.Connection.get_messages`
+    '''
+    messageid = database.parse_message_id(message['messageid'])
+    return message['timestamp'], messageid
+
+
+def _check_key(key, *types):
+    '''
+    Checks the key of a cursor decoded by :py:func:`forum.utils.decode_cursor`
+    before it is used, since the errors binding it would be raised once the
+    response is being streamed.
+
+    :param tuple key: The key of the cursor.
+    :param types: The type, or tuple of types, of each value of the key.
+    :raises ValueError: if the key has another length or types, or one of
+        its integers is out of the range of SQLite.
+    '''
+    if len(key) != len(types):
+        raise ValueError("The cursor is malformed")
+    for value, kind in zip(key, types):
+        if not isinstance(value, kind) or \
+           isinstance(value, (int, long)) and \
+           not MIN_INTEGER <= value <= MAX_INTEGER:
+            raise ValueError("The cursor is malformed")
+
+
+#Types of the values of the keys returned by _user_key, by order
+_USER_KEY_TYPES = {'nickname': (basestring,),
+                   'registrationdate': ((int, long, float), basestring)}
+
+
+def _user_key(user, order):
+    '''
+    :return: the keyset pagination key of a user returned by
+        :py:meth:`forum.database.Connection.get_users` sorted by ``order``.
+    '''
+    if order == 'registrationdate':
+        return user['registrationdate'], user['nickname']
+    return user['nickname'],
+
+
+def _message_cache_key(messageid):
+    '''
+    :return: the key of a message in the MessageCache. msg-01 and msg-1 are
+        the same message, so the key has the format used by the database.
+    '''
+    return 'msg-%d' % database.parse_message_id(messageid)
+
+
+def _get_user(nickname):
+    '''
+    Same as ``g.con.get_user(nickname)``, but the user record is served
+    from the UserCache when it is there. The record is shared by the
+    requests, so it must not be modified. Invalidate it in the UserCache
+    whenever the user is written.
+    '''
+    user_cache = app.config['UserCache']
+    user = user_cache.get(nickname)
+    if user is None:
+        user = g.con.get_user(nickname)
+        if user is not None:
+            user_cache.set(nickname, user, len(repr(user)))
+    return user
+
+
+def _write(method, *args):
+    '''
+    Runs the write method ``method`` of :py:class:`forum.database.Connection`
+    with g.con or, if the Engine works in write-behind mode, in its writer
+    thread, waiting until the change is committed.
+
+    :return: the return value of the method.
+    :raises HTTPException: 503 if the writer thread has stopped or the
+        change has not been committed within WRITE_TIMEOUT seconds.
+    '''
+    engine = app.config['Engine']
+    if engine.write_behind:
+        try:
+            return engine.submit(method, *args).result(WRITE_TIMEOUT)
+        except sqlite3.OperationalError:
+            #Same body as create_error_response
+            abort(503, title="Service unavailable",
+                  message="The changes cannot be saved now. Please, try "
+                          "again later",
+                  resource_url=request.path,
+                  resource_type=request.url_rule.endpoint)
+    return getattr(g.con, method)(*args)
+
+
+def _archived_response(messageid):
+    '''
+    :return: the 409 response of the requests that modify a message moved
+        to a partition, which is read-only. Check
+        :py:meth:`forum.database.Engine.create_partition`.
+    '''
+    return create_error_response(409, "Archived message",
+                                 "The message %s is archived and cannot be "
+                                 "modified, deleted, replied to or read as "
+                                 "a thread" % messageid)
+
+
+def _parse_message_template(template):
+    '''
+    Reads a message from a Collection+JSON template with the descriptors
+    headline, articleBody, author and inReplyTo (URL of the parent
+    message).
+
+    :return: a dictionary with the format of the items of
+        :py:meth:`forum.database.Connection.create_messages`.
+    :raises ValueError: if the template is malformed, the title or the
+        body are missing, a value is not a string or inReplyTo is not the
+        URL of a message.
+    '''
+    message = {}
+    names = {'headline': 'title', 'articleBody': 'body', 'author': 'sender',
+             'inReplyTo': 'replyto'}
+    try:
+        for d in template['data']:
+            if d['name'] in names:
+                message[names[d['name']]] = d['value']
+    except (KeyError, TypeError):
+        raise ValueError("The template is malformed")
+    if not message.get('title') or not message.get('body'):
+        raise ValueError("The title or the body are missing")
+    for descriptor in ('headline', 'articleBody', 'author'):
+        value = message.get(names[descriptor])
+        if value is not None and not isinstance(value, basestring):
+            raise ValueError("%s is not a string" % descriptor)
+    if message.get('replyto') is not None:
+        if not isinstance(message['replyto'], basestring):
+            raise ValueError("inReplyTo is not the URL of a message")
+        path = urlparse.urlsplit(message['replyto']).path
+        if path.startswith(request.script_root):
+            path = path[len(request.script_root):]
+        try:
+            endpoint, values = _request_ctx_stack.top.url_adapter.match(path)
+        except (NotFound, RequestRedirect, MethodNotAllowed):
+            endpoint = None
+        if endpoint != 'message':
+            raise ValueError("inReplyTo is not the URL of a message")
+        message['replyto'] = values['messageid']
+    return message
 
 
 #Define the resources
@@ -103,12 +621,19 @@ class Messages(Resource):
     '''
     Resource Messages implementation
     '''
+    @conditional('messages')
     def get(self):
         '''
         Get all messages.
 
         INPUT parameters:
-          None
+          The query parameters are:
+           * length: the number of messages in the page. By default
+                     DEFAULT_PAGE_SIZE, at most MAX_PAGE_SIZE.
+           * cursor: opaque value taken from the next and prev links.
+           * search: words that the headline or the body of the messages
+                     must contain. The messages are sorted from the most
+                     relevant and there is only a next link.
 
         RESPONSE ENTITY BODY:
         * Media type: Collection+JSON:
@@ -121,58 +646,145 @@ class Messages(Resource):
 
         Link relations used in items: None
         Semantic descriptions used in items: headline
-        Link relations used in links: users-all
+        Link relations used in links: users-all, next, prev. next and prev
+        are only included if there are more messages in that direction.
         Semantic descriptors used in template: headline, articleBody, author,
         editor.
+        Semantic descriptors used in queries: search, length.
 
         NOTE:
          * The attribute articleBody is obtained from the column messages.body
          * The attribute headline is obtained from the column messages.title
          * The attribute author is obtained from the column messages.sender
         '''
-        #Extract messages from database
-        messages_db = g.con.get_messages()
+        #Extract the pagination parameters
+        parameters = request.args
+        try:
+            length = int(parameters.get('length', DEFAULT_PAGE_SIZE))
+            direction, seek = 'next', None
+            if 'cursor' in parameters:
+                direction, seek = decode_cursor(parameters['cursor'])
+                #(timestamp, message_id) or (rank, message_id)
+                _check_key(seek, (int, long, float), (int, long))
+        except ValueError:
+            return create_error_response(400, "Wrong query parameters",
+                                         "The length or the cursor are "
+                                         "malformed")
+        length = max(1, min(length, MAX_PAGE_SIZE))
+        if 'search' in parameters:
+            return self._search(parameters['search'], length, direction,
+                                seek)
+        backwards = direction == 'prev'
+
+        #Extract messages from database. One extra message tells if there
+        #is another page.
+        messages_db = g.con.iter_messages(number_of_messages=length + 1,
+                                          seek=seek, backwards=backwards)
+        #First and last messages of the page, known once the items are sent
+        page = {'first': None, 'last': None, 'more': False}
+        if backwards:
+            #Backwards pages are read at once anyway. The extra message is
+            #the furthest from the cursor
+            messages_db = list(messages_db)
+            page['more'] = len(messages_db) > length
+            if page['more']:
+                messages_db = messages_db[1:]
+
+        def page_messages():
+            for count, message in enumerate(messages_db):
+                if count == length:
+                    page['more'] = True
+                    break
+                if page['first'] is None:
+                    page['first'] = message
+                page['last'] = message
+                yield message
+
+        def page_links():
+            links = [{'prompt': 'List of all users in the Forum',
+                      'rel': 'users-all', 'href': api.url_for(Users)}]
+            if page['first'] is None:
+                return links
+            page_args = {}
+            if 'length' in parameters:
+                page_args['length'] = length
+            #Going forward, there are older messages if the extra message
+            #was found. Going backwards, the client comes from older pages.
+            has_next = backwards or page['more']
+            has_prev = page['more'] if backwards else seek is not None
+            if has_next:
+                cursor = encode_cursor('next', _message_key(page['last']))
+                links.append(
+                    {'prompt': 'Older messages', 'rel': 'next',
+                     'href': api.url_for(Messages, cursor=cursor,
+                                         **page_args)})
+            if has_prev:
+                cursor = encode_cursor('prev', _message_key(page['first']))
+                links.append(
+                    {'prompt': 'Newer messages', 'rel': 'prev',
+                     'href': api.url_for(Messages, cursor=cursor,
+                                         **page_args)})
+            return links
+
+        #Create the envelope. The links depend on the messages of the page,
+        #so they go after the items.
+        envelope = {}
+        collection = OrderedDict()
+        envelope["collection"] = collection
+        collection['version'] = "1.0"
+        collection['href'] = api.url_for(Messages)
+        collection['template'] = MESSAGE_TEMPLATE
+        collection['queries'] = MESSAGES_QUERIES.fill(href=collection['href'])
+        #Create the items
+        collection['items'] = Stream(_message_items(page_messages()))
+        collection['links'] = Deferred(page_links)
 
-        #Create the envelope
+        #RENDER
+        return stream_response(envelope,
+                               COLLECTIONJSON+";"+FORUM_MESSAGE_PROFILE)
+
+    def _search(self, text, length, direction, seek):
+        '''
+        Builds the response of the search query of :py:meth:`get`.
+        '''
+        #The keys of the search pages are (rank, message_id)
+        try:
+            if seek is not None:
+                if direction != 'next':
+                    raise ValueError("The cursor is malformed")
+                _check_key(seek, (int, long, float), (int, long))
+        except ValueError:
+            return create_error_response(400, "Wrong query parameters",
+                                         "The cursor is malformed")
+        try:
+            #One extra message tells if there is another page
+            messages_db = g.con.search_messages(text, length + 1, seek)
+        except ValueError:
+            return create_error_response(400, "Wrong query parameters",
+                                         "The search has no words")
         envelope = {}
         collection = {}
         envelope["collection"] = collection
         collection['version'] = "1.0"
         collection['href'] = api.url_for(Messages)
-        collection['links'] = [
-                                {'prompt': 'List of all users in the Forum',
-                                'rel': 'users-all', 'href': api.url_for(Users)
-                                }
-            ]
-        collection['template'] = {
-            "data": [
-                {"prompt": "", "name": "headline",
-                 "value": "", "required": True},
-                {"prompt": "", "name": "articleBody",
-                 "value": "", "required": True},
-                {"prompt": "", "name": "author",
-                 "value": "", "required": False},
-                {"prompt": "", "name": "editor",
-                 "value": "", "required": False}
-            ]
-        }
-        #Create the items
-        items = []
-        for message in messages_db:
-            _messageid = message['messageid']
-            _headline = message['title']
-            _url = api.url_for(Message, messageid=_messageid)
-            message = {}
-            message['href'] = _url
-            message['data'] = []
-            value = {'name':'headline', 'value': _headline}
-            message['data'].append(value)
-            message['links'] = []
-            items.append(message)
-        collection['items'] = items
+        collection['queries'] = MESSAGES_QUERIES.fill(href=collection['href'])
+        collection['links'] = [{'prompt': 'List of all users in the Forum',
+                                'rel': 'users-all', 'href': api.url_for(Users)}]
+        if len(messages_db) > length:
+            messages_db = messages_db[:length]
+            page_args = {'search': text}
+            if 'length' in request.args:
+                page_args['length'] = length
+            last = messages_db[-1]
+            cursor = encode_cursor('next', (last['rank'],
+                                            _message_key(last)[1]))
+            collection['links'].append(
+                {'prompt': 'Less relevant messages', 'rel': 'next',
+                 'href': api.url_for(Messages, cursor=cursor, **page_args)})
+        collection['items'] = list(_message_items(messages_db))
 
         #RENDER
-        return Response(json.dumps(envelope), 200,
+        return Response(dumps(envelope), 200,
                         mimetype=COLLECTIONJSON+";"+FORUM_MESSAGE_PROFILE)
 
     def post(self):
@@ -247,7 +859,7 @@ class Messages(Resource):
             return create_error_response(400, "Wrong request format",
                                          "Be sure you include message title and body")
         #Create the new message and build the response code'
-        newmessageid = g.con.create_message(title, body, sender, ipaddress)
+        newmessageid = _write('create_message', title, body, sender, ipaddress)
         if not newmessageid:
             return create_error_response(500, "Problem with the database",
                                          "Cannot access the database")
@@ -264,6 +876,7 @@ class Message(Resource):
     Resource that represents a single message in the API.
     '''
 
+    @conditional('messages', 'users')
     def get(self, messageid):
         '''
         Get the body, the title and the id of a specific message.
@@ -284,7 +897,8 @@ class Message(Resource):
             Link relations used: self, collection, author, replies and
             in-reply-to
 
-            Semantic descriptors used: articleBody, headline, editor and author
+            Semantic descriptors used: articleBody, headline, editor, author,
+            replyCount and lastReply
             NOTE: editor should not be included in the output if the database
             return None.
 
@@ -296,8 +910,19 @@ class Message(Resource):
          * The attribute articleBody is obtained from the column messages.body
          * The attribute headline is obtained from the column messages.title
          * The attribute author is obtained from the column messages.sender
+         * The attributes replyCount and lastReply are the number of direct
+           replies and the timestamp of the last one, obtained from the
+           table message_counters
         '''
 
+        #Serve the representation from the cache if it was already rendered
+        message_cache = app.config['MessageCache']
+        cache_key = _message_cache_key(messageid)
+        body = message_cache.get(cache_key)
+        if body is not None:
+            return Response(body, 200,
+                            mimetype=HAL+";"+FORUM_MESSAGE_PROFILE)
+
         #PEFORM OPERATIONS INITIAL CHECKS
         #Get the message from db
         message_db = g.con.get_message(messageid)
@@ -313,19 +938,7 @@ class Message(Resource):
         envelope["_links"] = links
 
         #Fill the links
-        _curies = [
-            {
-                "name": "msg",
-                "href": FORUM_MESSAGE_PROFILE + "/{rels}",
-                "templated": True
-            },
-            {
-                "name": "atom-thread",
-                "href": ATOM_THREAD_PROFILE + "/{rels}",
-                "templated": True
-            }
-        ]
-        links['curies'] = _curies
+        links['curies'] = MESSAGE_CURIES
         links['self'] = {'href': api.url_for(Message, messageid=messageid),
                          'profile': FORUM_MESSAGE_PROFILE}
         links['msg:edit'] = {'href': api.url_for(Message, messageid=messageid),
@@ -341,7 +954,8 @@ class Message(Resource):
         #Extract the author and add the link
         #If sender is not Anonymous extract the nickname from message_db,
         #the link exista but its href points to None.
-        sender_db = message_db.get('sender', 'Anonymous')
+        #The sender is None if the user was deleted.
+        sender_db = message_db.get('sender') or 'Anonymous'
         if sender_db != 'Anonymous':
             links['msg:author'] = {
                 'href': api.url_for(User, nickname=sender_db),
@@ -367,28 +981,21 @@ class Message(Resource):
 
 
         #Fill the template
-        envelope['template'] = {
-            "data": [
-                {"prompt": "", "name": "headline",
-                 "value": "", "required": True},
-                {"prompt": "", "name": "articleBody",
-                 "value": "", "required": True},
-                {"prompt": "", "name": "author",
-                 "value": "", "required": False},
-                {"prompt": "", "name": "editor",
-                 "value": "", "required": False}
-            ]
-        }
+        envelope['template'] = MESSAGE_TEMPLATE
 
         #Fill the rest of properties
         envelope['articleBody'] = message_db['body']
         envelope['headline'] = message_db['title']
         envelope['author'] = sender_db  # Calculated before. It can be Anonymous
         envelope['editor'] = message_db['editor']
+        counters = g.con.get_message_counters(messageid)
+        envelope['replyCount'] = counters['replycount']
+        envelope['lastReply'] = counters['lastreply']
 
         #RENDER
-        return Response(json.dumps(envelope), 200,
-                        mimetype=HAL+";"+FORUM_MESSAGE_PROFILE)
+        body = dumps(envelope)
+        message_cache.set(cache_key, body)
+        return Response(body, 200, mimetype=HAL+";"+FORUM_MESSAGE_PROFILE)
 
     def delete(self, messageid):
         '''
@@ -400,11 +1007,17 @@ class Message(Resource):
         RESPONSE STATUS CODE
          * Returns 204 if the message was deleted
          * Returns 404 if the messageid is not associated to any message.
+         * Returns 409 if the message is archived.
         '''
 
         #PERFORM DELETE OPERATIONS
-        if g.con.delete_message(messageid):
+        if _write('delete_message', messageid):
+            #The replies are deleted in cascade, so none of the cached
+            #messages can be trusted.
+            app.config['MessageCache'].clear()
             return '', 204
+        elif g.con.is_archived(messageid):
+            return _archived_response(messageid)
         else:
             #Send error message
             return create_error_response(404, "Unknown message",
@@ -436,6 +1049,7 @@ class Message(Resource):
          * Returns 400 if the body of the request is not well formed or it is
            empty.
          * Returns 404 if there is no message with messageid
+         * Returns 409 if the message is archived.
          * Returns 415 if the input is not JSON.
          * Returns 500 if the database cannot be modified
 
@@ -447,6 +1061,8 @@ class Message(Resource):
         '''
 
         #CHECK THAT MESSAGE EXISTS
+        if g.con.is_archived(messageid):
+            return _archived_response(messageid)
         if not g.con.contains_message(messageid):
             return create_error_response(404, "Message not found",
                                          "There is no a message with id %s" % messageid
@@ -497,10 +1113,11 @@ class Message(Resource):
                                           )
         else:
             #Modify the message in the database
-            if not g.con.modify_message(messageid, title, body, editor):
+            if not _write('modify_message', messageid, title, body, editor):
                 return create_error_response(500, "Internal error",
                                          "Message information for %s cannot be updated" % messageid
                                         )
+            app.config['MessageCache'].invalidate(_message_cache_key(messageid))
             return '', 204
 
     def post(self, messageid):
@@ -532,6 +1149,7 @@ class Message(Resource):
          * Returns 400 if the message is not well formed or the entity body is
            empty.
          * Returns 404 if there is no message with messageid
+         * Returns 409 if the message is archived.
          * Returns 415 if the format of the response is not json
          * Returns 500 if the message could not be added to database.
 
@@ -543,6 +1161,8 @@ class Message(Resource):
 
         #CHECK THAT MESSAGE EXISTS
         #If the message with messageid does not exist return status code 404
+        if g.con.is_archived(messageid):
+            return _archived_response(messageid)
         if not g.con.contains_message(messageid):
             return create_error_response(404, "Message not found",
                                          "There is no a message with id %s" % messageid
@@ -594,11 +1214,12 @@ class Message(Resource):
                                           )
 
         #Create the new message and build the response code'
-        newmessageid = g.con.append_answer(messageid, title, body,
-                                           sender, ipaddress)
+        newmessageid = _write('append_answer', messageid, title, body,
+                              sender, ipaddress)
         if not newmessageid:
             return create_error_response(500, "Internal error",
                                          "Cannot create a new message")
+        app.config['MessageCache'].invalidate(_message_cache_key(messageid))
 
         #Create the Location header with the id of the message created
         url = api.url_for(Message, messageid=newmessageid)
@@ -607,13 +1228,228 @@ class Message(Resource):
         #Return the response
         return Response(status=201, headers={'Location': url})
 
+class Thread(Resource):
+    '''
+    Resource that represents a message and all its replies.
+    '''
+
+    @conditional('messages')
+    def get(self, messageid):
+        '''
+        Get the reply tree of a message in one request.
+
+        INPUT PARAMETER
+       : param str messageid: The id of the root message of the thread.
+
+        The query parameters are:
+         * depth: replies deeper than depth levels below the root are not
+                  included. By default there is no limit.
+         * length: the number of messages in the page. By default
+                   DEFAULT_PAGE_SIZE, at most MAX_PAGE_SIZE.
+         * cursor: opaque value taken from the next link.
+
+        RESPONSE ENTITY BODY:
+        * Media type: Collection+JSON:
+             http://amundsen.com/media-types/collection/
+         * Profile: Forum_Message
+           http://atlassian.virtues.fi: 8090/display/PWP
+           /Exercise+4#Exercise4-Forum_Message
+
+        The items are in depth-first order: every message is followed by its
+        replies.
+        Link relations used in items: in-reply-to (except for the root)
+        Semantic descriptions used in items: headline, author, depth
+        Link relations used in links: up (the root message), next. next is
+        only included if there are more messages in the thread.
+
+        RESPONSE STATUS CODE:
+         * Returns 200 if the message exists.
+         * Returns 400 if the query parameters are malformed.
+         * Returns 404 if the message does not exist.
+         * Returns 409 if the message is archived.
+        '''
+        parameters = request.args
+        try:
+            max_depth = int(parameters.get('depth', -1))
+            length = int(parameters.get('length', DEFAULT_PAGE_SIZE))
+            seek = None
+            if 'cursor' in parameters:
+                direction, key = decode_cursor(parameters['cursor'])
+                if direction != 'next' or \
+                   not isinstance(key[0], basestring):
+                    raise ValueError("The cursor is malformed")
+                seek = key[0]
+        except ValueError:
+            return create_error_response(400, "Wrong query parameters",
+                                         "The depth, the length or the "
+                                         "cursor are malformed")
+        length = max(1, min(length, MAX_PAGE_SIZE))
+
+        #One extra message tells if there is another page
+        messages_db = g.con.get_thread(messageid, max_depth, length + 1, seek)
+        if messages_db is None:
+            return create_error_response(404, "Unknown message",
+                                         "There is no a message with id %s"
+                                         % messageid)
+        #The root of a thread is always read, unless it is archived
+        if not messages_db and g.con.is_archived(messageid):
+            return _archived_response(messageid)
+
+        #Create the envelope
+        envelope = {}
+        collection = {}
+        envelope["collection"] = collection
+        collection['version'] = "1.0"
+        collection['href'] = api.url_for(Thread, messageid=messageid)
+        collection['links'] = [{'prompt': 'Root message of the thread',
+                                'rel': 'up',
+                                'href': api.url_for(Message,
+                                                    messageid=messageid)}]
+        if len(messages_db) > length:
+            messages_db = messages_db[:length]
+            page_args = {}
+            if 'depth' in parameters:
+                page_args['depth'] = max_depth
+            if 'length' in parameters:
+                page_args['length'] = length
+            cursor = encode_cursor('next', (messages_db[-1]['path'],))
+            collection['links'].append(
+                {'prompt': 'Next messages of the thread', 'rel': 'next',
+                 'href': api.url_for(Thread, messageid=messageid,
+                                     cursor=cursor, **page_args)})
+        items = []
+        for message in messages_db:
+            item = {}
+            item['href'] = build_url(Message, messageid=message['messageid'])
+            item['data'] = [
+                {'name': 'headline', 'value': message['title']},
+                {'name': 'author', 'value': message['sender']},
+                {'name': 'depth', 'value': message['depth']}]
+            item['links'] = []
+            if message['replyto'] is not None:
+                item['links'].append(
+                    {'rel': 'in-reply-to', 'prompt': 'Parent message',
+                     'href': build_url(Message,
+                                       messageid=message['replyto'])})
+            items.append(item)
+        collection['items'] = items
+
+        #RENDER
+        return Response(dumps(envelope), 200,
+                        mimetype=COLLECTIONJSON+";"+FORUM_MESSAGE_PROFILE)
+
+class MessagesBatch(Resource):
+    '''
+    Resource to create many messages with one request.
+    '''
+
+    def post(self):
+        '''
+        Adds many messages in one transaction. Either all the messages are
+        created or none.
+
+        REQUEST ENTITY BODY:
+         * Media type: Collection+JSON:
+             http://amundsen.com/media-types/collection/
+         * Profile: Forum_Message
+           http://atlassian.virtues.fi: 8090/display/PWP
+           /Exercise+4#Exercise4-Forum_Message
+
+        The body is an object whose attribute templates is an array of, at
+        most, MAX_BATCH_SIZE Collection+JSON templates, like the template
+        accepted by Messages.post. A template may include the descriptor
+        inReplyTo, with the URL of the message it replies to.
+        If author is not there consider it "Anonymous".
+
+        RESPONSE ENTITY BODY:
+         * Media type: Collection+JSON:
+             http://amundsen.com/media-types/collection/
+         * The items are the URLs of the created messages, in the order of
+           the templates.
+
+        RESPONSE STATUS CODE:
+         * Returns 201 if the messages have been added correctly.
+         * Returns 400 if any template is not well formed, or there are no
+           templates or too many.
+         * Returns 404 if any message replied to does not exist.
+         * Returns 409 if any message replied to has been archived.
+         * Returns 415 if the format of the response is not json
+         * Returns 500 if the messages could not be added to database.
+
+        '''
+        if COLLECTIONJSON != request.headers.get('Content-Type',''):
+            return create_error_response(415, "UnsupportedMediaType",
+                                         "Use a JSON compatible format")
+        request_body = request.get_json(force=True)
+        try:
+            templates = request_body['templates']
+        except (KeyError, TypeError):
+            templates = None
+        if not isinstance(templates, list) or not templates or \
+           len(templates) > MAX_BATCH_SIZE:
+            return create_error_response(
+                400, "Wrong request format",
+                "Include between 1 and %d templates" % MAX_BATCH_SIZE)
+
+        #Validate all the templates before creating any message
+        messages = []
+        errors = []
+        for index, template in enumerate(templates):
+            try:
+                messages.append(_parse_message_template(template))
+            except ValueError, excp:
+                errors.append('Template %d: %s' % (index, excp))
+        if errors:
+            return create_error_response(400, "Wrong request format",
+                                         '. '.join(errors))
+        for message in messages:
+            if message.get('replyto') is not None and \
+               g.con.is_archived(message['replyto']):
+                return _archived_response(message['replyto'])
+
+        try:
+            newmessageids = _write('create_messages', messages,
+                                   request.remote_addr)
+        except ValueError:
+            return create_error_response(400, "Wrong request format",
+                                         "inReplyTo is not a valid message")
+        if newmessageids is None:
+            return create_error_response(404, "Resource not found",
+                                         "A message replied to does not exist")
+        cache = app.config['MessageCache']
+        for message in messages:
+            if message.get('replyto') is not None:
+                cache.invalidate(_message_cache_key(message['replyto']))
+
+        #RENDER
+        envelope = {}
+        collection = {}
+        envelope["collection"] = collection
+        collection['version'] = "1.0"
+        collection['href'] = api.url_for(MessagesBatch)
+        collection['items'] = [
+            {'href': build_url(Message, messageid=messageid)}
+            for messageid in newmessageids]
+        return Response(dumps(envelope), 201,
+                        mimetype=COLLECTIONJSON+";"+FORUM_MESSAGE_PROFILE)
+
 class Users(Resource):
 
+    @conditional('users')
     def get(self):
         '''
-        Gets a list of all the users in the database.
+        Gets a page of the list of the users in the database.
 
-        It returns always status code 200.
+        INPUT parameters:
+          The query parameters are:
+           * length: the number of users in the page. By default
+                     DEFAULT_PAGE_SIZE, at most MAX_PAGE_SIZE.
+           * cursor: opaque value taken from the next and prev links.
+           * order: nickname (default) or registrationdate. Users are
+                    sorted in ascending order.
+
+        It returns status code 200, or 400 if the query parameters are
+        malformed.
 
         RESPONSE ENTITITY BODY:
 
@@ -631,12 +1467,15 @@ class Users(Resource):
 
         Semantic descriptions used in items: nickname, registrationdate
 
-        Link relations used in links: messages-all
+        Link relations used in links: messages-all, next, prev. next and prev
+        are only included if there are more users in that direction.
 
         Semantic descriptors used in template: address, avatar, birthday,
         email,familyname,gender,givenName,image, nickname, signature, skype, telephone,
         website
 
+        Semantic descriptors used in queries: order, length.
+
         NOTE:
          * The attribute signature is obtained from the column users_profile.signature
          * The attribute givenName is obtained from the column users_profile.firstname
@@ -648,77 +1487,87 @@ class Users(Resource):
          * The rest of attributes match one-to-one with column names in the
            database.
         '''
-        #PERFORM OPERATIONS
-        #Create the messages list
-        users_db = g.con.get_users()
+        #Extract the pagination parameters
+        parameters = request.args
+        order = parameters.get('order', 'nickname')
+        try:
+            length = int(parameters.get('length', DEFAULT_PAGE_SIZE))
+            direction, seek = 'next', None
+            if 'cursor' in parameters:
+                direction, seek = decode_cursor(parameters['cursor'])
+                #The key of an unknown order does not match any type
+                _check_key(seek, *_USER_KEY_TYPES.get(order, ()))
+            #PERFORM OPERATIONS
+            #Create the users generator. The users are read while the
+            #response is sent. One extra user tells if there is another page.
+            length = max(1, min(length, MAX_PAGE_SIZE))
+            backwards = direction == 'prev'
+            users_db = g.con.iter_users(length + 1, seek, backwards, order)
+        except ValueError:
+            return create_error_response(400, "Wrong query parameters",
+                                         "The length, the cursor or the "
+                                         "order are malformed")
+        #First and last users of the page, known once the items are sent
+        page = {'first': None, 'last': None, 'more': False}
+        if backwards:
+            #Backwards pages are read at once anyway. The extra user is the
+            #furthest from the cursor
+            users_db = list(users_db)
+            page['more'] = len(users_db) > length
+            if page['more']:
+                users_db = users_db[1:]
+
+        def page_users():
+            for count, user in enumerate(users_db):
+                if count == length:
+                    page['more'] = True
+                    break
+                if page['first'] is None:
+                    page['first'] = user
+                page['last'] = user
+                yield user
+
+        def page_links():
+            links = [{'prompt': 'List of all messages in the Forum',
+                      'rel': 'messages-all',
+                      'href': api.url_for(Messages)}]
+            if page['first'] is None:
+                return links
+            page_args = {}
+            if 'length' in parameters:
+                page_args['length'] = length
+            if 'order' in parameters:
+                page_args['order'] = order
+            has_next = backwards or page['more']
+            has_prev = page['more'] if backwards else seek is not None
+            if has_next:
+                cursor = encode_cursor('next', _user_key(page['last'], order))
+                links.append(
+                    {'prompt': 'Next users', 'rel': 'next',
+                     'href': api.url_for(Users, cursor=cursor, **page_args)})
+            if has_prev:
+                cursor = encode_cursor('prev', _user_key(page['first'], order))
+                links.append(
+                    {'prompt': 'Previous users', 'rel': 'prev',
+                     'href': api.url_for(Users, cursor=cursor, **page_args)})
+            return links
 
         #FILTER AND GENERATE THE RESPONSE
-       #Create the envelope
+        #Create the envelope. The links depend on the users of the page, so
+        #they go after the items.
         envelope = {}
-        collection = {}
+        collection = OrderedDict()
         envelope["collection"] = collection
         collection['version'] = "1.0"
         collection['href'] = api.url_for(Users)
-        collection['links'] = [{'prompt': 'List of all messages in the Forum',
-                                'rel': 'messages-all',
-                                'href': api.url_for(Messages)}
-                              ]
-
-        collection['template'] = {
-            "data": [
-                {"prompt": "Insert nickname", "name": "nickname",
-                 "value": "", "required": True},
-                {"prompt": "Insert user address", "name": "address",
-                 "object": {}, "required": False},
-                {"prompt": "Insert user avatar", "name": "avatar",
-                 "value": "", "required": True},
-                {"prompt": "Insert user birthday", "name": "birthday",
-                 "value": "", "required": True},
-                {"prompt": "Insert user email", "name": "email",
-                 "value": "", "required": True},
-                {"prompt": "Insert user familyName", "name": "familyName",
-                 "value": "", "required": True},
-                {"prompt": "Insert user gender", "name": "gender",
-                 "value": "", "required": True},
-                {"prompt": "Insert user givenName", "name": "givenName",
-                 "value": "", "required": True},
-                {"prompt": "Insert user image", "name": "image",
-                 "value": "", "required": False},
-                {"prompt": "Insert user signature", "name": "signature",
-                 "value": "", "required": True},
-                {"prompt": "Insert user skype", "name": "skype",
-                 "value": "", "required": False},
-                {"prompt": "Insert user telephone", "name": "telephone",
-                 "value": "", "required": False},
-                {"prompt": "Insert user website", "name": "website",
-                 "value": "", "required": False}
-            ]
-        }
+        collection['template'] = USERS_TEMPLATE
+        collection['queries'] = USERS_QUERIES.fill(href=collection['href'])
         #Create the items
-        items = []
-        for user in users_db:
-            _nickname = user['nickname']
-            _registrationdate = user['registrationdate']
-            _url = api.url_for(User, nickname=_nickname)
-            _history_url = api.url_for(History, nickname=_nickname)
-            user = {}
-            user['href'] = _url
-            user['read-only'] = True
-            user['data'] = []
-            value = {'name': 'nickname', 'value': _nickname}
-            user['data'].append(value)
-            value = {'name': 'registrationdate', 'value': _registrationdate}
-            user['data'].append(value)
-            user['links'] = [{'href': _history_url,
-                              'rel': "messages",
-                              'name': "history",
-                              'prompt': "History of user"
-                            }]
-            items.append(user)
-        collection['items'] = items
+        collection['items'] = Stream(_user_items(page_users()))
+        collection['links'] = Deferred(page_links)
         #RENDER
-        return Response(json.dumps(envelope), 200,
-                        mimetype=COLLECTIONJSON+";"+FORUM_USER_PROFILE)
+        return stream_response(envelope,
+                               COLLECTIONJSON+";"+FORUM_USER_PROFILE)
 
     def post(self):
         '''
@@ -863,7 +1712,8 @@ class Users(Resource):
         }
 
         try:
-            nickname = g.con.append_user(_nickname, user)
+            nickname = _write('append_user', _nickname, user)
+            app.config['UserCache'].invalidate(_nickname)
         except ValueError:
             return create_error_response(400, "Wrong request format",
                                          "Be sure you include all"
@@ -886,6 +1736,7 @@ class User(Resource):
     User Resource. Public and private profile are separate resources.
     '''
 
+    @conditional('users', 'messages')
     def get(self, nickname):
         '''
         Get basic information of a user:
@@ -907,7 +1758,10 @@ class User(Resource):
         Link relations used: self, collection, public-data, private-data,
         messages.
 
-        Semantic descriptors used: nickname and registrationdate
+        Semantic descriptors used: nickname, registrationdate, messageCount
+        and lastActivity. The last two are the number of messages sent by
+        the user and the timestamp of the last one, obtained from the table
+        user_counters.
 
         NOTE:
         The: py: method:`Connection.get_user()` returns a dictionary with the
@@ -922,7 +1776,7 @@ class User(Resource):
             }
         '''
         #PERFORM OPERATIONS
-        user_db = g.con.get_user(nickname)
+        user_db = _get_user(nickname)
         if not user_db:
             return create_error_response(404, "Unknown user",
                                          "There is no a user with nickname %s"
@@ -936,14 +1790,7 @@ class User(Resource):
         envelope["_links"] = links
 
         #Fill the links
-        _curies = [
-            {
-                "name": "user",
-                "href": FORUM_USER_PROFILE + "/{rels}",
-                "templated": True
-            }
-        ]
-        links['curies'] = _curies
+        links['curies'] = USER_CURIES
         links['self'] = {'href': api.url_for(User, nickname=nickname),
                          'profile': FORUM_USER_PROFILE}
         links['collection'] = {'href': api.url_for(Users),
@@ -967,9 +1814,12 @@ class User(Resource):
         }
         envelope['nickname'] = nickname
         envelope['registrationdate'] = user_db['public_profile']['registrationdate']
+        counters = g.con.get_user_counters(nickname)
+        envelope['messageCount'] = counters['messagecount']
+        envelope['lastActivity'] = counters['lastactivity']
 
         #RENDER
-        return Response(json.dumps(envelope), 200,
+        return Response(dumps(envelope), 200,
                         mimetype=HAL+";"+FORUM_USER_PROFILE)
 
     def delete(self, nickname):
@@ -986,7 +1836,11 @@ class User(Resource):
         #PEROFRM OPERATIONS
         #Try to delete the user. If it could not be deleted, the database
         #returns None.
-        if g.con.delete_user(nickname):
+        if _write('delete_user', nickname):
+            app.config['UserCache'].invalidate(nickname)
+            #The messages of the user are now anonymous. Drop every cached
+            #message instead of looking for the ones sent by the user.
+            app.config['MessageCache'].clear()
             #RENDER RESPONSE
             return '', 204
         else:
@@ -1000,6 +1854,7 @@ class User_public(Resource):
     Profile information publicly available
     '''
 
+    @conditional('users', 'users_profile')
     def get (self, nickname):
         '''
         Get public information about a user
@@ -1040,7 +1895,7 @@ class User_public(Resource):
 
         '''
         #PERFORM OPERATIONS
-        user_db = g.con.get_user(nickname)
+        user_db = _get_user(nickname)
         if not user_db:
             return create_error_response(404, "Unknown user",
                                          "There is no a user with nickname %s"
@@ -1053,15 +1908,7 @@ class User_public(Resource):
         envelope["_links"] = links
 
         #Fill the links
-         #Fill the links
-        _curies = [
-            {
-                "name": "user",
-                "href": FORUM_USER_PROFILE + "/{rels}",
-                "templated": True
-            }
-        ]
-        links['curies'] = _curies
+        links['curies'] = USER_CURIES
 
         links['self'] = {'href': api.url_for(User_public, nickname=nickname),
                          'profile': FORUM_USER_PROFILE}
@@ -1086,25 +1933,10 @@ class User_public(Resource):
         envelope['registrationdate'] = user_db['public_profile']['registrationdate']
         envelope['signature'] = user_db['public_profile']['signature']
         envelope['avatar'] = user_db['public_profile']['avatar']
-        envelope['template'] = {
-            "data": [
-                {
-                    "prompt": "Insert signature text",
-                    "name": "signature",
-                    "value": "",
-                    "required": True
-                },
-                {
-                    "prompt": "Insert avatar file name",
-                    "name": "avatar",
-                    "value": "",
-                    "required": True
-                }
-            ]
-        }
+        envelope['template'] = USER_PUBLIC_TEMPLATE
 
         #RENDER
-        return Response(json.dumps(envelope), 200,
+        return Response(dumps(envelope), 200,
                         mimetype=HAL+";"+FORUM_USER_PROFILE)
 
     def put (self, nickname):
@@ -1194,8 +2026,9 @@ class User_public(Resource):
             user = {'public_profile': {'signature': _signature,
                                        'avatar': _avatar}}
             #Modify the message in the database
-            if not g.con.modify_user(nickname, user):
+            if not _write('modify_user', nickname, user):
                 return NotFound()
+            app.config['UserCache'].invalidate(nickname)
             return '', 204
 
 class User_restricted(Resource):
@@ -1204,6 +2037,7 @@ class User_restricted(Resource):
     authorized users. No authorization implemented, though.
     '''
 
+    @conditional('users', 'users_profile')
     def get(self, nickname):
         '''
         Gets the personal data information relative to a user
@@ -1246,7 +2080,7 @@ class User_restricted(Resource):
             }
         '''
         #PERFORM OPERATIONS
-        user_db = g.con.get_user(nickname)
+        user_db = _get_user(nickname)
         if not user_db:
             return create_error_response(404, "Unknown user",
                                          "There is no a user with nickname %s"
@@ -1260,15 +2094,7 @@ class User_restricted(Resource):
         envelope["_links"] = links
 
         #Fill the links
-         #Fill the links
-        _curies = [
-            {
-                "name": "user",
-                "href": FORUM_USER_PROFILE + "/{rels}",
-                "templated": True
-            }
-        ]
-        links['curies'] = _curies
+        links['curies'] = USER_CURIES
         links['self'] = {'href': api.url_for(User_public, nickname=nickname),
                          'profile': FORUM_USER_PROFILE}
         links['user:parent'] = {'href': api.url_for(User, nickname=nickname),
@@ -1299,52 +2125,9 @@ class User_restricted(Resource):
         envelope['telephone'] = user_db['restricted_profile']['mobile']
         envelope['skype'] = user_db['restricted_profile']['skype']
         envelope['image'] = user_db['restricted_profile']['picture']
-        envelope['template'] = {
-            "data": [
-                {"prompt": "Insert user address",
-                 "name": "address",
-                 "object": {},
-                 "required": False},
-                {"prompt": "Insert user birthday",
-                 "name": "birthday",
-                 "value": "",
-                 "required": True},
-                {"prompt": "Insert user email",
-                 "name": "email",
-                 "value": "",
-                 "required": True},
-                {"prompt": "Insert user familyName",
-                 "name": "familyName",
-                 "value": "",
-                 "required": True},
-                {"prompt": "Insert user gender",
-                 "name": "gender",
-                 "value":  "",
-                 "required": True},
-                {"prompt": "Insert user givenName",
-                 "name": "givenName",
-                 "value": "",
-                 "required": True},
-                {"prompt": "Insert user website",
-                 "name": "website",
-                 "value": "",
-                 "required": False},
-                {"prompt": "Insert user telephone",
-                 "name":  "telephone",
-                 "value":  "",
-                 "required": False},
-                {"prompt": "Insert user skype",
-                 "name": "skype",
-                 "value": "",
-                 "required": False},
-                {"prompt": "Insert user image",
-                 "name": "image",
-                 "value": "",
-                 "required": False}
-            ]
-        }
+        envelope['template'] = USER_RESTRICTED_TEMPLATE
         #RENDER
-        return Response(json.dumps(envelope), 200,
+        return Response(dumps(envelope), 200,
                         mimetype=HAL+";"+FORUM_USER_PROFILE)
 
     def put (self, nickname):
@@ -1409,7 +2192,7 @@ class User_restricted(Resource):
 
         '''
         #Check user exists:
-        user_db = g.con.get_user(nickname)
+        user_db = _get_user(nickname)
         if not user_db:
             return create_error_response(404, "Unknown user",
                                          "There is no a user with nickname %s"
@@ -1481,12 +2264,14 @@ class User_restricted(Resource):
                                    'gender': _temp_dictionary['gender'],
                                    'picture': _temp_dictionary['picture']}
         }
-        g.con.modify_user(nickname, user)
+        _write('modify_user', nickname, user)
+        app.config['UserCache'].invalidate(nickname)
 
         #CREATE RESPONSE AND RENDER
         return Response(status=204)
 
 class History(Resource):
+    @conditional('messages', 'users')
     def get (self, nickname):
         '''
             This method returns a list of messages that has been sent by an user
@@ -1522,6 +2307,12 @@ class History(Resource):
             Link relations used in links: messages-all, author
 
             Semantic descriptors used in queries: after, before, lenght
+
+            RESPONSE HEADERS:
+             * X-Message-Count: number of messages sent by the user, without
+               the restrictions of the query parameters.
+             * X-Last-Activity: UNIX timestamp of the last message sent by
+               the user.
         '''
         #INTIAL CHECKING
         #Extract query parameters
@@ -1533,11 +2324,15 @@ class History(Resource):
         #PERFORM OPERATIONS
         #Get the messages. This method return None if there is
         #not user with nickname = nickname
-        messages_db = g.con.get_messages(nickname, length, before, after)
-        if messages_db is None or not messages_db:
+        messages_db = g.con.iter_messages(nickname, length, before, after)
+        #Read the first message to know if the list is empty
+        try:
+            first = next(messages_db)
+        except StopIteration:
             return create_error_response(404, "Empty list",
                                          "Cannot find any message with the"
                                          " provided restrictions")
+        messages_db = itertools.chain([first], messages_db)
         #FILTER AND GENERATE RESPONSE
         #Create the envelope
         envelope = {}
@@ -1552,54 +2347,34 @@ class History(Resource):
                                 'rel': "author",
                                 'prompt': "User's profile"}
                               ]
-        collection['queries'] = [
-            {'href': api.url_for(History, nickname=nickname),
-             'rel': 'search',
-             'prompt': "Search in the user history",
-             'data': [
-                    {"prompt": "Return the messages published after this timestamp",
-                     "name": "after",
-                     "value": "",
-                     "required": False},
-                    {"prompt": "Return the messages published before this timestamp",
-                     "name": "before",
-                     "value": "",
-                     "required": False},
-                    {"prompt": "Limit the number of messages returned",
-                     "name": "length",
-                     "value": "",
-                     "required": False}
-             ]
-            }
-        ]
+        collection['queries'] = HISTORY_QUERIES.fill(href=collection['href'])
         #Create the items
-        items = []
-        for message in messages_db:
-            _messageid = message['messageid']
-            _headline = message['title']
-            _url = api.url_for(Message, messageid=_messageid)
-            message = {}
-            message['href'] = _url
-            message['data'] = []
-            value = {'name': 'headline', 'value': _headline}
-            message['data'].append(value)
-            message['links'] = []
-            items.append(message)
-        collection['items'] = items
+        collection['items'] = Stream(_message_items(messages_db))
+        #The counters do not fit in a Collection+JSON document
+        counters = g.con.get_user_counters(nickname)
+        headers = {'X-Message-Count': str(counters['messagecount']),
+                   'X-Last-Activity': str(counters['lastactivity'])}
 
         #RENDER
-        return Response(json.dumps(envelope), 200,
-                        mimetype=COLLECTIONJSON+";"+FORUM_MESSAGE_PROFILE)
+        return stream_response(envelope,
+                               COLLECTIONJSON+";"+FORUM_MESSAGE_PROFILE,
+                               headers)
 
 #Add the Regex Converter so we can use regex expressions when we define the
 #routes
 app.url_map.converters['regex'] = RegexConverter
+app.url_map.converters['messageid'] = MessageIdConverter
 
 
 #Define the routes
 api.add_resource(Messages, '/forum/api/messages/',
                  endpoint='messages')
-api.add_resource(Message, '/forum/api/messages/<regex("msg-\d+"):messageid>/',
+api.add_resource(Thread,
+                 '/forum/api/messages/<messageid:messageid>/thread/',
+                 endpoint='thread')
+api.add_resource(MessagesBatch, '/forum/api/messages/batch/',
+                 endpoint='messages_batch')
+api.add_resource(Message, '/forum/api/messages/<messageid:messageid>/',
                  endpoint='message')
 api.add_resource(User_public, '/forum/api/users/<nickname>/public_profile/',
                  endpoint='public_profile')
@@ -1611,6 +2386,21 @@ api.add_resource(User, '/forum/api/users/<nickname>/',
                  endpoint='user')
 api.add_resource(History, '/forum/api/users/<nickname>/history/',
                  endpoint='history')
+#URL templates of the endpoints, built once from the rules. Check build_url
+URL_TEMPLATES = dict((rule.endpoint, URLTemplate(rule.rule))
+                     for rule in app.url_map.iter_rules())
+
+
+#Monitoring
+@app.route('/forum/stats/')
+def stats():
+    '''Returns the internal counters of the application in JSON.'''
+    engine = app.config['Engine']
+    body = dumps({'pool': engine.pool_stats(),
+                  'read_pool': engine.pool_stats(read_only=True),
+                  'message_cache': app.config['MessageCache'].stats(),
+                  'user_cache': app.config['UserCache'].stats()})
+    return Response(body, 200, mimetype='application/json')
 
 
 #Redirect profile
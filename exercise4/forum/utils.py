@@ -1,4 +1,9 @@
-from werkzeug.routing import BaseConverter
+import base64, json
+
+from werkzeug.routing import BaseConverter, ValidationError, parse_rule
+from werkzeug.urls import url_quote
+
+from database import MESSAGE_ID_PATTERN, parse_message_id
 
 class RegexConverter(BaseConverter):
     '''
@@ -6,4 +11,89 @@ class RegexConverter(BaseConverter):
     '''
     def __init__(self, url_map, *items):
         super(RegexConverter, self).__init__(url_map)
-        self.regex = items[0]
\ No newline at end of file
+        self.regex = items[0]
+
+
+class MessageIdConverter(BaseConverter):
+    '''
+    Matches the message ids, ``msg-\d+``, that fit in the 64-bit message_id
+    of the database. The value is kept as a string.
+    '''
+    regex = MESSAGE_ID_PATTERN
+
+    def to_python(self, value):
+        try:
+            parse_message_id(value)
+        except ValueError:
+            raise ValidationError()
+        return value
+
+
+class URLTemplate(object):
+    '''
+    Path of a URL rule with its variables replaced by string formatting.
+    Building a URL from the template does not walk the URL map.
+
+    :Example:
+
+    >>> template = URLTemplate('/forum/api/users/<nickname>/history/')
+    >>> template.expand(nickname='AxelW')
+    '/forum/api/users/AxelW/history/'
+
+    The variables are quoted like the werkzeug converters do. The converters
+    are not called, so do not use it for rules whose converters change the
+    value (e.g. int with fixed digits).
+
+    :param str rule: The rule, as given to :py:class:`werkzeug.routing.Rule`.
+    '''
+    def __init__(self, rule):
+        super(URLTemplate, self).__init__()
+        parts = []
+        self.names = []
+        for converter, _, variable in parse_rule(rule):
+            if converter is None:
+                parts.append(variable.replace('%', '%%'))
+            else:
+                parts.append('%%(%s)s' % variable)
+                self.names.append(variable)
+        self._template = ''.join(parts)
+
+    def expand(self, **values):
+        '''
+        :return: the path with the variables replaced by ``values``.
+        :raises KeyError: if a variable of the rule is not in ``values``.
+        '''
+        return self._template % dict(
+            (name, url_quote(values[name], safe='/:')) for name in self.names)
+
+
+def encode_cursor(direction, key):
+    '''
+    Creates the opaque cursor used in the pagination links.
+
+    :param str direction: 'next' or 'prev'
+    :param tuple key: key of the database row where the page starts.
+    :return: URL-safe string
+    '''
+    return base64.urlsafe_b64encode(json.dumps([direction] + list(key)))
+
+
+def decode_cursor(cursor):
+    '''
+    Reverse of :py:func:`encode_cursor`.
+
+    :return: a tuple (direction, key)
+    :raises ValueError: if the cursor is malformed
+    '''
+    try:
+        value = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise ValueError("The cursor is malformed")
+    if not isinstance(value, list) or len(value) < 2 or \
+       value[0] not in ('next', 'prev'):
+        raise ValueError("The cursor is malformed")
+    for item in value[1:]:
+        if isinstance(item, bool) or \
+           not isinstance(item, (int, long, float, basestring)):
+            raise ValueError("The cursor is malformed")
+    return value[0], tuple(value[1:])
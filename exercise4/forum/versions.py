@@ -0,0 +1,100 @@
+'''
+Created on 18.10.2026
+
+Counters of the changes committed to each table, used by the database
+Engine and by the resources to build HTTP validators.
+
+This module does not import the application, so the master process of
+:py:class:`forum.prefork.PreforkServer` can create the shared counters
+without importing :py:mod:`forum.database`: the workers forked on a reload
+import the current code of the application. This module itself is not
+reloaded, so restart the server after changing it, e.g. ``TABLES``.
+'''
+
+import multiprocessing, random, threading, time
+
+#Tables whose changes are counted by TableVersions
+TABLES = ('messages', 'users', 'users_profile', 'friends')
+
+
+class TableVersions(object):
+    '''
+    Counts the changes committed to each table of ``TABLES`` in this process.
+
+    Resources use the counters as validators: a representation built from
+    some tables is unchanged while none of their counters changes. The
+    counters start at 0 in every process, so they are combined with a random
+    ``epoch`` to tell apart the validators of different processes.
+
+    An instance of this class should not be instantiated directly. Use
+    :py:attr:`forum.database.Engine.versions`.
+
+    '''
+    def __init__(self):
+        super(TableVersions, self).__init__()
+        self.epoch = '%08x' % random.getrandbits(32)
+        self._versions = dict.fromkeys(TABLES, 0)
+        #Time of the last change of each table. Nothing is known about the
+        #changes made before the process started.
+        self._modified = dict.fromkeys(TABLES, time.time())
+        self._lock = threading.Lock()
+
+    def bump(self, *tables):
+        '''
+        Records a change committed to ``tables``.
+        '''
+        now = time.time()
+        with self._lock:
+            for table in tables:
+                self._versions[table] += 1
+                self._modified[table] = now
+
+    def validators(self, *tables):
+        '''
+        :return: the tuple (etag, last_modified) of a representation built
+            from ``tables``. ``etag`` is a string and ``last_modified`` the
+            UNIX time of the last change of any of the tables.
+        '''
+        with self._lock:
+            etag = '-'.join([self.epoch] +
+                            [str(self._versions[table]) for table in tables])
+            last_modified = max(self._modified[table] for table in tables)
+        return etag, last_modified
+
+
+class _SharedTableValues(object):
+    '''
+    Values of the tables of ``TABLES``, accessed by table name, kept in a
+    shared memory array.
+
+    :param str typecode: The :py:mod:`array` type code of the values.
+    :param dict values: The initial value of each table.
+    '''
+    def __init__(self, typecode, values):
+        self._index = dict((table, i) for i, table in enumerate(TABLES))
+        self._array = multiprocessing.RawArray(
+            typecode, [values[table] for table in TABLES])
+
+    def __getitem__(self, table):
+        return self._array[self._index[table]]
+
+    def __setitem__(self, table, value):
+        self._array[self._index[table]] = value
+
+
+class SharedTableVersions(TableVersions):
+    '''
+    Same as :py:class:`TableVersions`, but the counters are kept in shared
+    memory, so they count the changes committed by this process and by all
+    the processes forked after the instance is created, e.g. the workers of
+    :py:class:`forum.prefork.PreforkServer`.
+
+    Create it in the parent process and assign it to the
+    :py:attr:`forum.database.Engine.versions` of the Engine of every child.
+
+    '''
+    def __init__(self):
+        super(SharedTableVersions, self).__init__()
+        self._versions = _SharedTableValues('L', self._versions)
+        self._modified = _SharedTableValues('d', self._modified)
+        self._lock = multiprocessing.Lock()
@@ -80,29 +80,37 @@ ENTRYPOINT = "/forum/api/users/"; //Entrypoint: Resource Users
 /**
  * This function is the entrypoint to the Forum API.
  *
- * Associated rel attribute: Users Collection+JSON and users-all
+ * Associated rel attribute: Users Collection+JSON, users-all and next
  * 
- * Sends an AJAX GET request to retrive the list of all the users of the application
+ * Sends an AJAX GET request to retrive a page of the list of the users of the application
  * 
  * ONSUCCESS=> Show users in the #user_list. 
  *             After processing the response it utilizes the method {@link #appendUserToList}
  *             to append the user to the list.  
  *             Each user is an anchor pointing to the respective user url.
+ *             If there are more users, {@link #appendNextUsersToList} appends an anchor
+ *             that loads the next page.
  * ONERROR => Show an alert to the user.
  *
  * @param {string} [apiurl = ENTRYPOINT] - The url of the Users instance.
+ * @param {boolean} [nextPage = false] - If true, the users are appended to the users
+ * already in the list.
 **/
-function getUsers(apiurl) {
+function getUsers(apiurl, nextPage) {
     apiurl = apiurl || ENTRYPOINT;
-    $("#mainContent").hide();
+    if (!nextPage) {
+        $("#mainContent").hide();
+    }
     return $.ajax({
         url: apiurl,
         dataType:DEFAULT_DATATYPE
     }).always(function(){
         //Remove old list of users
         //clear the form data hide the content information(no selected)
-        $("#user_list").empty();
-        $("#mainContent").hide();
+        if (!nextPage) {
+            $("#user_list").empty();
+            $("#mainContent").hide();
+        }
 
     }).done(function (data, textStatus, jqXHR){
         if (DEBUG) {
@@ -126,6 +134,8 @@ function getUsers(apiurl) {
                 }
             }
         }
+        //Link to the next page of users
+        appendNextUsersToList(data.collection.links);
 
         //Prepare the new_user_form to create a new user
         createFormFromTemplate(data.collection.href,data.collection.template,
@@ -726,6 +736,24 @@ function appendUserToList(url, nickname) {
     return $user;
 }
 
+/**
+ * Appends to the #user_list an anchor pointing to the next page of users, if there is
+ * a next link in the <i>links</i> of the Users collection.
+ *
+ * @param {Array} links - The links of the Users collection.
+ * @returns {Object} The jQuery representation of the generated <li> element or undefined
+ * if there are no more users.
+**/
+function appendNextUsersToList(links) {
+    for (var i=0; i < links.length; i++){
+        if (links[i].rel == "next"){
+            var $next = $('<li>').html('<a class="next_users" href="'+links[i].href+'">More users...</a>');
+            $("#user_list").append($next);
+            return $next;
+        }
+    }
+}
+
 /**
  * Populate a form with the <input> elements contained in the <i>template</i> input parameter.
  * The action attribute is filled in with the <i>url</i> parameter. Values are filled
@@ -1132,7 +1160,7 @@ function handleCreateUser(event){
  * this function modifies the selected user in the #user_list (removes the .selected
  * class from the old user and add it to the current user)
  *
- * TRIGGER: click on #user_list li a 
+ * TRIGGER: click on #user_list li a.user_link
 **/
 function handleGetUser(event) {
     if (DEBUG) {
@@ -1148,6 +1176,22 @@ function handleGetUser(event) {
 }
 
 
+/**
+ * Uses the API to append the next page of users to the #user_list
+ *
+ * TRIGGER: click on #user_list li a.next_users
+**/
+function handleGetNextUsers(event) {
+    if (DEBUG) {
+        console.log ("Triggered handleGetNextUsers");
+    }
+    event.preventDefault();
+    var url = $(this).attr("href");
+    $(this).parent().remove();
+    getUsers(url, true);
+    return false;
+}
+
 /**
  * Uses the API to delete the associated message
  *
@@ -1174,7 +1218,8 @@ $(function(){
     $("#deleteUserRestricted").on("click", handleDeleteUserRestricted);
     $("#editUserRestricted").on("click", handleEditUserRestricted);
     $("#createUser").on("click", handleCreateUser);
-    $("#user_list").on("click","li a",handleGetUser);
+    $("#user_list").on("click","li a.user_link",handleGetUser);
+    $("#user_list").on("click","li a.next_users",handleGetNextUsers);
     $("#messages_list").on("click", ".deleteMessage", handleDeleteMessage);
     alert("YES YES")
 
@@ -0,0 +1,93 @@
+'''
+Testing of the in-process caches used by the resources.
+'''
+
+import unittest
+
+from forum.cache import LRUCache
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    '''
+    Test cases for the LRU cache with time to live.
+    '''
+    @classmethod
+    def setUpClass(cls):
+        print "Testing ", cls.__name__
+
+    def test_get_set(self):
+        '''
+        Check that a cached value is returned and the counters are updated
+        '''
+        print '('+self.test_get_set.__name__+')', self.test_get_set.__doc__
+        cache = LRUCache()
+        self.assertIsNone(cache.get('msg-1'))
+        cache.set('msg-1', 'message 1')
+        self.assertEquals(cache.get('msg-1'), 'message 1')
+        stats = cache.stats()
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['misses'], 1)
+        self.assertEquals(stats['entries'], 1)
+        self.assertEquals(stats['bytes'], len('message 1'))
+        #Values that are not strings with their size
+        cache.set('AxelW', {'nickname': 'AxelW'}, 30)
+        self.assertEquals(cache.get('AxelW'), {'nickname': 'AxelW'})
+        self.assertEquals(cache.stats()['bytes'], len('message 1') + 30)
+
+    def test_least_recently_used_evicted(self):
+        '''
+        Check that the least recently used values are evicted when the memory
+        cap is exceeded
+        '''
+        print '('+self.test_least_recently_used_evicted.__name__+')', \
+              self.test_least_recently_used_evicted.__doc__
+        cache = LRUCache(max_bytes=20)
+        cache.set('msg-1', 'a' * 8)
+        cache.set('msg-2', 'b' * 8)
+        cache.get('msg-1')
+        cache.set('msg-3', 'c' * 8)
+        self.assertIsNone(cache.get('msg-2'))
+        self.assertEquals(cache.get('msg-1'), 'a' * 8)
+        self.assertEquals(cache.get('msg-3'), 'c' * 8)
+        self.assertEquals(cache.stats()['evictions'], 1)
+        self.assertEquals(cache.stats()['bytes'], 16)
+        #Values bigger than the cap are never cached
+        cache.set('msg-4', 'd' * 21)
+        self.assertIsNone(cache.get('msg-4'))
+        self.assertEquals(cache.stats()['entries'], 2)
+
+    def test_expired_value(self):
+        '''
+        Check that a value is not returned after its time to live
+        '''
+        print '('+self.test_expired_value.__name__+')', \
+              self.test_expired_value.__doc__
+        cache = LRUCache(ttl=-1)
+        cache.set('msg-1', 'message 1')
+        self.assertIsNone(cache.get('msg-1'))
+        stats = cache.stats()
+        self.assertEquals(stats['expirations'], 1)
+        self.assertEquals(stats['entries'], 0)
+        self.assertEquals(stats['bytes'], 0)
+
+    def test_invalidate(self):
+        '''
+        Check that invalidated values are removed from the cache
+        '''
+        print '('+self.test_invalidate.__name__+')', \
+              self.test_invalidate.__doc__
+        cache = LRUCache()
+        cache.set('msg-1', 'message 1')
+        cache.set('msg-2', 'message 2')
+        cache.invalidate('msg-1')
+        self.assertIsNone(cache.get('msg-1'))
+        self.assertEquals(cache.get('msg-2'), 'message 2')
+        cache.clear()
+        self.assertIsNone(cache.get('msg-2'))
+        stats = cache.stats()
+        self.assertEquals(stats['invalidations'], 2)
+        self.assertEquals(stats['bytes'], 0)
+
+if __name__ == '__main__':
+    print 'Start running tests'
+    unittest.main()
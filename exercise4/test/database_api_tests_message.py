@@ -21,7 +21,7 @@ A messages' list has the following format:
 @author: ivan
 '''
 
-import sqlite3, unittest
+import json, os, shutil, sqlite3, tempfile, unittest
 
 from forum import database
 
@@ -234,6 +234,200 @@ class MessageDBAPITestCase(unittest.TestCase):
         messages = self.connection.get_messages(number_of_messages=1)
         self.assertEquals(len(messages), 1)
 
+    def test_get_messages_seek(self):
+        '''
+        Check that keyset pagination in get_messages returns consecutive pages
+        '''
+        print '('+self.test_get_messages_seek.__name__+')',\
+              self.test_get_messages_seek.__doc__
+        messages = self.connection.get_messages()
+        def key(message):
+            return message['timestamp'], int(message['messageid'][4:])
+        #Page through the messages, 6 by 6
+        pages = []
+        seek = None
+        while True:
+            page = self.connection.get_messages(number_of_messages=6,
+                                                seek=seek)
+            if not page:
+                break
+            pages.append(page)
+            seek = key(page[-1])
+        self.assertEquals(len(pages), 4)
+        self.assertEquals(sum(pages, []), messages)
+        #Going backwards from the second page returns the first page
+        page = self.connection.get_messages(number_of_messages=6,
+                                            seek=key(pages[1][0]),
+                                            backwards=True)
+        self.assertEquals(page, pages[0])
+
+    def test_get_messages_query_plan(self):
+        '''
+        Check with EXPLAIN QUERY PLAN that the get_messages queries used by
+        History and Messages use the indexes instead of scanning and sorting
+        the whole table
+        '''
+        print '('+self.test_get_messages_query_plan.__name__+')',\
+              self.test_get_messages_query_plan.__doc__
+        def plan(**kwargs):
+            query, pvalue = self.connection._messages_query(**kwargs)
+            cur = self.connection.con.execute('EXPLAIN QUERY PLAN ' + query,
+                                              pvalue)
+            return [row[3] for row in cur.fetchall()]
+        #History of a user, read only from the index
+        for kwargs in ({'nickname': 'Mystery'},
+                       {'nickname': 'Mystery', 'number_of_messages': 2},
+                       {'nickname': 'Mystery', 'before': 1362017481},
+                       {'nickname': 'Mystery', 'after': 1362017481},
+                       {'nickname': 'Mystery', 'before': 1362517481,
+                        'after': 1362017481, 'number_of_messages': 2}):
+            for detail in plan(**kwargs):
+                self.assertTrue(detail.startswith('SEARCH messages USING '
+                                                  'COVERING INDEX'), detail)
+                self.assertNotIn('TEMP B-TREE', detail)
+        #List of messages, ordered through the list index
+        for kwargs in ({'number_of_messages': 10},
+                       {'number_of_messages': 10,
+                        'seek': (1362017481, 10)},
+                       {'number_of_messages': 10,
+                        'seek': (1362017481, 10), 'backwards': True}):
+            for detail in plan(**kwargs):
+                self.assertIn('USING COVERING INDEX messages_list_idx',
+                              detail)
+                self.assertNotIn('TEMP B-TREE', detail)
+
+    def test_get_messages_parameterised(self):
+        '''
+        Check that get_messages passes the values as parameters: different
+        values reuse the same statement and quotes are not interpreted
+        '''
+        print '('+self.test_get_messages_parameterised.__name__+')',\
+              self.test_get_messages_parameterised.__doc__
+        queries = set()
+        for nickname in ('Mystery', 'AxelW', "O'Brien"):
+            for length in (1, 5):
+                for before in (1362017481, 1362517481):
+                    query, _ = self.connection._messages_query(
+                        nickname=nickname, number_of_messages=length,
+                        before=before)
+                    queries.add(query)
+        self.assertEquals(len(queries), 1)
+        messages = self.connection.get_messages(nickname="x' OR '1'='1")
+        self.assertEquals(messages, [])
+
+    def test_get_thread(self):
+        '''
+        Test that a thread is read in depth-first order, by depth and by pages
+        '''
+        print '('+self.test_get_thread.__name__+')', \
+              self.test_get_thread.__doc__
+        thread = self.connection.get_thread(MESSAGE1_ID)
+        self.assertEquals([message['messageid'] for message in thread],
+                          ['msg-%d' % i for i in (1, 3, 13, 14, 5, 7, 15, 10,
+                                                  11, 17, 19, 20)])
+        self.assertEquals([message['depth'] for message in thread[:7]],
+                          [0, 1, 2, 2, 1, 2, 3])
+        self.assertIsNone(thread[0]['replyto'])
+        self.assertEquals(thread[6]['replyto'], 'msg-7')
+        self.assertEquals(thread[0]['sender'], 'AxelW')
+        #Only the direct replies
+        thread = self.connection.get_thread(MESSAGE1_ID, max_depth=1)
+        self.assertEquals([message['messageid'] for message in thread],
+                          ['msg-%d' % i for i in (1, 3, 5, 10, 11, 17, 19,
+                                                  20)])
+        #By pages
+        pages = []
+        seek = None
+        while True:
+            page = self.connection.get_thread(MESSAGE1_ID,
+                                              number_of_messages=5,
+                                              seek=seek)
+            if not page:
+                break
+            pages.append([message['messageid'] for message in page])
+            seek = page[-1]['path']
+        self.assertEquals([len(page) for page in pages], [5, 5, 2])
+        self.assertEquals(sum(pages, []), [message['messageid'] for message
+                                           in self.connection.get_thread(
+                                               MESSAGE1_ID)])
+        self.assertIsNone(self.connection.get_thread(WRONG_MESSAGE_ID))
+        with self.assertRaises(ValueError):
+            self.connection.get_thread('1')
+
+    def test_search_messages(self):
+        '''
+        Test the full-text search and that the index follows the changes
+        '''
+        print '('+self.test_search_messages.__name__+')', \
+              self.test_search_messages.__doc__
+        messages = self.connection.search_messages('IE')
+        messageids = [message['messageid'] for message in messages]
+        self.assertEquals(sorted(messageids),
+                          ['msg-1', 'msg-16', 'msg-6', 'msg-8'])
+        ranks = [message['rank'] for message in messages]
+        self.assertEquals(ranks, sorted(ranks))
+        #By pages
+        page = self.connection.search_messages('IE', 2)
+        self.assertEquals(len(page), 2)
+        seek = (page[-1]['rank'], int(page[-1]['messageid'][len('msg-'):]))
+        page += self.connection.search_messages('IE', 2, seek)
+        self.assertEquals([message['messageid'] for message in page],
+                          messageids)
+        #The operators of FTS5 are plain words
+        self.assertEquals(self.connection.search_messages('IE OR "('), [])
+        self.assertRaises(ValueError, self.connection.search_messages, ' ')
+        #Created, modified and deleted messages
+        messageid = self.connection.create_message('Hyperlinks',
+                                                   'Anchors everywhere')
+        self.assertEquals([message['messageid'] for message in
+                           self.connection.search_messages('anchors')],
+                          [messageid])
+        self.connection.modify_message(messageid, 'Links', 'Everywhere',
+                                       'AxelW')
+        self.assertEquals(self.connection.search_messages('anchors'), [])
+        self.assertEquals(len(self.connection.search_messages('links')), 1)
+        #Deleting a message deletes its replies too
+        self.connection.delete_message(MESSAGE1_ID)
+        self.assertNotIn(MESSAGE2_ID, [message['messageid'] for message in
+                                       self.connection.search_messages(
+                                           'WinZip')])
+
+    def test_get_message_counters(self):
+        '''
+        Test that the counters of the replies follow the writes of messages
+        '''
+        print '('+self.test_get_message_counters.__name__+')', \
+              self.test_get_message_counters.__doc__
+        self.assertEquals(self.connection.get_message_counters(MESSAGE1_ID),
+                          {'replycount': 7, 'lastreply': 1362517481})
+        self.assertEquals(self.connection.get_message_counters('msg-2'),
+                          {'replycount': 0, 'lastreply': None})
+        self.assertIsNone(
+            self.connection.get_message_counters(WRONG_MESSAGE_ID))
+        with self.assertRaises(ValueError):
+            self.connection.get_message_counters('1')
+        #A new reply
+        messageid = self.connection.create_message('new title', 'new body',
+                                                   'Mystery', replyto='msg-2')
+        counters = self.connection.get_message_counters('msg-2')
+        self.assertEquals(counters['replycount'], 1)
+        self.assertEquals(counters['lastreply'], self.connection.get_message(
+            messageid)['timestamp'])
+        self.assertEquals(self.connection.get_user_counters('Mystery'),
+                          {'messagecount': 3,
+                           'lastactivity': counters['lastreply']})
+        #msg-3 is deleted with its replies msg-13 and msg-14 of Mystery
+        self.assertTrue(self.connection.delete_message('msg-3'))
+        self.assertEquals(
+            self.connection.get_message_counters(MESSAGE1_ID)['replycount'], 6)
+        self.assertEquals(
+            self.connection.get_user_counters('Mystery')['messagecount'], 1)
+        self.assertTrue(self.connection.delete_message(messageid))
+        self.assertEquals(self.connection.get_message_counters('msg-2'),
+                          {'replycount': 0, 'lastreply': None})
+        self.assertEquals(self.connection.get_user_counters('Mystery'),
+                          {'messagecount': 0, 'lastactivity': None})
+
     def test_delete_message(self):
         '''
         Test that the message msg-1 is deleted
@@ -246,6 +440,88 @@ class MessageDBAPITestCase(unittest.TestCase):
         resp2 = self.connection.get_message(MESSAGE1_ID)
         self.assertIsNone(resp2)
 
+    def test_changes_counted_in_versions(self):
+        '''
+        Test that the validators of the messages change only when a message
+        change is committed
+        '''
+        print '('+self.test_changes_counted_in_versions.__name__+')', \
+              self.test_changes_counted_in_versions.__doc__
+        etag, _ = ENGINE.versions.validators('messages')
+        users_etag, _ = ENGINE.versions.validators('users')
+        self.assertFalse(self.connection.delete_message('msg-200'))
+        self.assertEquals(ENGINE.versions.validators('messages')[0], etag)
+        self.assertTrue(self.connection.delete_message(MESSAGE1_ID))
+        self.assertNotEquals(ENGINE.versions.validators('messages')[0], etag)
+        self.assertEquals(ENGINE.versions.validators('users')[0], users_etag)
+
+    def test_bulk_load(self):
+        '''
+        Test that users and messages are loaded from CSV and JSON Lines files
+        '''
+        print '('+self.test_bulk_load.__name__+')', \
+              self.test_bulk_load.__doc__
+        folder = tempfile.mkdtemp()
+        try:
+            users = os.path.join(folder, 'users.csv')
+            with open(users, 'wb') as f:
+                f.write('user_id,nickname,regDate,lastLogin,timesviewed\n'
+                        '100,Bulk\xc3\xa4,1400000000,,0\n')
+            profiles = os.path.join(folder, 'profiles.jsonl')
+            with open(profiles, 'wb') as f:
+                f.write(json.dumps({'user_id': 100, 'firstname': 'Bulk'}))
+            messages = os.path.join(folder, 'messages.jsonl')
+            with open(messages, 'wb') as f:
+                #The reply comes before its parent
+                for message_id, reply_to in ((101, 100), (100, None)):
+                    f.write(json.dumps({
+                        'message_id': message_id, 'title': 'Bulk',
+                        'body': 'Loaded', 'timestamp': 1500000000,
+                        'reply_to': reply_to, 'user_nickname': u'Bulk\xe4',
+                        'user_id': 100}) + '\n')
+            report = ENGINE.bulk_load({'users': users,
+                                       'users_profile': profiles,
+                                       'messages': messages})
+        finally:
+            shutil.rmtree(folder)
+        self.assertEquals(report['tables'], {'users': 1, 'users_profile': 1,
+                                             'messages': 2})
+        self.assertEquals(report['rows'], 4)
+        self.assertGreater(report['rows_per_second'], 0)
+        message = self.connection.get_message('msg-101')
+        self.assertEquals(message['replyto'], 'msg-100')
+        self.assertEquals(message['sender'], u'Bulk\xe4')
+        self.assertEquals(len(self.connection.get_messages()),
+                          INITIAL_SIZE + 2)
+        #The indexes were built again
+        cur = self.connection.con.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")
+        names = set(row[0] for row in cur)
+        for name, _ in database.INDEXES:
+            self.assertIn(name, names)
+
+    def test_bulk_load_rolled_back(self):
+        '''
+        Test that nothing is loaded if a row breaks a constraint
+        '''
+        print '('+self.test_bulk_load_rolled_back.__name__+')', \
+              self.test_bulk_load_rolled_back.__doc__
+        folder = tempfile.mkdtemp()
+        try:
+            messages = os.path.join(folder, 'messages.csv')
+            with open(messages, 'wb') as f:
+                f.write('message_id,title,timestamp,reply_to\n'
+                        '100,Bulk,1500000000,\n'
+                        '101,Orphan,1500000000,500\n')
+            self.assertRaises(sqlite3.IntegrityError, ENGINE.bulk_load,
+                              {'messages': messages})
+            self.assertRaises(ValueError, ENGINE.bulk_load,
+                              {'sessions': messages})
+        finally:
+            shutil.rmtree(folder)
+        self.assertIsNone(self.connection.get_message('msg-100'))
+        self.assertEquals(len(self.connection.get_messages()), INITIAL_SIZE)
+
     def test_delete_message_malformedid(self):
         '''
         Test that trying to delete message wit id ='2' raises an error
@@ -363,6 +639,233 @@ class MessageDBAPITestCase(unittest.TestCase):
         resp2 = self.connection.get_message(messageid)
         self.assertDictContainsSubset(new_message, resp2)
 
+    def test_create_messages(self):
+        '''
+        Test that many messages are created in one transaction
+        '''
+        print '('+self.test_create_messages.__name__+')', \
+              self.test_create_messages.__doc__
+        messages = [{'title': 'new title', 'body': 'new body',
+                     'sender': 'AxelW'},
+                    {'title': 'reply', 'body': 'reply body',
+                     'replyto': MESSAGE1_ID}]
+        messageids = self.connection.create_messages(messages)
+        self.assertEquals(len(messageids), 2)
+        message = self.connection.get_message(messageids[0])
+        self.assertEquals(message['sender'], 'AxelW')
+        message = self.connection.get_message(messageids[1])
+        self.assertEquals(message['sender'], 'Anonymous')
+        self.assertEquals(message['replyto'], MESSAGE1_ID)
+        #Nothing is created if a parent does not exist
+        messages.append({'title': 'reply', 'body': 'reply body',
+                         'replyto': WRONG_MESSAGE_ID})
+        self.assertIsNone(self.connection.create_messages(messages))
+        self.assertEquals(len(self.connection.get_messages()),
+                          INITIAL_SIZE + 2)
+        with self.assertRaises(ValueError):
+            self.connection.create_messages([{'title': 'reply',
+                                              'body': 'reply body',
+                                              'replyto': '1'}])
+
+    def test_large_message_ids(self):
+        '''
+        Test the methods with the ids of a database with millions of
+        messages and with the largest 64-bit message_id
+        '''
+        print '('+self.test_large_message_ids.__name__+')', \
+              self.test_large_message_ids.__doc__
+        largest = 'msg-%d' % database.MAX_MESSAGE_ID
+        con = self.connection.con
+        with con:
+            con.execute('INSERT INTO messages (message_id, title, body, \
+                         timestamp, ip, timesviewed, reply_to, \
+                         user_nickname) VALUES (?, ?, ?, ?, ?, 0, NULL, ?)',
+                        (3000000, 'Millions', 'body', 1400000000, '0.0.0.0',
+                         'AxelW'))
+        #The next id follows the largest one
+        messageid = self.connection.create_message('title', 'body', 'AxelW')
+        self.assertEquals(messageid, 'msg-3000001')
+        replyid = self.connection.append_answer('msg-3000000', 'reply',
+                                                'body', 'Koodari')
+        self.assertEquals(replyid, 'msg-3000002')
+        message = self.connection.get_message('msg-3000002')
+        self.assertEquals(message['messageid'], 'msg-3000002')
+        self.assertEquals(message['replyto'], 'msg-3000000')
+        #msg-300 is not truncated to msg-3 or msg-300
+        self.assertIsNone(self.connection.get_message('msg-300'))
+        self.assertEquals(self.connection.get_message('msg-0003000000')
+                          ['title'], 'Millions')
+        thread = self.connection.get_thread('msg-3000000')
+        self.assertEquals([m['messageid'] for m in thread],
+                          ['msg-3000000', 'msg-3000002'])
+        self.assertEquals(
+            self.connection.get_message_counters('msg-3000000')['replycount'],
+            1)
+        with con:
+            con.execute('UPDATE messages SET message_id = ? \
+                         WHERE message_id = 3000001',
+                        (database.MAX_MESSAGE_ID,))
+        self.assertEquals(self.connection.get_message(largest)['messageid'],
+                          largest)
+        self.assertEquals(self.connection.modify_message(largest, 'new',
+                                                         'new body'),
+                          largest)
+        self.assertTrue(self.connection.delete_message(largest))
+        self.assertIsNone(self.connection.get_message(largest))
+
+    def test_parse_message_id(self):
+        '''
+        Test that the message ids out of the 64-bit range or with trailing
+        characters are malformed
+        '''
+        print '('+self.test_parse_message_id.__name__+')', \
+              self.test_parse_message_id.__doc__
+        self.assertEquals(database.parse_message_id('msg-12345'), 12345)
+        self.assertEquals(database.parse_message_id('msg-007'), 7)
+        for messageid in ('msg-%d' % (database.MAX_MESSAGE_ID + 1),
+                          'msg-' + '1' * 20, 'msg-', 'msg-12a', 'msg--1',
+                          ' msg-1', 'msg-1/', 12345, None):
+            with self.assertRaises(ValueError):
+                database.parse_message_id(messageid)
+        with self.assertRaises(ValueError):
+            self.connection.get_message('msg-12345x')
+
+    def _create_partitions(self):
+        '''
+        Gives every message its own second and moves msg-1 to msg-7 to the
+        partition p1 and msg-8 to msg-14 to the partition p2
+        '''
+        con = self.connection.con
+        with con:
+            con.execute('UPDATE messages SET timestamp = 1362000000 + \
+                         message_id')
+        self.assertEquals(ENGINE.create_partition('p1', 1362000000,
+                                                  1362000008), 7)
+        self.assertEquals(ENGINE.create_partition('p2', 1362000008,
+                                                  1362000015), 7)
+
+    def test_create_partition(self):
+        '''
+        Test that the messages of the range are moved to the file of the
+        partition and that wrong partitions are rejected
+        '''
+        print '('+self.test_create_partition.__name__+')', \
+              self.test_create_partition.__doc__
+        self._create_partitions()
+        partitions = ENGINE.partitions()
+        self.assertEquals([p['name'] for p in partitions], ['p1', 'p2'])
+        self.assertEquals(partitions[0]['path'], 'db/forum_test.p1.db')
+        self.assertEquals((partitions[1]['start'], partitions[1]['end']),
+                          (1362000008, 1362000015))
+        con = sqlite3.connect(partitions[0]['path'])
+        try:
+            rows = con.execute('SELECT message_id FROM messages \
+                                ORDER BY message_id').fetchall()
+        finally:
+            con.close()
+        self.assertEquals(rows, [(i,) for i in range(1, 8)])
+        cur = self.connection.con.execute('SELECT COUNT(*) FROM messages')
+        self.assertEquals(cur.fetchone()[0], 6)
+        #The replies in the main database and the counters are kept
+        self.assertEquals(self.connection.get_message('msg-19')['replyto'],
+                          'msg-1')
+        self.assertEquals(
+            self.connection.get_message_counters('msg-1')['replycount'], 7)
+        self.assertEquals(
+            self.connection.get_user_counters('AxelW')['messagecount'], 2)
+        #Archived messages are not searched
+        self.assertEquals(self.connection.search_messages('WinZip'), [])
+        for args in (('p3', 1362000010, 1362000020),
+                     ('p1', 1300000000, 1300000100),
+                     ('p 3', 1300000000, 1300000100),
+                     ('p3', 1300000100, 1300000000),
+                     ('p3', 1362000015, 1362000100)):
+            with self.assertRaises(ValueError):
+                ENGINE.create_partition(*args)
+        self.assertFalse(os.path.exists('db/forum_test.p3.db'))
+        self.assertEquals(len(ENGINE.partitions()), 2)
+        #The partitions are removed with the messages
+        ENGINE.clear()
+        self.assertEquals(ENGINE.partitions(), [])
+        self.assertFalse(os.path.exists(partitions[0]['path']))
+
+    def test_get_messages_partitions(self):
+        '''
+        Test that the messages of the partitions are merged in the lists and
+        that only the partitions overlapping the window are read
+        '''
+        print '('+self.test_get_messages_partitions.__name__+')', \
+              self.test_get_messages_partitions.__doc__
+        con = self.connection.con
+        with con:
+            con.execute('UPDATE messages SET timestamp = 1362000000 + \
+                         message_id')
+        windows = ({}, {'number_of_messages': 5},
+                   {'nickname': 'Mystery'}, {'nickname': 'HockeyFan'},
+                   {'before': 1362000010, 'after': 1362000005},
+                   {'after': 1362000012, 'number_of_messages': 4},
+                   {'number_of_messages': 6, 'seek': (1362000016, 16)},
+                   {'number_of_messages': 6, 'seek': (1362000009, 9),
+                    'backwards': True})
+        expected = [self.connection.get_messages(**kwargs)
+                    for kwargs in windows]
+        self._create_partitions()
+        connection = ENGINE.connect(read_only=True)
+        try:
+            for kwargs, messages in zip(windows, expected):
+                self.assertEquals(connection.get_messages(**kwargs), messages)
+            self.assertEquals(connection._partitions(),
+                              ('partition_p1', 'partition_p2'))
+            self.assertEquals(connection._partitions(after=1362000010),
+                              ('partition_p2',))
+            self.assertEquals(connection._partitions(before=1362000008),
+                              ('partition_p1',))
+            self.assertEquals(connection._partitions(after=1362000015), ())
+            self.assertEquals(connection._partitions(seek=(1362000005, 5)),
+                              ('partition_p1',))
+            #Merged from the indexes, without sorting
+            query, pvalue = connection._messages_query(number_of_messages=5)
+            cur = connection.con.execute('EXPLAIN QUERY PLAN ' + query,
+                                         pvalue)
+            details = [row[3] for row in cur.fetchall()]
+            self.assertIn('MERGE (UNION ALL)', details)
+            for detail in details:
+                self.assertNotIn('TEMP B-TREE', detail)
+        finally:
+            connection.close()
+
+    def test_get_message_partition(self):
+        '''
+        Test that a message moved to a partition is found by its id and that
+        it loses its sender when the sender is deleted
+        '''
+        print '('+self.test_get_message_partition.__name__+')', \
+              self.test_get_message_partition.__doc__
+        self._create_partitions()
+        message = self.connection.get_message('msg-13')
+        self.assertEquals(message['sender'], 'Mystery')
+        self.assertEquals(message['replyto'], 'msg-3')
+        self.assertEquals(message['timestamp'], 1362000013)
+        self.assertEquals(
+            self.connection.get_message_counters('msg-13')['replycount'], 0)
+        self.assertIsNone(self.connection.get_message(WRONG_MESSAGE_ID))
+        self.assertIsNone(self.connection.get_message_counters(
+            WRONG_MESSAGE_ID))
+        #Archived messages are read-only
+        self.assertTrue(self.connection.is_archived('msg-13'))
+        self.assertFalse(self.connection.is_archived('msg-20'))
+        self.assertFalse(self.connection.is_archived(WRONG_MESSAGE_ID))
+        self.assertFalse(self.connection.delete_message('msg-13'))
+        self.assertIsNone(self.connection.append_answer('msg-13', 'title',
+                                                        'body', 'AxelW'))
+        self.assertTrue(self.connection.delete_user('Mystery'))
+        self.assertIsNone(self.connection.get_message('msg-13')['sender'])
+        self.assertEquals(self.connection.get_messages(nickname='Mystery'),
+                          [])
+        #Messages without registered sender keep it
+        self.assertEquals(self.connection.get_message('msg-2')['sender'],
+                          'Jack')
+
     def test_append_answer_malformed_id(self):
         '''
         Test that trying to reply message wit id ='2' raises an error
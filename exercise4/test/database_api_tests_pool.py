@@ -0,0 +1,422 @@
+'''
+Database interface testing for the connection management of the Engine:
+connection pool and settings applied to new connections.
+'''
+
+import os, sqlite3, sys, threading, time, unittest
+
+from forum import database, versions
+
+#Path to the database file, different from the deployment db
+DB_PATH = 'db/forum_test.db'
+ENGINE = database.Engine(DB_PATH)
+
+
+class PoolDBAPITestCase(unittest.TestCase):
+    '''
+    Test cases for the pooled connections of the Engine.
+    '''
+    #INITIATION AND TEARDOWN METHODS
+    @classmethod
+    def setUpClass(cls):
+        ''' Creates the database structure. Removes first any preexisting
+            database file
+        '''
+        print "Testing ", cls.__name__
+        ENGINE.remove_database()
+        ENGINE.create_tables()
+
+    @classmethod
+    def tearDownClass(cls):
+        '''Remove the testing database'''
+        print "Testing ENDED for ", cls.__name__
+        ENGINE.remove_database()
+
+    def setUp(self):
+        '''
+        Populates the database
+        '''
+        ENGINE.populate_tables()
+        #Small pool so that it can be exhausted
+        self.engine = database.Engine(DB_PATH, pool_size=2, pool_timeout=0.1)
+
+    def tearDown(self):
+        '''
+        Close the pooled connections and remove all records from database
+        '''
+        self.engine.dispose()
+        ENGINE.clear()
+
+    def test_connection_reused(self):
+        '''
+        Check that a released connection is handed out again
+        '''
+        print '('+self.test_connection_reused.__name__+')', \
+              self.test_connection_reused.__doc__
+        connection = self.engine.acquire()
+        self.engine.release(connection)
+        self.assertIs(self.engine.acquire(), connection)
+        self.engine.release(connection)
+        stats = self.engine.pool_stats()
+        self.assertEquals(stats['created'], 1)
+        self.assertEquals(stats['idle'], 1)
+        self.assertEquals(stats['in_use'], 0)
+
+    def test_nested_checkout_same_thread(self):
+        '''
+        Check that a thread holding a connection gets the same one back
+        '''
+        print '('+self.test_nested_checkout_same_thread.__name__+')', \
+              self.test_nested_checkout_same_thread.__doc__
+        connection = self.engine.acquire()
+        self.assertIs(self.engine.acquire(), connection)
+        self.engine.release(connection)
+        self.assertEquals(self.engine.pool_stats()['in_use'], 1)
+        self.engine.release(connection)
+        self.assertEquals(self.engine.pool_stats()['in_use'], 0)
+
+    def test_pool_is_bounded(self):
+        '''
+        Check that acquire times out when every connection is in use
+        '''
+        print '('+self.test_pool_is_bounded.__name__+')', \
+              self.test_pool_is_bounded.__doc__
+        #Two other threads hold the two connections of the pool
+        held = []
+        threads = [threading.Thread(target=lambda: held.append(self.engine.acquire()))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(len(held), 2)
+        self.assertRaises(sqlite3.OperationalError, self.engine.acquire)
+        self.assertEquals(self.engine.pool_stats()['timeouts'], 1)
+        for connection in held:
+            self.engine.release(connection)
+
+    def test_released_changes_are_committed(self):
+        '''
+        Check that the changes made with a pooled connection are visible to
+        other connections once it is released
+        '''
+        print '('+self.test_released_changes_are_committed.__name__+')', \
+              self.test_released_changes_are_committed.__doc__
+        connection = self.engine.acquire()
+        connection.con.execute('DELETE FROM messages')
+        self.engine.release(connection)
+        other = self.engine.connect()
+        try:
+            self.assertEquals(other.get_messages(), [])
+        finally:
+            other.close()
+
+    def test_idle_connections_evicted(self):
+        '''
+        Check that idle connections are closed after the idle timeout
+        '''
+        print '('+self.test_idle_connections_evicted.__name__+')', \
+              self.test_idle_connections_evicted.__doc__
+        connection = self.engine.acquire()
+        self.engine.release(connection)
+        self.engine.pool.idle_timeout = -1
+        try:
+            self.assertIsNot(self.engine.acquire(), connection)
+        finally:
+            self.engine.pool.idle_timeout = database.DEFAULT_POOL_IDLE_TIMEOUT
+        self.engine.release(self.engine.acquire())
+        self.assertEquals(self.engine.pool_stats()['evicted'], 1)
+
+    def test_unhealthy_connection_discarded(self):
+        '''
+        Check that a broken idle connection is not handed out again
+        '''
+        print '('+self.test_unhealthy_connection_discarded.__name__+')', \
+              self.test_unhealthy_connection_discarded.__doc__
+        connection = self.engine.acquire()
+        self.engine.release(connection)
+        connection.con.close()
+        self.engine.pool.health_check_interval = -1
+        try:
+            new_connection = self.engine.acquire()
+        finally:
+            self.engine.pool.health_check_interval = \
+                database.DEFAULT_POOL_HEALTH_CHECK_INTERVAL
+        self.assertIsNot(new_connection, connection)
+        self.assertIsNotNone(new_connection.get_message('msg-1'))
+        self.engine.release(new_connection)
+
+    def test_read_only_connections(self):
+        '''
+        Check that read-only connections come from their own pool and cannot
+        modify the database
+        '''
+        print '('+self.test_read_only_connections.__name__+')', \
+              self.test_read_only_connections.__doc__
+        reader = self.engine.acquire(read_only=True)
+        writer = self.engine.acquire()
+        try:
+            self.assertTrue(reader.read_only)
+            self.assertFalse(writer.read_only)
+            self.assertIsNot(reader, writer)
+            self.assertEquals(self.engine.pool_stats(read_only=True)['in_use'],
+                              1)
+            self.assertEquals(self.engine.pool_stats()['in_use'], 1)
+            self.assertEquals(len(reader.get_messages()), 20)
+            self.assertRaises(sqlite3.OperationalError, reader.delete_message,
+                              'msg-1')
+        finally:
+            self.engine.release(reader)
+            self.engine.release(writer)
+        self.assertEquals(self.engine.pool_stats(read_only=True)['in_use'], 0)
+        self.assertEquals(self.engine.pool_stats()['in_use'], 0)
+        self.assertIs(self.engine.acquire(read_only=True), reader)
+        self.engine.release(reader)
+
+    def test_read_only_connection_wal(self):
+        '''
+        Check that a read-only connection of a WAL Engine opens a database
+        in rollback journal mode and sees the changes of the writer
+        '''
+        print '('+self.test_read_only_connection_wal.__name__+')', \
+              self.test_read_only_connection_wal.__doc__
+        engine = database.Engine(DB_PATH, wal=True, busy_timeout=0,
+                                 checkpoint_interval=None)
+        reader = engine.connect(read_only=True)
+        writer = engine.connect()
+        try:
+            writer.con.execute('DELETE FROM messages')
+            self.assertEquals(len(reader.get_messages()), 20)
+            writer.con.commit()
+            self.assertEquals(len(reader.get_messages()), 0)
+        finally:
+            reader.close()
+            writer.close()
+        self.assertEquals(engine.checkpoint()[0], 0)
+
+    def test_read_only_connection_without_uri(self):
+        '''
+        Check that read-only connections use the PRAGMA query_only when the
+        sqlite3 module does not open URI filenames
+        '''
+        print '('+self.test_read_only_connection_without_uri.__name__+')', \
+              self.test_read_only_connection_without_uri.__doc__
+        database._URI_FILENAMES = False
+        try:
+            reader = database.Connection(DB_PATH, read_only=True)
+        finally:
+            database._URI_FILENAMES = None
+        try:
+            self.assertEquals(
+                reader.con.execute('PRAGMA query_only').fetchone()[0], 1)
+            self.assertEquals(len(reader.get_messages()), 20)
+            self.assertRaises(sqlite3.OperationalError, reader.delete_message,
+                              'msg-1')
+        finally:
+            reader.close()
+        self.assertFalse([name for name in os.listdir('.') + os.listdir('db')
+                          if name.startswith('file:')])
+
+    def test_pragmas_applied_on_connect(self):
+        '''
+        Check that the configured PRAGMAs are set once the connection is
+        opened, without calling set_foreign_keys_support
+        '''
+        print '('+self.test_pragmas_applied_on_connect.__name__+')', \
+              self.test_pragmas_applied_on_connect.__doc__
+        engine = database.Engine(DB_PATH, pragmas=[('foreign_keys', 'ON'),
+                                                   ('cache_size', -4000)])
+        connection = engine.acquire()
+        try:
+            self.assertTrue(connection.check_foreign_keys_status())
+            cur = connection.con.execute('PRAGMA cache_size')
+            self.assertEquals(cur.fetchone()[0], -4000)
+        finally:
+            engine.release(connection)
+            engine.pool.dispose()
+
+    def test_unsupported_pragma(self):
+        '''
+        Check that unknown or malformed PRAGMAs are rejected
+        '''
+        print '('+self.test_unsupported_pragma.__name__+')', \
+              self.test_unsupported_pragma.__doc__
+        self.assertRaises(ValueError, database.Engine, DB_PATH,
+                          pragmas=[('user_version', 1)])
+        self.assertRaises(ValueError, database.Engine, DB_PATH,
+                          pragmas=[('synchronous', 'OFF; DROP TABLE users')])
+
+    def test_wal_readers_not_blocked(self):
+        '''
+        Check that in WAL mode a reader is not blocked by a writer holding an
+        open transaction
+        '''
+        print '('+self.test_wal_readers_not_blocked.__name__+')', \
+              self.test_wal_readers_not_blocked.__doc__
+        engine = database.Engine(DB_PATH, wal=True, busy_timeout=0,
+                                 checkpoint_interval=None)
+        writer = engine.connect()
+        reader = engine.connect()
+        try:
+            cur = writer.con.execute('PRAGMA journal_mode')
+            self.assertEquals(cur.fetchone()[0], 'wal')
+            writer.con.execute('DELETE FROM messages')
+            #The writer has not committed yet, the reader sees the old data
+            self.assertEquals(len(reader.get_messages()), 20)
+            writer.con.commit()
+            self.assertEquals(len(reader.get_messages()), 0)
+        finally:
+            reader.close()
+            writer.close()
+        self.assertEquals(engine.checkpoint()[0], 0)
+
+    def test_checkpointer_started_on_acquire(self):
+        '''
+        Check that the background checkpointer runs in WAL mode
+        '''
+        print '('+self.test_checkpointer_started_on_acquire.__name__+')', \
+              self.test_checkpointer_started_on_acquire.__doc__
+        engine = database.Engine(DB_PATH, wal=True, checkpoint_interval=0.01)
+        connection = engine.acquire()
+        try:
+            connection.create_message('title', 'body')
+        finally:
+            engine.release(connection)
+        checkpointer = engine._checkpointer
+        self.assertTrue(checkpointer.is_alive())
+        deadline = time.time() + 5
+        while checkpointer.checkpoints == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        engine.stop_checkpointer()
+        engine.pool.dispose()
+        self.assertFalse(checkpointer.is_alive())
+        self.assertGreater(checkpointer.checkpoints, 0)
+
+    def test_write_behind_group_commit(self):
+        '''
+        Check that the writes submitted together are committed in one
+        transaction and their results returned through the futures
+        '''
+        print '('+self.test_write_behind_group_commit.__name__+')', \
+              self.test_write_behind_group_commit.__doc__
+        engine = database.Engine(DB_PATH, write_behind=True,
+                                 write_latency=0.5)
+        before = engine.versions.validators('messages')
+        try:
+            futures = [engine.submit('create_message', 'title %d' % i,
+                                     'body', 'AxelW') for i in range(5)]
+            ids = [future.result(5) for future in futures]
+            self.assertEquals(ids, ['msg-%d' % i for i in range(21, 26)])
+            self.assertEquals(engine._writer.batches, 1)
+            self.assertEquals(engine._writer.writes, 5)
+        finally:
+            engine.stop_writer()
+        self.assertNotEquals(engine.versions.validators('messages'), before)
+        connection = engine.connect()
+        try:
+            self.assertEquals(connection.get_message('msg-25')['title'],
+                              'title 4')
+        finally:
+            connection.close()
+        self.assertRaises(ValueError, engine.submit, 'get_message', 'msg-1')
+        engine.stop_writer()
+
+    def test_write_behind_failed_write(self):
+        '''
+        Check that a failing write of a group does not undo the other writes
+        of its transaction
+        '''
+        print '('+self.test_write_behind_failed_write.__name__+')', \
+              self.test_write_behind_failed_write.__doc__
+        engine = database.Engine(DB_PATH, write_behind=True,
+                                 write_latency=0.5)
+        try:
+            deleted = engine.submit('delete_message', 'msg-1')
+            malformed = engine.submit('delete_message', 'msg-x')
+            created = engine.submit('create_message', 'title', 'body')
+            self.assertTrue(deleted.result(5))
+            self.assertRaises(ValueError, malformed.result, 5)
+            messageid = created.result(5)
+            self.assertEquals(engine._writer.batches, 1)
+            self.assertEquals(engine._writer.errors, 1)
+        finally:
+            engine.stop_writer()
+        connection = engine.connect()
+        try:
+            self.assertIsNone(connection.get_message('msg-1'))
+            self.assertIsNotNone(connection.get_message(messageid))
+        finally:
+            connection.close()
+
+    def test_write_behind_connect_failure(self):
+        '''
+        Check that the writes fail instead of waiting forever when the
+        writer thread cannot connect to the database
+        '''
+        print '('+self.test_write_behind_connect_failure.__name__+')', \
+              self.test_write_behind_connect_failure.__doc__
+        def connect():
+            raise sqlite3.OperationalError("unable to open database")
+        writer = database.WriteBehindQueue(connect)
+        future = writer.submit('delete_message', 'msg-1')
+        writer.start()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        self.assertRaises(sqlite3.OperationalError, future.result, 5)
+        self.assertRaises(sqlite3.OperationalError, writer.submit,
+                          'delete_message', 'msg-2')
+        self.assertEquals(writer.errors, 1)
+
+    def test_shared_versions_across_processes(self):
+        '''
+        Check that the changes committed by a forked process are seen by the
+        SharedTableVersions of the parent
+        '''
+        print '('+self.test_shared_versions_across_processes.__name__+')', \
+              self.test_shared_versions_across_processes.__doc__
+        self.engine.versions = database.SharedTableVersions()
+        before = self.engine.versions.validators('messages')
+        users = self.engine.versions.validators('users')
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                connection = self.engine.connect()
+                connection.create_message('title', 'body')
+                connection.close()
+                status = 0
+            finally:
+                os._exit(status)
+        self.assertEquals(os.waitpid(pid, 0)[1], 0)
+        after = self.engine.versions.validators('messages')
+        self.assertNotEquals(before, after)
+        self.assertEquals(self.engine.versions.validators('users'), users)
+
+    def test_shared_versions_without_application(self):
+        '''
+        Check that the master of the pre-forking server can create the
+        SharedTableVersions without importing the database module, so the
+        workers forked on a reload import its current code
+        '''
+        print '('+self.test_shared_versions_without_application.__name__+')', \
+              self.test_shared_versions_without_application.__doc__
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                for name in [name for name in sys.modules
+                             if name.startswith('forum.')]:
+                    del sys.modules[name]
+                from forum.prefork import PreforkServer
+                from forum.versions import SharedTableVersions
+                SharedTableVersions()
+                status = 0 if 'forum.database' not in sys.modules else 2
+            finally:
+                os._exit(status)
+        self.assertEquals(os.waitpid(pid, 0)[1], 0)
+        self.assertIs(database.SharedTableVersions,
+                      versions.SharedTableVersions)
+
+if __name__ == '__main__':
+    print 'Start running tests'
+    unittest.main()
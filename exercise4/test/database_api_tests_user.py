@@ -225,6 +225,23 @@ class UserDBAPITestCase(unittest.TestCase):
         user = self.connection.get_user(USER_WRONG_NICKNAME)
         self.assertIsNone(user)
 
+    def test_get_user_counters(self):
+        '''
+        Test that the counters of the messages of Mystery are kept when the
+        user is deleted
+        '''
+        print '('+self.test_get_user_counters.__name__+')', \
+              self.test_get_user_counters.__doc__
+        self.assertEquals(self.connection.get_user_counters(USER1_NICKNAME),
+                          {'messagecount': 2, 'lastactivity': 1362017481})
+        self.assertEquals(
+            self.connection.get_user_counters(USER_WRONG_NICKNAME),
+            {'messagecount': 0, 'lastactivity': None})
+        #The messages of a deleted user are anonymous
+        self.assertTrue(self.connection.delete_user(USER1_NICKNAME))
+        self.assertEquals(self.connection.get_user_counters(USER1_NICKNAME),
+                          {'messagecount': 0, 'lastactivity': None})
+
     def test_get_users(self):
         '''
         Test that get_users work correctly and extract required user info
@@ -242,6 +259,37 @@ class UserDBAPITestCase(unittest.TestCase):
             elif user['nickname'] == USER2_NICKNAME:
                 self.assertDictContainsSubset(user, USER2['public_profile'])
 
+    def test_get_users_pages(self):
+        '''
+        Test that get_users returns pages of users in both orders
+        '''
+        print '('+self.test_get_users_pages.__name__+')', \
+              self.test_get_users_pages.__doc__
+        nicknames = ['AxelW', 'HockeyFan', 'Koodari', 'LinuxPenguin',
+                     'Mystery']
+        users = self.connection.get_users()
+        self.assertEquals([user['nickname'] for user in users], nicknames)
+        users = self.connection.get_users(2, seek=('HockeyFan',))
+        self.assertEquals([user['nickname'] for user in users],
+                          ['Koodari', 'LinuxPenguin'])
+        users = self.connection.get_users(2, seek=('Koodari',),
+                                          backwards=True)
+        self.assertEquals([user['nickname'] for user in users],
+                          ['AxelW', 'HockeyFan'])
+        users = self.connection.get_users(order='registrationdate')
+        self.assertEquals([user['nickname'] for user in users],
+                          ['AxelW', 'LinuxPenguin', 'Mystery', 'Koodari',
+                           'HockeyFan'])
+        users = self.connection.get_users(seek=(1362015937, 'Mystery'),
+                                          order='registrationdate')
+        self.assertEquals([user['nickname'] for user in users],
+                          ['Koodari', 'HockeyFan'])
+        with self.assertRaises(ValueError):
+            self.connection.get_users(order='email')
+        with self.assertRaises(ValueError):
+            self.connection.get_users(seek=('Mystery',),
+                                      order='registrationdate')
+
     def test_delete_user(self):
         '''
         Test that the user Mystery is deleted
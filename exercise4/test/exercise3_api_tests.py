@@ -3,13 +3,15 @@ Created on 26.01.2013
 Modified on 24.02.2016
 @author: ivan
 '''
-import unittest, copy
+import unittest, copy, time
 import json
 
 import flask
+import flask.testing
 
 import forum.resources as resources
 import forum.database as database
+import forum.utils as utils
 
 DB_PATH = 'db/forum_test.db'
 ENGINE = database.Engine(DB_PATH)
@@ -28,6 +30,19 @@ resources.app.config['SERVER_NAME'] = 'localhost:5000'
 #Database Engine utilized in our testing
 resources.app.config.update({'Engine': ENGINE})
 
+
+class BufferedClient(flask.testing.FlaskClient):
+    '''
+    Test client that reads the whole body of the responses and closes it,
+    like a WSGI server does. Streamed responses keep the request context
+    and the database connection until they are closed.
+    '''
+    def open(self, *args, **kwargs):
+        kwargs.setdefault('buffered', True)
+        return super(BufferedClient, self).open(*args, **kwargs)
+
+resources.app.test_client_class = BufferedClient
+
 #Other database parameters.
 initial_messages = 20
 initial_users = 5
@@ -67,6 +82,9 @@ class ResourcesAPITestCase(unittest.TestCase):
         Remove all records from database
         '''
         ENGINE.clear()
+        #The database is reloaded, forget the rendered messages and users
+        resources.app.config['MessageCache'].clear()
+        resources.app.config['UserCache'].clear()
         self.app_context.pop()
 
 class MessagesTestCase (ResourcesAPITestCase):
@@ -175,6 +193,102 @@ class MessagesTestCase (ResourcesAPITestCase):
             self.assertEquals('headline', item['data'][0]['name'])
             self.assertIn('value', item['data'][0])
 
+    def test_search_messages(self):
+        '''
+        Checks that the search query of Messages returns ranked pages
+        '''
+        print '('+self.test_search_messages.__name__+')', self.test_search_messages.__doc__
+        resp = self.client.get(self.url)
+        queries = json.loads(resp.data)['collection']['queries']
+        self.assertEquals(queries[0]['rel'], 'search')
+        self.assertEquals(queries[0]['href'], self.url)
+        self.assertIn('search', [d['name'] for d in queries[0]['data']])
+
+        url = self.url + '?search=IE&length=3'
+        hrefs = []
+        while url is not None:
+            resp = self.client.get(url)
+            self.assertEquals(resp.status_code, 200)
+            data = json.loads(resp.data)['collection']
+            hrefs.extend(item['href'] for item in data['items'])
+            links = dict((link['rel'], link['href'])
+                         for link in data['links'])
+            url = links.get('next')
+        self.assertEquals(sorted(hrefs),
+                          [self.url + 'msg-%d/' % i for i in (1, 16, 6, 8)])
+
+        resp = self.client.get(self.url + '?search=%20')
+        self.assertEquals(resp.status_code, 400)
+        #An id out of the range of SQLite cannot be bound
+        resp = self.client.get(flask.url_for(
+            'messages', search='IE',
+            cursor=utils.encode_cursor('next', (-1.5, 2 ** 70))))
+        self.assertEquals(resp.status_code, 400)
+
+    def test_get_messages_pagination(self):
+        '''
+        Checks that the next and prev links of Messages traverse all messages
+        '''
+        print '('+self.test_get_messages_pagination.__name__+')', \
+              self.test_get_messages_pagination.__doc__
+        def get_page(url):
+            resp = self.client.get(url)
+            self.assertEquals(resp.status_code, 200)
+            collection = json.loads(resp.data)['collection']
+            links = dict((link['rel'], link['href'])
+                         for link in collection['links'])
+            return [item['href'] for item in collection['items']], links
+
+        first_page, links = get_page(flask.url_for('messages', length=8))
+        self.assertEquals(len(first_page), 8)
+        self.assertNotIn('prev', links)
+        second_page, links = get_page(links['next'])
+        self.assertEquals(len(second_page), 8)
+        last_page, last_links = get_page(links['next'])
+        self.assertEquals(len(last_page), 4)
+        self.assertNotIn('next', last_links)
+        self.assertEquals(len(set(first_page + second_page + last_page)),
+                          initial_messages)
+        #The prev link of the second page returns the first page
+        page, links = get_page(links['prev'])
+        self.assertEquals(page, first_page)
+        self.assertNotIn('prev', links)
+        #Malformed cursor
+        resp = self.client.get(flask.url_for('messages', cursor='wrong'))
+        self.assertEquals(resp.status_code, 400)
+        #Cursors whose key is not a (timestamp, message_id) pair of
+        #SQLite numbers
+        for direction, key in (('next', (1, 2, 3)), ('prev', (1,)),
+                               ('next', ('msg-1', 2)), ('prev', (1, 2.5)),
+                               ('next', (1, 2 ** 70)),
+                               ('prev', (-2 ** 64, 1))):
+            resp = self.client.get(flask.url_for(
+                'messages', cursor=utils.encode_cursor(direction, key)))
+            self.assertEquals(resp.status_code, 400)
+
+    def test_get_messages_not_modified(self):
+        '''
+        Checks that GET Messages returns 304 until a message is added
+        '''
+        print '('+self.test_get_messages_not_modified.__name__+')', \
+              self.test_get_messages_not_modified.__doc__
+        url = flask.url_for('messages')
+        resp = self.client.get(url)
+        self.assertEquals(resp.status_code, 200)
+        etag = resp.headers['ETag']
+        self.assertIn('Last-Modified', resp.headers)
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEquals(resp.status_code, 304)
+        self.assertEquals(resp.data, '')
+        self.assertEquals(resp.headers['ETag'], etag)
+        resp = self.client.post(resources.api.url_for(resources.Messages),
+                                headers={'Content-Type': COLLECTIONJSON},
+                                data=json.dumps(self.message_1_request))
+        self.assertEquals(resp.status_code, 201)
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEquals(resp.status_code, 200)
+        self.assertNotEquals(resp.headers['ETag'], etag)
+
     def test_get_messages_mimetype(self):
         '''
         Checks that GET Messages return correct status code and data format
@@ -223,6 +337,30 @@ class MessagesTestCase (ResourcesAPITestCase):
         resp = self.client.get(url)
         self.assertTrue(resp.status_code == 200)
 
+    def test_add_message_writer_failure(self):
+        '''
+        Test that a write answers 503 instead of waiting when the writer
+        thread of the write-behind mode cannot connect to the database
+        '''
+        print '('+self.test_add_message_writer_failure.__name__+')', self.test_add_message_writer_failure.__doc__
+        def connect():
+            raise database.sqlite3.OperationalError("unable to open database")
+        ENGINE._writer = database.WriteBehindQueue(connect)
+        ENGINE._writer.start()
+        ENGINE.write_behind = True
+        try:
+            start = time.time()
+            for _ in xrange(2):
+                resp = self.client.post(
+                    resources.api.url_for(resources.Messages),
+                    headers={'Content-Type': COLLECTIONJSON},
+                    data=json.dumps(self.message_1_request))
+                self.assertEquals(resp.status_code, 503)
+            self.assertLess(time.time() - start, resources.WRITE_TIMEOUT)
+        finally:
+            ENGINE.write_behind = False
+            ENGINE.stop_writer()
+
     def test_add_message_wrong_media(self):
         '''
         Test adding messages with a media different than json
@@ -252,6 +390,229 @@ class MessagesTestCase (ResourcesAPITestCase):
                                )
         self.assertTrue(resp.status_code == 400)
 
+class ThreadTestCase (ResourcesAPITestCase):
+
+    url = "/forum/api/messages/msg-1/thread/"
+    url_wrong = "/forum/api/messages/msg-200/thread/"
+
+    def test_url(self):
+        '''
+        Checks that the URL points to the right resource
+        '''
+        print '('+self.test_url.__name__+')', self.test_url.__doc__,
+        with resources.app.test_request_context(self.url):
+            rule = flask.request.url_rule
+            view_point = resources.app.view_functions[rule.endpoint].view_class
+            self.assertEquals(view_point, resources.Thread)
+
+    def test_get_thread(self):
+        '''
+        Checks that GET Thread returns the whole reply tree
+        '''
+        print '('+self.test_get_thread.__name__+')', self.test_get_thread.__doc__
+        resp = self.client.get(self.url)
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals(resp.headers.get('Content-Type',None),
+                          COLLECTIONJSON+";"+FORUM_MESSAGE_PROFILE)
+        data = json.loads(resp.data)['collection']
+        items = data['items']
+        self.assertEquals(len(items), 12)
+        self.assertEquals(items[0]['href'], '/forum/api/messages/msg-1/')
+        self.assertEquals(items[0]['links'], [])
+        self.assertEquals(items[1]['href'], '/forum/api/messages/msg-3/')
+        self.assertEquals(items[1]['links'][0]['rel'], 'in-reply-to')
+        self.assertEquals(items[1]['links'][0]['href'],
+                          '/forum/api/messages/msg-1/')
+        self.assertIn({'name': 'depth', 'value': 1}, items[1]['data'])
+        self.assertNotIn('next', [link['rel'] for link in data['links']])
+
+        resp = self.client.get(self.url + '?depth=1')
+        items = json.loads(resp.data)['collection']['items']
+        self.assertEquals(len(items), 8)
+
+    def test_get_thread_pages(self):
+        '''
+        Checks that a long thread is read following the next links
+        '''
+        print '('+self.test_get_thread_pages.__name__+')', self.test_get_thread_pages.__doc__
+        url = self.url + '?length=5'
+        hrefs = []
+        while url is not None:
+            resp = self.client.get(url)
+            self.assertEquals(resp.status_code, 200)
+            data = json.loads(resp.data)['collection']
+            self.assertLessEqual(len(data['items']), 5)
+            hrefs.extend(item['href'] for item in data['items'])
+            links = dict((link['rel'], link['href'])
+                         for link in data['links'])
+            url = links.get('next')
+        self.assertEquals(len(hrefs), 12)
+        self.assertEquals(len(set(hrefs)), 12)
+
+        resp = self.client.get(self.url + '?cursor=wrong')
+        self.assertEquals(resp.status_code, 400)
+
+    def test_get_thread_unknown_message(self):
+        '''
+        Checks that GET Thread returns 404 for an unknown message
+        '''
+        print '('+self.test_get_thread_unknown_message.__name__+')', self.test_get_thread_unknown_message.__doc__
+        resp = self.client.get(self.url_wrong)
+        self.assertEquals(resp.status_code, 404)
+
+class MessagesBatchTestCase (ResourcesAPITestCase):
+
+    batch_request = {"templates": [
+        MessagesTestCase.message_1_request["template"],
+        MessagesTestCase.message_2_request["template"],
+        {"data": [
+            {"name": "headline", "value": "RE: CSS: Margin problems with IE"},
+            {"name": "articleBody", "value": "Check the box model"},
+            {"name": "author", "value": "AxelW"},
+            {"name": "inReplyTo",
+             "value": "http://localhost:5000/forum/api/messages/msg-1/"}
+        ]}
+    ]}
+
+    url = "/forum/api/messages/batch/"
+
+    def test_url(self):
+        '''
+        Checks that the URL points to the right resource
+        '''
+        print '('+self.test_url.__name__+')', self.test_url.__doc__,
+        with resources.app.test_request_context(self.url, method='POST'):
+            rule = flask.request.url_rule
+            view_point = resources.app.view_functions[rule.endpoint].view_class
+            self.assertEquals(view_point, resources.MessagesBatch)
+
+    def test_add_messages(self):
+        '''
+        Test adding many messages with one request
+        '''
+        print '('+self.test_add_messages.__name__+')', self.test_add_messages.__doc__
+        resp = self.client.post(self.url,
+                                headers={'Content-Type': COLLECTIONJSON},
+                                data=json.dumps(self.batch_request))
+        self.assertEquals(resp.status_code, 201)
+        items = json.loads(resp.data)['collection']['items']
+        self.assertEquals(len(items), 3)
+        for item in items:
+            resp = self.client.get(item['href'])
+            self.assertEquals(resp.status_code, 200)
+        data = json.loads(resp.data)
+        self.assertEquals(data['author'], 'AxelW')
+        self.assertEquals(data['_links']['atom-thread:in-reply-to']['href'],
+                          '/forum/api/messages/msg-1/')
+
+    def test_add_messages_incorrect_format(self):
+        '''
+        Test that no message is added if any template is wrong
+        '''
+        print '('+self.test_add_messages_incorrect_format.__name__+')', self.test_add_messages_incorrect_format.__doc__
+        for templates in ([self.batch_request['templates'][0],
+                           MessagesTestCase.message_4_wrong['template']],
+                          [{"data": [
+                              {"name": "headline", "value": "Reply"},
+                              {"name": "articleBody", "value": "Reply"},
+                              {"name": "inReplyTo",
+                               "value": "/forum/api/users/AxelW/"}]}],
+                          []):
+            resp = self.client.post(self.url,
+                                    headers={'Content-Type': COLLECTIONJSON},
+                                    data=json.dumps({'templates': templates}))
+            self.assertEquals(resp.status_code, 400)
+        resp = self.client.get(MessagesTestCase.url + '?length=100')
+        self.assertEquals(len(json.loads(resp.data)['collection']['items']),
+                          initial_messages)
+
+    def test_add_messages_wrong_parent_type(self):
+        '''
+        Test that inReplyTo values that are not strings are rejected
+        '''
+        print '('+self.test_add_messages_wrong_parent_type.__name__+')', self.test_add_messages_wrong_parent_type.__doc__
+        for value in (5, ["x"], {"a": 1}, True):
+            templates = [{"data": [
+                {"name": "headline", "value": "Reply"},
+                {"name": "articleBody", "value": "Reply"},
+                {"name": "inReplyTo", "value": value}]}]
+            resp = self.client.post(self.url,
+                                    headers={'Content-Type': COLLECTIONJSON},
+                                    data=json.dumps({'templates': templates}))
+            self.assertEquals(resp.status_code, 400)
+        resp = self.client.get(MessagesTestCase.url + '?length=100')
+        self.assertEquals(len(json.loads(resp.data)['collection']['items']),
+                          initial_messages)
+
+    def test_add_messages_wrong_value_type(self):
+        '''
+        Test that headline, articleBody and author values that are not
+        strings are rejected
+        '''
+        print '('+self.test_add_messages_wrong_value_type.__name__+')', self.test_add_messages_wrong_value_type.__doc__
+        for name in ("headline", "articleBody", "author"):
+            data = {"headline": "Title", "articleBody": "Body",
+                    "author": "AxelW"}
+            for value in (5, ["x"], {"a": 1}, True):
+                data[name] = value
+                templates = [{"data": [{"name": n, "value": v}
+                                       for n, v in data.items()]}]
+                resp = self.client.post(
+                    self.url, headers={'Content-Type': COLLECTIONJSON},
+                    data=json.dumps({'templates': templates}))
+                self.assertEquals(resp.status_code, 400)
+        resp = self.client.get(MessagesTestCase.url + '?length=100')
+        self.assertEquals(len(json.loads(resp.data)['collection']['items']),
+                          initial_messages)
+
+    def test_add_messages_archived_parent(self):
+        '''
+        Test that no message is added if a parent message has been moved to
+        a partition
+        '''
+        print '('+self.test_add_messages_archived_parent.__name__+')', self.test_add_messages_archived_parent.__doc__
+        #The last message cannot be moved, so create a newer one
+        connection = ENGINE.connect()
+        try:
+            connection.create_message('New', 'Newest message', 'Koodari')
+        finally:
+            connection.close()
+        #Moves msg-1
+        ENGINE.create_partition('p1', 1362000000, 1362317481)
+        templates = [self.batch_request['templates'][0],
+                     {"data": [
+                         {"name": "headline", "value": "Reply"},
+                         {"name": "articleBody", "value": "Reply"},
+                         {"name": "inReplyTo",
+                          "value": "/forum/api/messages/msg-1/"}]}]
+        resp = self.client.post(self.url,
+                                headers={'Content-Type': COLLECTIONJSON},
+                                data=json.dumps({'templates': templates}))
+        self.assertEquals(resp.status_code, 409)
+        resp = self.client.get(MessagesTestCase.url + '?length=100')
+        #Only the message created above has been added
+        self.assertEquals(len(json.loads(resp.data)['collection']['items']),
+                          initial_messages + 1)
+
+    def test_add_messages_unexisting_parent(self):
+        '''
+        Test that no message is added if a parent message does not exist
+        '''
+        print '('+self.test_add_messages_unexisting_parent.__name__+')', self.test_add_messages_unexisting_parent.__doc__
+        templates = [self.batch_request['templates'][0],
+                     {"data": [
+                         {"name": "headline", "value": "Reply"},
+                         {"name": "articleBody", "value": "Reply"},
+                         {"name": "inReplyTo",
+                          "value": "/forum/api/messages/msg-200/"}]}]
+        resp = self.client.post(self.url,
+                                headers={'Content-Type': COLLECTIONJSON},
+                                data=json.dumps({'templates': templates}))
+        self.assertEquals(resp.status_code, 404)
+        resp = self.client.get(MessagesTestCase.url + '?length=100')
+        self.assertEquals(len(json.loads(resp.data)['collection']['items']),
+                          initial_messages)
+
 class MessageTestCase (ResourcesAPITestCase):
 
     #ATTENTION: json.loads return unicode
@@ -380,6 +741,44 @@ class MessageTestCase (ResourcesAPITestCase):
         resp = self.client.get(self.url_wrong)
         self.assertEquals(resp.status_code, 404)
 
+    def test_large_message_ids(self):
+        '''
+        Checks that messages with 64-bit ids are routed, linked and replied
+        and that ids out of range are not found
+        '''
+        print '('+self.test_large_message_ids.__name__+')', \
+              self.test_large_message_ids.__doc__
+        largest = 'msg-%d' % database.MAX_MESSAGE_ID
+        con = ENGINE.connect()
+        try:
+            con.con.execute('INSERT INTO messages (message_id, title, body, \
+                             timestamp, ip, timesviewed, reply_to, \
+                             user_nickname) \
+                             VALUES (?, ?, ?, ?, ?, 0, NULL, ?)',
+                            (database.MAX_MESSAGE_ID, 'Largest', 'body',
+                             1400000000, '0.0.0.0', 'AxelW'))
+        finally:
+            con.close()
+        url = resources.api.url_for(resources.Message, messageid=largest,
+                                    _external=False)
+        resp = self.client.get(url)
+        self.assertEquals(resp.status_code, 200)
+        links = json.loads(resp.data)['_links']
+        self.assertEquals(links['self']['href'], url)
+        resp = self.client.get(url + 'thread/')
+        self.assertEquals(resp.status_code, 200)
+        resp = self.client.post(url, data=json.dumps(self.message_req_1),
+                                headers={"Content-Type": COLLECTIONJSON})
+        self.assertEquals(resp.status_code, 201)
+        resp = self.client.get(resp.headers['Location'])
+        links = json.loads(resp.data)['_links']
+        self.assertTrue(links['atom-thread:in-reply-to']['href']
+                        .endswith(url))
+        for messageid in ('msg-%d' % (database.MAX_MESSAGE_ID + 1),
+                          'msg-' + '9' * 25):
+            resp = self.client.get('/forum/api/messages/%s/' % messageid)
+            self.assertEquals(resp.status_code, 404)
+
     def test_get_message(self):
         '''
         Checks that GET Message return correct status code and data format
@@ -538,6 +937,127 @@ class MessageTestCase (ResourcesAPITestCase):
                           self.message_mod_req_1['template']['data'][1]['value']
                          )
 
+    def test_add_reply_updates_counters(self):
+        '''
+        Checks that the number of replies of a cached message is updated
+        '''
+        print '('+self.test_add_reply_updates_counters.__name__+')', self.test_add_reply_updates_counters.__doc__
+        data = json.loads(self.client.get(self.url).data)
+        self.assertEquals(data['replyCount'], 7)
+        self.assertEquals(data['lastReply'], 1362517481)
+        resp = self.client.post(self.url,
+                                data=json.dumps(self.message_req_1),
+                                headers={"Content-Type": COLLECTIONJSON})
+        self.assertEquals(resp.status_code, 201)
+        data = json.loads(self.client.get(self.url).data)
+        self.assertEquals(data['replyCount'], 8)
+        self.assertGreater(data['lastReply'], 1362517481)
+
+    def test_get_message_cached(self):
+        '''
+        Checks that a message is rendered once and then served from the cache
+        '''
+        print '('+self.test_get_message_cached.__name__+')', self.test_get_message_cached.__doc__
+        message_cache = resources.app.config['MessageCache']
+        resp = self.client.get(self.url)
+        self.assertEquals(resp.status_code, 200)
+        stats = message_cache.stats()
+        resp2 = self.client.get(self.url)
+        self.assertEquals(resp2.status_code, 200)
+        self.assertEquals(resp2.headers.get('Content-Type', None),
+                          HAL+";"+FORUM_MESSAGE_PROFILE)
+        self.assertEquals(resp2.data, resp.data)
+        self.assertEquals(message_cache.stats()['hits'], stats['hits'] + 1)
+
+    def test_modify_message_invalidates_cache(self):
+        '''
+        Checks that a cached message is rendered again after it is modified
+        '''
+        print '('+self.test_modify_message_invalidates_cache.__name__+')', self.test_modify_message_invalidates_cache.__doc__
+        self.client.get(self.url)
+        resp = self.client.put(self.url,
+                               data=json.dumps(self.message_mod_req_1),
+                               headers={"Content-Type": COLLECTIONJSON})
+        self.assertEquals(resp.status_code, 204)
+        data = json.loads(self.client.get(self.url).data)
+        self.assertEquals(data['headline'],
+                          self.message_mod_req_1['template']['data'][0]['value'])
+        self.assertEquals(data['editor'], 'AxelW')
+
+    def test_engine_change_invalidates_cache(self):
+        '''
+        Checks that a cached message is rendered again after it is modified
+        through the Engine instead of the API
+        '''
+        print '('+self.test_engine_change_invalidates_cache.__name__+')', self.test_engine_change_invalidates_cache.__doc__
+        self.client.get(self.url)
+        connection = ENGINE.connect()
+        try:
+            connection.modify_message('msg-1', 'Changed', 'Changed body',
+                                      'Koodari')
+        finally:
+            connection.close()
+        data = json.loads(self.client.get(self.url).data)
+        self.assertEquals(data['headline'], 'Changed')
+        self.assertEquals(data['editor'], 'Koodari')
+
+    def test_delete_message_invalidates_replies(self):
+        '''
+        Checks that the cached replies of a deleted message are not served
+        '''
+        print '('+self.test_delete_message_invalidates_replies.__name__+')', self.test_delete_message_invalidates_replies.__doc__
+        #msg-10 is a reply to msg-1
+        reply_url = resources.api.url_for(resources.Message,
+                                          messageid='msg-10',
+                                          _external=False)
+        self.assertEquals(self.client.get(reply_url).status_code, 200)
+        self.assertEquals(self.client.delete(self.url).status_code, 204)
+        self.assertEquals(self.client.get(reply_url).status_code, 404)
+
+    def test_delete_user_invalidates_cache(self):
+        '''
+        Checks that the cached messages of a deleted user lose their author
+        '''
+        print '('+self.test_delete_user_invalidates_cache.__name__+')', self.test_delete_user_invalidates_cache.__doc__
+        data = json.loads(self.client.get(self.url).data)
+        self.assertEquals(data['author'], 'AxelW')
+        user_url = resources.api.url_for(resources.User, nickname='AxelW',
+                                         _external=False)
+        self.assertEquals(self.client.delete(user_url).status_code, 204)
+        data = json.loads(self.client.get(self.url).data)
+        self.assertEquals(data['author'], 'Anonymous')
+
+    def test_get_message_not_modified(self):
+        '''
+        Checks the conditional GET of a message with If-None-Match and
+        If-Modified-Since
+        '''
+        print '('+self.test_get_message_not_modified.__name__+')', self.test_get_message_not_modified.__doc__
+        resp = self.client.get(self.url)
+        self.assertEquals(resp.status_code, 200)
+        etag = resp.headers['ETag']
+        last_modified = resp.headers['Last-Modified']
+        resp = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEquals(resp.status_code, 304)
+        resp = self.client.get(self.url,
+                               headers={'If-Modified-Since': last_modified})
+        self.assertEquals(resp.status_code, 304)
+        #If-None-Match has precedence over If-Modified-Since
+        resp = self.client.get(self.url,
+                               headers={'If-None-Match': '"other"',
+                                        'If-Modified-Since': last_modified})
+        self.assertEquals(resp.status_code, 200)
+        #Errors do not have validators
+        resp = self.client.get(self.url_wrong)
+        self.assertEquals(resp.status_code, 404)
+        self.assertNotIn('ETag', resp.headers)
+        resp = self.client.put(self.url,
+                               data=json.dumps(self.message_mod_req_1),
+                               headers={"Content-Type": COLLECTIONJSON})
+        self.assertEquals(resp.status_code, 204)
+        resp = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEquals(resp.status_code, 200)
+
     def test_modify_unexisting_message(self):
         '''
         Try to modify a message that does not exist
@@ -584,6 +1104,40 @@ class MessageTestCase (ResourcesAPITestCase):
         resp = self.client.delete(self.url_wrong)
         self.assertEquals(resp.status_code, 404)
 
+    def test_archived_message(self):
+        '''
+        Checks that a message moved to a partition can be read, but that
+        modifying, deleting, replying to it or reading its thread return 409
+        '''
+        print '('+self.test_archived_message.__name__+')', self.test_archived_message.__doc__
+        #The last message cannot be moved, so create a newer one
+        connection = ENGINE.connect()
+        try:
+            connection.create_message('New', 'Newest message', 'Koodari')
+        finally:
+            connection.close()
+        #Moves msg-1, whose reply msg-17 stays in the main database
+        ENGINE.create_partition('p1', 1362000000, 1362317481)
+        self.assertEquals(self.client.get(self.url).status_code, 200)
+        resp = self.client.put(self.url,
+                               data=json.dumps(self.message_mod_req_1),
+                               headers={"Content-Type": COLLECTIONJSON})
+        self.assertEquals(resp.status_code, 409)
+        resp = self.client.post(self.url,
+                                data=json.dumps(self.message_req_1),
+                                headers={"Content-Type": COLLECTIONJSON})
+        self.assertEquals(resp.status_code, 409)
+        resp = self.client.delete(self.url)
+        self.assertEquals(resp.status_code, 409)
+        resp = self.client.get(resources.api.url_for(resources.Thread,
+                                                     messageid='msg-1',
+                                                     _external=False))
+        self.assertEquals(resp.status_code, 409)
+        self.assertEquals(self.client.get(self.url).status_code, 200)
+        #Unknown messages are still not found
+        resp = self.client.delete(self.url_wrong)
+        self.assertEquals(resp.status_code, 404)
+
 class UsersTestCase (ResourcesAPITestCase):
 
     user_1_request = {"template": {
@@ -749,6 +1303,86 @@ class UsersTestCase (ResourcesAPITestCase):
         self.assertEquals(resp.headers.get('Content-Type',None),
                           COLLECTIONJSON+";"+FORUM_USER_PROFILE)
 
+    def test_build_url(self):
+        '''
+        Checks that the URLs built from templates are the URLs of url_for
+        '''
+        print '('+self.test_build_url.__name__+')', self.test_build_url.__doc__
+        for base_url in ('http://localhost:5000/',
+                         'http://localhost:5000/forum_app/'):
+            with resources.app.test_request_context(self.url,
+                                                    base_url=base_url):
+                for nickname in ('AxelW', u'Ax el/\xe4%?#'):
+                    for resource in (resources.User, resources.History):
+                        self.assertEquals(
+                            resources.build_url(resource, nickname=nickname),
+                            resources.api.url_for(resource, nickname=nickname))
+                self.assertEquals(
+                    resources.build_url(resources.Message, messageid='msg-1'),
+                    resources.api.url_for(resources.Message, messageid='msg-1'))
+
+    def test_get_users_pagination(self):
+        '''
+        Checks that the next and prev links of Users traverse all users in
+        both orders
+        '''
+        print '('+self.test_get_users_pagination.__name__+')', \
+              self.test_get_users_pagination.__doc__
+        def get_page(url):
+            resp = self.client.get(url)
+            self.assertEquals(resp.status_code, 200)
+            collection = json.loads(resp.data)['collection']
+            links = dict((link['rel'], link['href'])
+                         for link in collection['links'])
+            return [item['href'].split('/')[-2]
+                    for item in collection['items']], links
+
+        first_page, links = get_page(flask.url_for('users', length=2))
+        self.assertEquals(first_page, ['AxelW', 'HockeyFan'])
+        self.assertNotIn('prev', links)
+        second_page, links = get_page(links['next'])
+        self.assertEquals(second_page, ['Koodari', 'LinuxPenguin'])
+        last_page, last_links = get_page(links['next'])
+        self.assertEquals(last_page, ['Mystery'])
+        self.assertNotIn('next', last_links)
+        #The prev link of the second page returns the first page
+        page, links = get_page(links['prev'])
+        self.assertEquals(page, first_page)
+        self.assertNotIn('prev', links)
+        #By registration date
+        page, links = get_page(flask.url_for('users', length=3,
+                                             order='registrationdate'))
+        self.assertEquals(page, ['AxelW', 'LinuxPenguin', 'Mystery'])
+        page, links = get_page(links['next'])
+        self.assertEquals(page, ['Koodari', 'HockeyFan'])
+        #Malformed parameters. The cursor of another order does not match.
+        resp = self.client.get(flask.url_for('users', order='email'))
+        self.assertEquals(resp.status_code, 400)
+        resp = self.client.get(links['prev'].replace('registrationdate',
+                                                     'nickname'))
+        self.assertEquals(resp.status_code, 400)
+        #Keys of the wrong types or out of the range of SQLite
+        for order, key in (('registrationdate', (2 ** 70, 'AxelW')),
+                           ('registrationdate', ('AxelW', 'AxelW')),
+                           ('nickname', (5,)),
+                           ('nickname', ('AxelW', 'Mystery'))):
+            resp = self.client.get(flask.url_for(
+                'users', order=order,
+                cursor=utils.encode_cursor('next', key)))
+            self.assertEquals(resp.status_code, 400)
+
+    def test_get_users_streamed(self):
+        '''
+        Checks that GET Users streams the body and gives back the connection
+        '''
+        print '('+self.test_get_users_streamed.__name__+')', self.test_get_users_streamed.__doc__
+        resp = self.client.get(self.url)
+        self.assertEquals(resp.status_code, 200)
+        self.assertIsNone(resp.headers.get('Content-Length'))
+        data = json.loads(resp.data)['collection']
+        self.assertEquals(len(data['items']), initial_users)
+        self.assertEquals(ENGINE.pool_stats(read_only=True)['in_use'], 0)
+
     def test_add_user(self):
         '''
         Checks that the user is added correctly
@@ -888,6 +1522,57 @@ class UserTestCase (ResourcesAPITestCase):
         self.assertEquals(resp.headers.get('Content-Type',None),
                           HAL+";"+FORUM_USER_PROFILE)
 
+    def test_get_user_cached(self):
+        '''
+        Checks that the user record is read once for the user resources and
+        read again after the user is modified
+        '''
+        print '('+self.test_get_user_cached.__name__+')', self.test_get_user_cached.__doc__
+        user_cache = resources.app.config['UserCache']
+        public_url = resources.api.url_for(resources.User_public,
+                                           nickname='AxelW', _external=False)
+        self.assertEquals(self.client.get(self.url1).status_code, 200)
+        stats = user_cache.stats()
+        self.assertEquals(self.client.get(public_url).status_code, 200)
+        self.assertEquals(user_cache.stats()['hits'], stats['hits'] + 1)
+        resp = self.client.put(public_url,
+                               data=json.dumps({'template': {'data': [
+                                   {'name': 'signature', 'value': 'Bye'},
+                                   {'name': 'avatar', 'value': 'bye.jpg'}]}}),
+                               headers={"Content-Type": COLLECTIONJSON})
+        self.assertEquals(resp.status_code, 204)
+        data = json.loads(self.client.get(public_url).data)
+        self.assertEquals(data['signature'], 'Bye')
+        #A deleted user is not served from the cache
+        self.assertEquals(self.client.delete(self.url1).status_code, 204)
+        self.assertEquals(self.client.get(public_url).status_code, 404)
+
+    def test_get_user_counters(self):
+        '''
+        Checks that the number of messages of the user follows its messages
+        '''
+        print '('+self.test_get_user_counters.__name__+')', self.test_get_user_counters.__doc__
+        resp = self.client.get(self.url1)
+        data = json.loads(resp.data)
+        self.assertEquals(data['messageCount'], 2)
+        self.assertEquals(data['lastActivity'], 1362517481)
+        messages_url = resources.api.url_for(resources.Messages,
+                                             _external=False)
+        resp2 = self.client.post(messages_url,
+                                 data=json.dumps(MessageTestCase.message_req_1),
+                                 headers={"Content-Type": COLLECTIONJSON})
+        self.assertEquals(resp2.status_code, 201)
+        #The representation changed, so it cannot be validated with the ETag
+        resp2 = self.client.get(self.url1,
+                                headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEquals(resp2.status_code, 200)
+        self.assertEquals(json.loads(resp2.data)['messageCount'], 2)
+        hockeyfan_url = resources.api.url_for(resources.User,
+                                              nickname='HockeyFan',
+                                              _external=False)
+        data = json.loads(self.client.get(hockeyfan_url).data)
+        self.assertEquals(data['messageCount'], 4)
+
     def test_get_format(self):
         '''
         Checks that the format of user is correct
@@ -898,8 +1583,9 @@ class UserTestCase (ResourcesAPITestCase):
         self.assertEquals(resp.status_code, 200)
         data = json.loads(resp.data)
 
-        attributes = ('nickname', 'registrationdate', '_links')
-        self.assertEquals(len(data), 3)
+        attributes = ('nickname', 'registrationdate', 'messageCount',
+                      'lastActivity', '_links')
+        self.assertEquals(len(data), 5)
         for data_attribute in data:
             self.assertIn(data_attribute, attributes)
 
@@ -961,6 +1647,20 @@ class UserTestCase (ResourcesAPITestCase):
         resp2 = self.client.get(self.url1)
         self.assertEquals(resp2.status_code, 404)
 
+    def test_get_user_not_modified(self):
+        '''
+        Checks that GET User returns 304 until the user is deleted
+        '''
+        print '('+self.test_get_user_not_modified.__name__+')', self.test_get_user_not_modified.__doc__
+        resp = self.client.get(self.url1)
+        self.assertEquals(resp.status_code, 200)
+        etag = resp.headers['ETag']
+        resp = self.client.get(self.url1, headers={'If-None-Match': etag})
+        self.assertEquals(resp.status_code, 304)
+        self.assertEquals(self.client.delete(self.url1).status_code, 204)
+        resp = self.client.get(self.url1, headers={'If-None-Match': etag})
+        self.assertEquals(resp.status_code, 404)
+
     def test_delete_unexisting_user(self):
         '''
         Checks that Delete user return correct status code if given a wrong address
@@ -1015,6 +1715,30 @@ class HistoryTestCase (ResourcesAPITestCase):
         self.assertEquals(resp.headers.get('Content-Type',None),
                           COLLECTIONJSON+";"+FORUM_MESSAGE_PROFILE)
 
+    def test_get_history_counters(self):
+        '''
+        Checks that the counters of the user are in the headers of History
+        '''
+        print '('+self.test_get_history_counters.__name__+')', self.test_get_history_counters.__doc__
+        #The counters do not depend on the query parameters
+        for url in (self.url1, self.url3):
+            resp = self.client.get(url)
+            self.assertEquals(resp.status_code, 200)
+            self.assertEquals(resp.headers['X-Message-Count'],
+                              str(self.messages1_number))
+            self.assertEquals(resp.headers['X-Last-Activity'], '1362517481')
+
+    def test_get_history_not_modified(self):
+        '''
+        Checks that GET History returns 304 if the messages did not change
+        '''
+        print '('+self.test_get_history_not_modified.__name__+')', self.test_get_history_not_modified.__doc__
+        resp = self.client.get(self.url1)
+        self.assertEquals(resp.status_code, 200)
+        resp = self.client.get(self.url1,
+                               headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEquals(resp.status_code, 304)
+
     def test_get_history_number_values(self):
         '''
         Checks that GET history return correct status code and number of values
@@ -1076,6 +1800,40 @@ class HistoryTestCase (ResourcesAPITestCase):
         resp = self.client.get(self.url_wrong)
         self.assertEquals(resp.status_code, 404)
 
+    def test_get_history_partitions(self):
+        '''
+        Checks that GET history merges the messages moved to a partition
+        with the rest and reads only the partitions of the window
+        '''
+        print '('+self.test_get_history_partitions.__name__+')', self.test_get_history_partitions.__doc__
+        #The last message cannot be moved, so create a newer one
+        connection = ENGINE.connect()
+        try:
+            connection.create_message('New', 'Newest message', 'Koodari')
+        finally:
+            connection.close()
+        #Moves msg-1 of AxelW, but not msg-17
+        self.assertEquals(ENGINE.create_partition('p1', 1362000000,
+                                                  1362317481), 19)
+        for url, messageids in ((self.url1, ['msg-17', 'msg-1']),
+                                (self.url3, ['msg-17']),
+                                (self.url4, ['msg-17']),
+                                (self.url5, ['msg-1'])):
+            resp = self.client.get(url)
+            self.assertEquals(resp.status_code, 200)
+            items = json.loads(resp.data)['collection']['items']
+            self.assertEquals([item['href'].rstrip('/').rsplit('/', 1)[1]
+                               for item in items], messageids)
+        self.assertEquals(self.client.get(self.url6).status_code, 404)
+        #The counters keep the archived messages
+        resp = self.client.get(self.url1)
+        self.assertEquals(resp.headers['X-Message-Count'], '2')
+        #The archived message is still served
+        resp = self.client.get(resources.api.url_for(
+            resources.Message, messageid='msg-1', _external=False))
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals(json.loads(resp.data)['replyCount'], 7)
+
     def test_get_history(self):
         '''
         Checks that GET history return correct status code and number of values
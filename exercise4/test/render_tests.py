@@ -0,0 +1,115 @@
+'''
+Testing of the serialisation of the envelopes with pre-serialised
+fragments.
+'''
+
+from collections import OrderedDict
+import io, json, unittest
+
+from forum import render
+
+
+class RenderTestCase(unittest.TestCase):
+    '''
+    Test cases for forum.render
+    '''
+    @classmethod
+    def setUpClass(cls):
+        print "Testing ", cls.__name__
+
+    def test_dumps_fragments(self):
+        '''
+        Check that the fragments are written in the place of the values
+        '''
+        print '('+self.test_dumps_fragments.__name__+')', \
+              self.test_dumps_fragments.__doc__
+        template = {'data': [{'name': 'headline', 'value': '',
+                              'required': True}]}
+        envelope = {'collection': {'version': '1.0',
+                                   'template': render.Fragment(template),
+                                   'links': [render.Fragment({'rel': 'up'})],
+                                   'items': [{'href': u'/\xe4\xf6'}]}}
+        expected = {'collection': {'version': '1.0', 'template': template,
+                                   'links': [{'rel': 'up'}],
+                                   'items': [{'href': u'/\xe4\xf6'}]}}
+        self.assertEquals(json.loads(render.dumps(envelope)), expected)
+
+    def test_fill_template(self):
+        '''
+        Check that the placeholders are replaced by the escaped values
+        '''
+        print '('+self.test_fill_template.__name__+')', \
+              self.test_fill_template.__doc__
+        queries = render.FragmentTemplate(
+            [{'href': render.Placeholder('href'), 'rel': 'search',
+              'data': [{'name': render.Placeholder('name')}]}])
+        fragment = queries.fill(href='/"history"/', name='after')
+        self.assertEquals(json.loads(render.dumps({'queries': fragment})),
+                          {'queries': [{'href': '/"history"/',
+                                        'rel': 'search',
+                                        'data': [{'name': 'after'}]}]})
+        self.assertRaises(TypeError, render.FragmentTemplate, [object()])
+
+    def test_iterdumps_stream(self):
+        '''
+        Check that a stream is written in chunks and a deferred value after it
+        '''
+        print '('+self.test_iterdumps_stream.__name__+')', \
+              self.test_iterdumps_stream.__doc__
+        read = []
+        def items():
+            for i in xrange(5):
+                read.append(i)
+                yield {'href': '/msg-%d/' % i,
+                       'template': render.Fragment({'data': []})}
+        envelope = OrderedDict([('items', render.Stream(items(), 2)),
+                                ('links', render.Deferred(lambda: len(read)))])
+        chunks = render.iterdumps(envelope)
+        document = [next(chunks), next(chunks)]
+        self.assertEquals(document, ['{"items": ', '['])
+        self.assertEquals(read, [])
+        document.append(next(chunks))
+        self.assertEquals(read, [0, 1])
+        document.extend(chunks)
+        expected = {'items': [{'href': '/msg-%d/' % i, 'template': {'data': []}}
+                              for i in xrange(5)],
+                    'links': 5}
+        self.assertEquals(json.loads(''.join(document)), expected)
+
+    def test_encoders(self):
+        '''
+        Check that every available encoder writes the same document
+        '''
+        print '('+self.test_encoders.__name__+')', \
+              self.test_encoders.__doc__
+        envelope = OrderedDict([('href', u'/\xe4/'),
+                                ('template', render.Fragment({'data': []})),
+                                ('items', [{'value': 1.5}, {'value': None}])])
+        expected = {'href': u'/\xe4/', 'template': {'data': []},
+                    'items': [{'value': 1.5}, {'value': None}]}
+        default = render.ENCODER
+        self.assertIn('json', render.available_encoders())
+        try:
+            for name in render.available_encoders():
+                render.use_encoder(name)
+                self.assertEquals(render.ENCODER, name)
+                self.assertEquals(json.loads(render.dumps(envelope)), expected)
+        finally:
+            render.use_encoder(default)
+        self.assertRaises(ValueError, render.use_encoder, 'pickle')
+
+    def test_dump_buffer(self):
+        '''
+        Check that the document is written into a byte buffer
+        '''
+        print '('+self.test_dump_buffer.__name__+')', \
+              self.test_dump_buffer.__doc__
+        envelope = {'items': render.Stream(({'id': i} for i in xrange(3)), 2)}
+        buffer = io.BytesIO()
+        render.dump(envelope, buffer)
+        self.assertEquals(json.loads(buffer.getvalue()),
+                          {'items': [{'id': 0}, {'id': 1}, {'id': 2}]})
+
+if __name__ == '__main__':
+    print 'Start running tests'
+    unittest.main()